@@ -0,0 +1,68 @@
+import resource
+import sys
+import time
+import numpy
+from broadcasting.vector_quantisation import nearest_codes as plain_nearest_codes
+from fancy_indexing_and_index_tricks.mandelbrot_engine import mandelbrot as plain_mandelbrot
+from tricks_and_tips import hot_paths
+from tricks_and_tips.arena import ScratchArena
+
+
+def _loop(work, iterations):
+    # wall time and minor page faults of a steady-state loop (after one warm-up call)
+    work()
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    start = time.time()
+    for i in range(iterations):
+        work()
+    return time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+
+
+def _paths(side, arena):
+    rng = numpy.random.RandomState(0)
+    a, b = rng.uniform(size=side * 4), rng.uniform(size=side * 4)
+    observations, codes = rng.normal(size=(side * side, 4)), rng.normal(size=(64, 4))
+    out = numpy.empty((side, side), dtype=int)
+
+    def arena_outer():
+        with arena:
+            hot_paths.outer_add(a, b, arena)
+
+    def arena_nearest():
+        with arena:
+            hot_paths.nearest_codes(observations, codes, arena)
+
+    return [('mandelbrot', lambda: plain_mandelbrot(side, side, maxit=30),
+             lambda: hot_paths.mandelbrot(side, side, arena, maxit=30, out=out)),
+            ('outer_add', lambda: a[:, numpy.newaxis] + b, arena_outer),
+            ('nearest_codes', lambda: plain_nearest_codes(observations, codes), arena_nearest)]
+
+
+def run(sides=(64, 256, 1024), iterations=20):
+    """Fresh temporaries against arena buffers for each hot path, in a steady-state loop."""
+    rows = []
+    for side in sides:
+        arena = ScratchArena()
+        for name, plain, pooled in _paths(side, arena):
+            plain_s, plain_faults = _loop(plain, iterations)
+            pooled()
+            misses = arena.misses
+            arena_s, arena_faults = _loop(pooled, iterations)
+            rows.append({'path': name, 'side': side, 'plain_s': plain_s,
+                         'plain_faults': plain_faults, 'arena_s': arena_s,
+                         'arena_faults': arena_faults,
+                         'steady_misses': arena.misses - misses})
+        rows[-1]['arena_bytes'] = arena.stats()['allocated_bytes']
+    return rows
+
+
+def main():
+    sys.stdout.write("%14s %6s %10s %12s %10s %12s %14s\n" % (
+        'path', 'side', 'plain_s', 'plain_faults', 'arena_s', 'arena_faults', 'steady_misses'))
+    for row in run():
+        sys.stdout.write("%(path)14s %(side)6d %(plain_s)10.4f %(plain_faults)12d "
+                         "%(arena_s)10.4f %(arena_faults)12d %(steady_misses)14d\n" % row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import sys
+import timeit
+import numpy
+from shape_manipulation.array_builder import ArrayBuilder
+
+# The ingestion loop being replaced: one record arrives at a time and is
+# stacked onto everything collected so far.
+
+
+def build_with_vstack(records):
+    result = records[0][numpy.newaxis]
+    for record in records[1:]:
+        result = numpy.vstack((result, record))
+    return result
+
+
+def build_with_list(records):
+    collected = []
+    for record in records:
+        collected.append(record)
+    return numpy.array(collected)
+
+
+def build_with_builder(records):
+    builder = ArrayBuilder(dtype=records[0].dtype)
+    for record in records:
+        builder.append(record)
+    return builder.finalize()
+
+
+def run(sizes=(10**3, 10**4, 10**5, 10**6, 10**7), width=4, vstack_limit=10**4, repeat=3):
+    """Time appending `sizes` rows one at a time with vstack, a list and ArrayBuilder.
+
+    Repeated vstack is quadratic, so it is skipped (None) above vstack_limit rows.
+    """
+    rows = []
+    for n in sizes:
+        records = list(numpy.random.RandomState(0).uniform(size=(n, width)))
+        builder = min(timeit.repeat(lambda: build_with_builder(records), number=1, repeat=repeat))
+        listed = min(timeit.repeat(lambda: build_with_list(records), number=1, repeat=repeat))
+        vstack = None
+        if n <= vstack_limit:
+            vstack = min(timeit.repeat(lambda: build_with_vstack(records), number=1, repeat=repeat))
+        rows.append({'rows': n, 'builder_s': builder, 'list_s': listed, 'vstack_s': vstack,
+                     'speedup': vstack / builder if vstack is not None else None})
+    return rows
+
+
+def main():
+    sys.stdout.write("%10s %10s %10s %10s %8s\n" % ('rows', 'builder_s', 'list_s', 'vstack_s',
+                                                   'speedup'))
+    for row in run():
+        if row['vstack_s'] is None:
+            sys.stdout.write("%10d %10.4f %10.4f %10s %8s\n" % (row['rows'], row['builder_s'],
+                                                               row['list_s'], '-', '-'))
+        else:
+            sys.stdout.write("%(rows)10d %(builder_s)10.4f %(list_s)10.4f %(vstack_s)10.4f "
+                             "%(speedup)8.1f\n" % row)
+
+
+if __name__ == "__main__":
+    main()
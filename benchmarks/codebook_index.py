@@ -0,0 +1,48 @@
+import sys
+import timeit
+import numpy
+from broadcasting.codebook_index import CodebookIndex
+
+
+def broadcast_nearest(observations, codes, block_bytes=1 << 26):
+    # the tutorial's codes - observation broadcast, chunked so each (chunk, K, d)
+    # difference stays within block_bytes however large the codebook is
+    chunk_size = max(block_bytes // codes.nbytes, 1)
+    index = numpy.empty(observations.shape[0], dtype=numpy.intp)
+    for start in range(0, observations.shape[0], chunk_size):
+        block = observations[start:start + chunk_size]
+        diff = codes[numpy.newaxis, :, :] - block[:, numpy.newaxis, :]
+        index[start:start + chunk_size] = numpy.sum(diff**2, axis=-1).argmin(axis=1)
+    return index
+
+
+def run(dims=(2, 4, 8, 16, 32, 64), n_codes=20000, n_queries=2000, leaf_size=32, repeat=3,
+        seed=0):
+    """Time brute-force broadcasting against CodebookIndex queries for each dimensionality."""
+    rng = numpy.random.RandomState(seed)
+    rows = []
+    for d in dims:
+        codes = rng.normal(size=(n_codes, d))
+        observations = rng.normal(size=(n_queries, d))
+        build = min(timeit.repeat(lambda: CodebookIndex(codes, leaf_size), number=1,
+                                  repeat=repeat))
+        index = CodebookIndex(codes, leaf_size)
+        brute = min(timeit.repeat(lambda: broadcast_nearest(observations, codes), number=1,
+                                  repeat=repeat))
+        tree = min(timeit.repeat(lambda: index.query(observations), number=1, repeat=repeat))
+        rows.append({'d': d, 'build_s': build, 'broadcast_s': brute, 'index_s': tree,
+                     'speedup': brute / tree})
+    return rows
+
+
+def main():
+    rows = run()
+    sys.stdout.write("%4s %10s %12s %10s %8s\n" % ('d', 'build_s', 'broadcast_s', 'index_s',
+                                                  'speedup'))
+    for row in rows:
+        sys.stdout.write("%(d)4d %(build_s)10.4f %(broadcast_s)12.4f %(index_s)10.4f "
+                         "%(speedup)8.2f\n" % row)
+
+
+if __name__ == "__main__":
+    main()
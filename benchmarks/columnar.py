@@ -0,0 +1,45 @@
+import sys
+import timeit
+import numpy
+from fancy_indexing_and_index_tricks.columnar import ColumnarArray
+
+RGB = [('r', 'float32'), ('g', 'float32'), ('b', 'float32')]
+
+
+def channel_reductions(channel):
+    return channel.sum(), channel.min(), channel.max()
+
+
+def run(sizes=(256, 1024, 4096), repeat=5, seed=0):
+    """Time per-channel sum/min/max over square RGB images in each layout."""
+    rng = numpy.random.RandomState(seed)
+    rows = []
+    for n in sizes:
+        structured = numpy.empty((n, n), RGB)
+        for name, _ in RGB:
+            structured[name] = rng.uniform(size=(n, n))
+        records = structured.view(numpy.recarray)
+        columnar = ColumnarArray.from_structured(structured)
+        layouts = [('structured', lambda: [channel_reductions(structured[name])
+                                           for name in ('r', 'g', 'b')]),
+                   ('recarray', lambda: [channel_reductions(getattr(records, name))
+                                         for name in ('r', 'g', 'b')]),
+                   ('columnar', lambda: [channel_reductions(getattr(columnar, name))
+                                         for name in ('r', 'g', 'b')])]
+        row = {'pixels': n * n}
+        for name, work in layouts:
+            row[name + '_s'] = min(timeit.repeat(work, number=1, repeat=repeat))
+        rows.append(row)
+    return rows
+
+
+def main():
+    sys.stdout.write("%10s %14s %12s %12s\n" % ('pixels', 'structured_s', 'recarray_s',
+                                                'columnar_s'))
+    for row in run():
+        sys.stdout.write("%(pixels)10d %(structured_s)14.5f %(recarray_s)12.5f "
+                         "%(columnar_s)12.5f\n" % row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import sys
+import timeit
+import tracemalloc
+import numpy
+from the_basics import precision
+from the_basics.construction import arange, exp, linspace
+
+
+def pipeline(n):
+    """A sensor-style chain: integer counts scaled by a float ramp, phase rotated, summed."""
+    counts = arange(n) % 4096
+    ramp = linspace(0, numpy.pi, n)
+    scaled = precision.apply(numpy.multiply, counts, ramp)
+    phase = exp(precision.apply(numpy.multiply, ramp, 1j))
+    signal = precision.apply(numpy.absolute, precision.apply(numpy.multiply, scaled, phase))
+    return precision.policy_sum(signal), precision.policy_cumsum(signal)[-1]
+
+
+def run(sizes=(10 ** 4, 10 ** 6, 10 ** 7), policies=('default', 'lean'), repeat=3):
+    """Time the pipeline and its tracemalloc peak under each dtype policy."""
+    rows = []
+    for n in sizes:
+        for name in policies:
+            with precision.policy(name):
+                precision.clear_escapes()
+                seconds = min(timeit.repeat(lambda: pipeline(n), number=1, repeat=repeat))
+                tracemalloc.start()
+                total, last = pipeline(n)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                escapes = sum(row['count'] for row in precision.escape_report())
+            rows.append({'policy': name, 'size': n, 'seconds': seconds,
+                         'elements_per_s': n / seconds, 'peak_bytes': peak,
+                         'sum': float(total), 'escapes': escapes})
+    return rows
+
+
+def main():
+    sys.stdout.write("%8s %10s %10s %14s %12s %18s %8s\n" % (
+        'policy', 'size', 'seconds', 'elements/s', 'peak_MiB', 'sum', 'escapes'))
+    for row in run():
+        sys.stdout.write("%8s %10d %10.4f %14.3g %12.2f %18.6g %8d\n" % (
+            row['policy'], row['size'], row['seconds'], row['elements_per_s'],
+            row['peak_bytes'] / 2. ** 20, row['sum'], row['escapes']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import sys
+import timeit
+import numpy
+from linear_algebra.sparse import from_triplets, solve
+
+
+def system(n, per_row=5, seed=0):
+    """A strictly diagonally dominant symmetric n x n matrix with about per_row entries per row."""
+    rng = numpy.random.RandomState(seed)
+    rows = rng.randint(0, n, size=n * (per_row - 1) // 2)
+    cols = rng.randint(0, n, size=rows.size)
+    off = rows != cols
+    rows, cols = rows[off], cols[off]
+    values = -rng.uniform(size=rows.size)
+    # each diagonal entry exceeds the absolute sum of the rest of its row by 1
+    i = numpy.arange(n)
+    diagonal = (numpy.bincount(rows, -values, minlength=n) +
+                numpy.bincount(cols, -values, minlength=n) + 1)
+    return from_triplets(numpy.concatenate([rows, cols, i]), numpy.concatenate([cols, rows, i]),
+                         numpy.concatenate([values, values, diagonal]), shape=(n, n))
+
+
+def run(sizes=(1000, 4000, 100000), dense_limit=4000, repeat=3):
+    """Memory, matrix-vector and solve times of the sparse path against dense numpy.
+
+    The dense path is skipped above dense_limit (n * n doubles stop fitting).
+    """
+    rows = []
+    for n in sizes:
+        a = system(n)
+        b = numpy.random.RandomState(1).normal(size=n)
+        row = {'n': n, 'nnz': a.nnz, 'sparse_bytes': a.nbytes,
+               'sparse_matvec_s': min(timeit.repeat(lambda: a.dot(b), number=1, repeat=repeat)),
+               'sparse_solve_s': min(timeit.repeat(lambda: solve(a, b), number=1, repeat=repeat)),
+               'dense_bytes': n * n * 8, 'dense_matvec_s': None, 'dense_solve_s': None}
+        if n <= dense_limit:
+            dense = a.toarray()
+            row['dense_matvec_s'] = min(timeit.repeat(lambda: dense.dot(b), number=1,
+                                                      repeat=repeat))
+            row['dense_solve_s'] = min(timeit.repeat(lambda: numpy.linalg.solve(dense, b),
+                                                     number=1, repeat=repeat))
+        rows.append(row)
+    return rows
+
+
+def _seconds(value):
+    return '%12s' % '-' if value is None else '%12.5f' % value
+
+
+def main():
+    sys.stdout.write("%8s %8s %12s %12s %12s %12s %12s %12s\n" % (
+        'n', 'nnz', 'sparse_MiB', 'dense_MiB', 'sp_matvec', 'de_matvec', 'sp_solve', 'de_solve'))
+    for row in run():
+        sys.stdout.write("%8d %8d %12.3f %12.3f %s %s %s %s\n" % (
+            row['n'], row['nnz'], row['sparse_bytes'] / 2. ** 20, row['dense_bytes'] / 2. ** 20,
+            _seconds(row['sparse_matvec_s']), _seconds(row['dense_matvec_s']),
+            _seconds(row['sparse_solve_s']), _seconds(row['dense_solve_s'])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Benchmarks of every tutorial subsystem over a sweep of sizes and dtypes.
+
+    python -m benchmarks.suite run -o results.json
+    python -m benchmarks.suite compare before.json after.json
+"""
+import argparse
+import fnmatch
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+import unittest
+import numpy
+from broadcasting.vector_quantisation import nearest_codes
+from fancy_indexing_and_index_tricks.mandelbrot_engine import mandelbrot
+from linear_algebra.batched import solve_batched
+
+SIZES = (10 ** 4, 10 ** 6)
+DTYPES = ('float32', 'float64')
+
+
+def _random(n, dtype, seed=0):
+    return numpy.random.RandomState(seed).uniform(size=n).astype(dtype)
+
+
+def _side(n):
+    return max(int(round(n ** 0.5)), 2)
+
+
+# Each case prepares its inputs for (size, dtype) and returns (work, bytes)
+# where work() is what is timed and bytes is the data it reads, for bytes/s.
+
+def basics_ufuncs(n, dtype):
+    a = numpy.arange(n, dtype=dtype).reshape(-1, 10)
+    return (lambda: numpy.exp(numpy.sin(a)).sum(axis=0)), a.nbytes
+
+
+def broadcast_outer_add(n, dtype):
+    side = _side(n)
+    a, b = _random(side, dtype), _random(side, dtype, 1)
+    return (lambda: a[:, numpy.newaxis] + b), a.nbytes + b.nbytes
+
+
+def broadcast_nearest_code(n, dtype):
+    observations = _random(n, dtype).reshape(-1, 4)
+    codes = _random(64 * 4, dtype, 1).reshape(64, 4)
+    return (lambda: nearest_codes(observations, codes)), observations.nbytes + codes.nbytes
+
+
+def copy_of_transpose(n, dtype):
+    side = _side(n)
+    a = _random(side * side, dtype).reshape(side, side)
+    return (lambda: a.T.copy()), a.nbytes
+
+
+def fancy_gather(n, dtype):
+    a = _random(n, dtype)
+    index = numpy.random.RandomState(1).randint(0, n, size=n)
+    return (lambda: a[index]), a.nbytes + index.nbytes
+
+
+def boolean_mask(n, dtype):
+    a = _random(n, dtype)
+    return (lambda: a[a > 0.5]), a.nbytes
+
+
+def mandelbrot_active(n, dtype):
+    side = _side(n)
+    return (lambda: mandelbrot(side, side, maxit=20)), side * side * 16
+
+
+def mandelbrot_reference(n, dtype):
+    side = _side(n)
+    return (lambda: mandelbrot(side, side, maxit=20, engine='reference')), side * side * 16
+
+
+def record_array_channels(n, dtype):
+    rgb = numpy.zeros(n // 3, [('r', dtype), ('g', dtype), ('b', dtype)])
+    records = rgb.view(numpy.recarray)
+    return (lambda: (records.r.sum(), records.g.max(), records.b.min())), rgb.nbytes
+
+
+def stack_and_split(n, dtype):
+    side = _side(n)
+    a = _random(side * side, dtype).reshape(side, side)
+    return (lambda: numpy.hsplit(numpy.vstack([a, a]), 2)), a.nbytes
+
+
+def dense_solve(n, dtype):
+    side = min(_side(n), 2000)
+    a = _random(side * side, dtype).reshape(side, side) + side * numpy.eye(side, dtype=dtype)
+    b = _random(side, dtype, 1)
+    return (lambda: numpy.linalg.solve(a, b)), a.nbytes + b.nbytes
+
+
+def dense_eig(n, dtype):
+    side = min(_side(n), 300)
+    a = _random(side * side, dtype).reshape(side, side)
+    return (lambda: numpy.linalg.eig(a)), a.nbytes
+
+
+def batched_solve(n, dtype):
+    a = _random(n // 9 * 9, dtype).reshape(-1, 3, 3) + 3 * numpy.eye(3, dtype=dtype)
+    b = _random(len(a) * 3, dtype, 1).reshape(-1, 3)
+    return (lambda: solve_batched(a, b)), a.nbytes + b.nbytes
+
+
+# (name, subsystem, prepare, dtypes) - dtypes None means the case has a fixed dtype
+CASES = [
+    ('ufunc_chain', 'the_basics', basics_ufuncs, DTYPES),
+    ('outer_add', 'broadcasting', broadcast_outer_add, DTYPES),
+    ('nearest_code', 'broadcasting', broadcast_nearest_code, DTYPES),
+    ('transpose_copy', 'copies_and_views', copy_of_transpose, DTYPES),
+    ('fancy_gather', 'fancy_indexing_and_index_tricks', fancy_gather, DTYPES),
+    ('boolean_mask', 'fancy_indexing_and_index_tricks', boolean_mask, DTYPES),
+    ('mandelbrot_active', 'fancy_indexing_and_index_tricks', mandelbrot_active, None),
+    ('mandelbrot_reference', 'fancy_indexing_and_index_tricks', mandelbrot_reference, None),
+    ('record_channels', 'fancy_indexing_and_index_tricks', record_array_channels, DTYPES),
+    ('stack_split', 'shape_manipulation', stack_and_split, DTYPES),
+    ('solve', 'linear_algebra', dense_solve, DTYPES),
+    ('eig', 'linear_algebra', dense_eig, DTYPES),
+    ('solve_batched_3x3', 'linear_algebra', batched_solve, ('float64',)),
+]
+
+
+def measure(work, nbytes, repeat):
+    seconds = min(timeit.repeat(work, number=1, repeat=repeat))
+    tracemalloc.start()
+    try:
+        work()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak, 'bytes_per_s': nbytes / seconds}
+
+
+def run(sizes=SIZES, dtypes=DTYPES, only='*', repeat=3):
+    """One result row per (case, size, dtype) whose name matches the glob only."""
+    rows = []
+    for name, subsystem, prepare, case_dtypes in CASES:
+        if not fnmatch.fnmatch(name, only) and not fnmatch.fnmatch(subsystem, only):
+            continue
+        sweep = [None] if case_dtypes is None else [d for d in case_dtypes if d in dtypes]
+        for size in sizes:
+            for dtype in sweep:
+                work, nbytes = prepare(size, dtype or 'float64')
+                row = {'case': name, 'subsystem': subsystem, 'size': size, 'dtype': dtype or '-'}
+                row.update(measure(work, nbytes, repeat))
+                rows.append(row)
+    return rows
+
+
+def _key(row):
+    return row['case'], row['size'], row['dtype']
+
+
+def compare(before, after, threshold=0.2):
+    """Rows present in both result sets, with time/memory ratios and regression flags.
+
+    A case regresses when it is more than threshold (a fraction) slower or
+    peaks higher than before.
+    """
+    old = dict((_key(row), row) for row in before['results'])
+    rows = []
+    for row in after['results']:
+        previous = old.get(_key(row))
+        if previous is None:
+            continue
+        time_ratio = row['seconds'] / previous['seconds']
+        memory_ratio = (row['peak_bytes'] / float(previous['peak_bytes'])
+                        if previous['peak_bytes'] else 1.)
+        rows.append({'case': row['case'], 'size': row['size'], 'dtype': row['dtype'],
+                     'time_ratio': time_ratio, 'memory_ratio': memory_ratio,
+                     'slower': time_ratio > 1 + threshold,
+                     'bigger': memory_ratio > 1 + threshold})
+    return rows
+
+
+def _metadata():
+    return {'numpy': numpy.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the sweep and write JSON results')
+    run_parser.add_argument('-o', '--output', help='results file (default: print only)')
+    run_parser.add_argument('--sizes', type=lambda s: int(float(s)), nargs='+', default=SIZES)
+    run_parser.add_argument('--dtypes', nargs='+', default=DTYPES)
+    run_parser.add_argument('--only', default='*', help='glob on case or subsystem names')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    compare_parser = commands.add_parser('compare', help='flag regressions between two runs')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        rows = run(args.sizes, args.dtypes, args.only, args.repeat)
+        sys.stdout.write("%-22s %10s %8s %10s %12s %12s\n" % ('case', 'size', 'dtype', 'seconds',
+                                                            'peak_MiB', 'MB/s'))
+        for row in rows:
+            sys.stdout.write("%-22s %10d %8s %10.5f %12.2f %12.1f\n" % (
+                row['case'], row['size'], row['dtype'], row['seconds'],
+                row['peak_bytes'] / 2. ** 20, row['bytes_per_s'] / 1e6))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'meta': _metadata(), 'results': rows}, f, indent=1)
+        return 0
+    if args.command == 'compare':
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        rows = compare(before, after, args.threshold)
+        sys.stdout.write("%-22s %10s %8s %8s %8s  %s\n" % ('case', 'size', 'dtype', 'time',
+                                                         'memory', 'regression'))
+        for row in rows:
+            flags = [label for label, bad in (('slower', row['slower']),
+                                              ('bigger', row['bigger'])) if bad]
+            sys.stdout.write("%-22s %10d %8s %7.2fx %7.2fx  %s\n" % (
+                row['case'], row['size'], row['dtype'], row['time_ratio'], row['memory_ratio'],
+                ', '.join(flags)))
+        return 1 if any(row['slower'] or row['bigger'] for row in rows) else 0
+    parser.print_help()
+    return 2
+
+
+class SuiteTest(unittest.TestCase):
+
+    def test_every_case_runs(self):
+        rows = run(sizes=(100,), repeat=1)
+        expected = sum(1 if dtypes is None else len(dtypes) for name, subsystem, prepare, dtypes
+                       in CASES)
+        self.assertEqual(len(rows), expected)
+        self.assertTrue(all(row['seconds'] > 0 for row in rows))
+
+    def test_compare_flags_regressions(self):
+        before = {'results': run(sizes=(100,), only='solve_batched*', repeat=1)}
+        after = {'results': [dict(row, seconds=row['seconds'] * 2) for row in before['results']]}
+        rows = compare(before, after)
+        self.assertEqual([(row['slower'], row['bigger']) for row in rows], [(True, False)])
+        self.assertEqual(compare(before, before)[0]['time_ratio'], 1.)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
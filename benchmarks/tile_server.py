@@ -0,0 +1,105 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+from fancy_indexing_and_index_tricks.tile_server import (Client, TileCache, TileKey, TileServer,
+                                                         compute_tile)
+
+
+def _workload(requests, zoom, maxit, skew, seed=0):
+    # tile requests with Zipf-like popularity: a few hot tiles, a long tail
+    rng = numpy.random.RandomState(seed)
+    side = 1 << zoom
+    ranks = numpy.arange(1, side * side + 1, dtype=float) ** -skew
+    picks = rng.choice(side * side, size=requests, p=ranks / ranks.sum())
+    order = rng.permutation(side * side)
+    return [TileKey(zoom, int(order[p] % side), int(order[p] // side), maxit) for p in picks]
+
+
+async def _load(server, keys, clients, unix_path):
+    host, port = server.address[:2] if unix_path is None else (None, None)
+    latencies = []
+    queue = list(reversed(keys))
+
+    async def worker():
+        client = Client(host, port, unix_path)
+        try:
+            while queue:
+                key = queue.pop()
+                start = time.time()
+                await client.tile(*key)
+                latencies.append(time.time() - start)
+        finally:
+            await client.close()
+
+    start = time.time()
+    await asyncio.gather(*[worker() for i in range(clients)])
+    return time.time() - start, latencies
+
+
+def _row(phase, seconds, latencies, before=None, after=None):
+    p50, p99 = numpy.percentile(latencies, [50, 99])
+    row = {'phase': phase, 'requests': len(latencies), 'seconds': seconds,
+           'per_s': len(latencies) / seconds, 'p50_ms': p50 * 1e3, 'p99_ms': p99 * 1e3,
+           'hit_rate': float('nan'), 'computed': len(latencies), 'coalesced': 0}
+    if after is not None:
+        # server counters are cumulative; report this phase's share
+        delta = dict((name, after[name] - before[name]) for name in
+                     ('memory_hits', 'disk_hits', 'misses', 'computed', 'coalesced'))
+        hits = delta['memory_hits'] + delta['disk_hits']
+        lookups = hits + delta['misses'] + delta['coalesced']
+        row.update(hit_rate=hits / float(lookups), computed=delta['computed'],
+                   coalesced=delta['coalesced'])
+    return row
+
+
+def run(requests=400, clients=16, zoom=3, maxit=50, tile_size=128, skew=1.1,
+        processes=None, unix=False):
+    """Recomputing every request against the server, cold (empty cache) and then warm."""
+    keys = _workload(requests, zoom, maxit, skew)
+    rows = []
+    latencies = []
+    start = time.time()
+    for key in keys:
+        t = time.time()
+        compute_tile(key, tile_size)
+        latencies.append(time.time() - t)
+    rows.append(_row('recompute', time.time() - start, latencies))
+
+    tmp = tempfile.mkdtemp()
+    unix_path = os.path.join(tmp, 'tiles.sock') if unix else None
+
+    async def serve():
+        server = TileServer(TileCache(directory=os.path.join(tmp, 'disk')),
+                            processes=processes, tile_size=tile_size)
+        await server.start(port=0, unix_path=unix_path)
+        try:
+            for phase in ('cold', 'warm'):
+                before = server.metrics()
+                seconds, latencies = await _load(server, keys, clients, unix_path)
+                rows.append(_row(phase, seconds, latencies, before, server.metrics()))
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        shutil.rmtree(tmp)
+    return rows
+
+
+def main():
+    unix = '--unix' in sys.argv[1:]
+    sys.stdout.write("%10s %9s %9s %10s %9s %9s %9s %9s %10s\n" % (
+        'phase', 'requests', 'seconds', 'req/s', 'p50_ms', 'p99_ms', 'hit_rate', 'computed',
+        'coalesced'))
+    for row in run(unix=unix):
+        sys.stdout.write("%(phase)10s %(requests)9d %(seconds)9.3f %(per_s)10.1f %(p50_ms)9.2f "
+                         "%(p99_ms)9.2f %(hit_rate)9.2f %(computed)9d %(coalesced)10d\n" % row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import unittest
+import numpy
+
+# bound on the temporaries built for one slice of (query, leaf) pairs
+PAIR_BYTES = 1 << 25
+
+
+class CodebookIndex(object):
+    """KD-tree over a codebook for repeated nearest-code queries.
+
+    The tree is held in flat arrays (one row per node), and queries walk it
+    level by level for a whole batch of observations at once.
+    """
+
+    def __init__(self, codes, leaf_size=32):
+        self.codes = numpy.ascontiguousarray(codes, dtype=float)
+        if self.codes.ndim != 2 or self.codes.shape[0] == 0:
+            raise ValueError("codes must be a non-empty (K, d) array")
+        if leaf_size < 1:
+            raise ValueError("leaf_size must be at least 1, got %r" % (leaf_size,))
+        self.leaf_size = leaf_size
+        self._build()
+
+    def _build(self):
+        n, d = self.codes.shape
+        max_nodes = 2 * -(-n // self.leaf_size) * 2 + 1
+        start = numpy.zeros(max_nodes, dtype=numpy.intp)
+        end = numpy.zeros(max_nodes, dtype=numpy.intp)
+        left = -numpy.ones(max_nodes, dtype=numpy.intp)
+        right = -numpy.ones(max_nodes, dtype=numpy.intp)
+        split_dim = numpy.zeros(max_nodes, dtype=numpy.intp)
+        split_val = numpy.zeros(max_nodes)
+        lo = numpy.zeros((max_nodes, d))
+        hi = numpy.zeros((max_nodes, d))
+        order = numpy.arange(n)
+
+        count = 1
+        start[0], end[0] = 0, n
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            members = self.codes[order[start[node]:end[node]]]
+            lo[node] = members.min(axis=0)
+            hi[node] = members.max(axis=0)
+            size = end[node] - start[node]
+            if size <= self.leaf_size:
+                continue
+            dim = numpy.argmax(hi[node] - lo[node])
+            half = size // 2
+            part = numpy.argpartition(members[:, dim], half)
+            order[start[node]:end[node]] = order[start[node]:end[node]][part]
+            split_dim[node] = dim
+            split_val[node] = members[part[half], dim]
+            left[node], right[node] = count, count + 1
+            start[count], end[count] = start[node], start[node] + half
+            start[count + 1], end[count + 1] = start[node] + half, end[node]
+            stack.extend((count, count + 1))
+            count += 2
+
+        self._left, self._right = left[:count], right[:count]
+        self._split_dim, self._split_val = split_dim[:count], split_val[:count]
+        self._lo, self._hi = lo[:count], hi[:count]
+        # leaves padded to leaf_size code indices, -1 marks padding
+        leaves = numpy.flatnonzero(self._left < 0)
+        self._leaf_of_node = -numpy.ones(count, dtype=numpy.intp)
+        self._leaf_of_node[leaves] = numpy.arange(leaves.size)
+        offsets = numpy.arange(self.leaf_size)
+        positions = start[leaves, numpy.newaxis] + offsets
+        self._leaf_points = numpy.where(positions < end[leaves, numpy.newaxis],
+                                        order[numpy.minimum(positions, n - 1)], -1)
+
+    def _descend(self, x):
+        node = numpy.zeros(x.shape[0], dtype=numpy.intp)
+        inner = self._left[node] >= 0
+        while inner.any():
+            q = numpy.flatnonzero(inner)
+            nq = node[q]
+            go_right = x[q, self._split_dim[nq]] >= self._split_val[nq]
+            node[q] = numpy.where(go_right, self._right[nq], self._left[nq])
+            inner = self._left[node] >= 0
+        return self._leaf_of_node[node]
+
+    def _leaf_distances(self, x, queries, leaves):
+        points = self._leaf_points[leaves]
+        diff = self.codes[numpy.maximum(points, 0)] - x[queries, numpy.newaxis, :]
+        dist = numpy.einsum('ijk,ijk->ij', diff, diff)
+        dist[points < 0] = numpy.inf
+        return points, dist
+
+    def _merge(self, best_idx, best_dist, queries, points, dist):
+        k = best_idx.shape[1]
+        nq = best_idx.shape[0]
+        q = numpy.concatenate((numpy.repeat(numpy.arange(nq), k),
+                               numpy.repeat(queries, points.shape[1])))
+        idx = numpy.concatenate((best_idx.ravel(), points.ravel()))
+        dist = numpy.concatenate((best_dist.ravel(), dist.ravel()))
+        ordered = numpy.lexsort((dist, q))
+        q, idx, dist = q[ordered], idx[ordered], dist[ordered]
+        rank = numpy.arange(q.size) - numpy.searchsorted(q, q)
+        keep = rank < k
+        best_idx[q[keep], rank[keep]] = idx[keep]
+        best_dist[q[keep], rank[keep]] = dist[keep]
+
+    def _visit(self, x, home, best_idx, best_dist, queries, nodes):
+        gap = numpy.maximum(self._lo[nodes] - x[queries], 0)
+        gap += numpy.maximum(x[queries] - self._hi[nodes], 0)
+        near = numpy.einsum('ij,ij->i', gap, gap) < best_dist[queries, -1]
+        queries, nodes = queries[near], nodes[near]
+        leaf = self._leaf_of_node[nodes]
+        at_leaf = (leaf >= 0) & (leaf != home[queries])
+        if at_leaf.any():
+            lq = queries[at_leaf]
+            self._merge(best_idx, best_dist, lq, *self._leaf_distances(x, lq, leaf[at_leaf]))
+        inner = leaf < 0
+        children = numpy.column_stack((self._left[nodes[inner]], self._right[nodes[inner]]))
+        return numpy.repeat(queries[inner], 2), children.ravel()
+
+    def _query_chunk(self, x, k):
+        nq = x.shape[0]
+        best_idx = -numpy.ones((nq, k), dtype=numpy.intp)
+        best_dist = numpy.full((nq, k), numpy.inf)
+        home = self._descend(x)
+        queries = numpy.arange(nq)
+        self._merge(best_idx, best_dist, queries, *self._leaf_distances(x, queries, home))
+
+        # breadth-first over (query, node) pairs, dropping boxes beyond the current k-th distance;
+        # the frontier is visited in slices so a (pairs, leaf_size, d) difference stays bounded
+        step = max(PAIR_BYTES // (self.leaf_size * x.shape[1] * x.itemsize), 1)
+        queries = numpy.arange(nq)
+        nodes = numpy.zeros(nq, dtype=numpy.intp)
+        while queries.size:
+            children = [self._visit(x, home, best_idx, best_dist,
+                                    queries[at:at + step], nodes[at:at + step])
+                        for at in range(0, queries.size, step)]
+            queries = numpy.concatenate([c[0] for c in children])
+            nodes = numpy.concatenate([c[1] for c in children])
+        return best_idx, best_dist
+
+    def query(self, observations, k=1, chunk_size=1024):
+        """Index of and distance to the k nearest codes for every row of observations."""
+        x = numpy.atleast_2d(numpy.asarray(observations, dtype=float))
+        if x.shape[1] != self.codes.shape[1]:
+            raise ValueError("observations have %d features, codes have %d"
+                             % (x.shape[1], self.codes.shape[1]))
+        if not 1 <= k <= self.codes.shape[0]:
+            raise ValueError("k must be between 1 and %d" % self.codes.shape[0])
+        index = numpy.empty((x.shape[0], k), dtype=numpy.intp)
+        distance = numpy.empty((x.shape[0], k))
+        for start in range(0, x.shape[0], chunk_size):
+            stop = start + chunk_size
+            index[start:stop], distance[start:stop] = self._query_chunk(x[start:stop], k)
+        numpy.sqrt(distance, out=distance)
+        if k == 1:
+            index, distance = index[:, 0], distance[:, 0]
+        if numpy.asarray(observations).ndim == 1:
+            return index[0], distance[0]
+        return index, distance
+
+
+class CodebookIndexTest(unittest.TestCase):
+
+    def brute_force(self, observations, codes, k):
+        diff = codes[numpy.newaxis, :, :] - observations[:, numpy.newaxis, :]
+        dist = numpy.sqrt(numpy.sum(diff**2, axis=-1))
+        index = numpy.argsort(dist, axis=1)[:, :k]
+        return index, numpy.take_along_axis(dist, index, axis=1)
+
+    def test_tutorial_codebook(self):
+        codes = numpy.array([[102., 203.],
+                             [132., 193.],
+                             [45., 155.],
+                             [57., 173.]])
+        index, distance = CodebookIndex(codes, leaf_size=1).query(numpy.array([111., 188.]))
+        self.assertEqual(index, 0)
+        self.assertAlmostEqual(distance, numpy.sqrt(9.**2 + 15.**2))
+
+    def test_nearest_matches_brute_force(self):
+        rng = numpy.random.RandomState(0)
+        for d in (1, 2, 3, 7):
+            codes = rng.normal(size=(500, d))
+            observations = rng.normal(size=(300, d))
+            index, distance = CodebookIndex(codes, leaf_size=8).query(observations, chunk_size=64)
+            expected_index, expected_distance = self.brute_force(observations, codes, 1)
+            numpy.testing.assert_array_equal(index, expected_index[:, 0])
+            numpy.testing.assert_array_almost_equal(distance, expected_distance[:, 0])
+
+    def test_k_nearest_matches_brute_force(self):
+        rng = numpy.random.RandomState(1)
+        codes = rng.uniform(size=(400, 3))
+        observations = rng.uniform(size=(100, 3))
+        index, distance = CodebookIndex(codes, leaf_size=16).query(observations, k=5)
+        expected_index, expected_distance = self.brute_force(observations, codes, 5)
+        numpy.testing.assert_array_equal(index, expected_index)
+        numpy.testing.assert_array_almost_equal(distance, expected_distance)
+
+    def test_k_larger_than_leaf(self):
+        rng = numpy.random.RandomState(2)
+        codes = rng.normal(size=(50, 2))
+        index, distance = CodebookIndex(codes, leaf_size=4).query(codes[:10], k=50)
+        expected_index, expected_distance = self.brute_force(codes[:10], codes, 50)
+        numpy.testing.assert_array_almost_equal(distance, expected_distance)
+        numpy.testing.assert_array_equal(index[:, 0], numpy.arange(10))
+
+    def test_bad_queries(self):
+        index = CodebookIndex(numpy.zeros((4, 2)))
+        self.assertRaises(ValueError, index.query, numpy.zeros((3, 3)))
+        self.assertRaises(ValueError, index.query, numpy.zeros((3, 2)), 5)
+
+    def test_bad_leaf_size(self):
+        for leaf_size in (0, -1):
+            self.assertRaises(ValueError, CodebookIndex, numpy.zeros((4, 2)), leaf_size)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(CodebookIndexTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,5 +1,5 @@
 import unittest
-from numpy.ma.core import array, argmin
+from the_basics.construction import array, argmin
 import numpy
 from numpy.core.numeric import newaxis
 
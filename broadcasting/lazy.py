@@ -0,0 +1,399 @@
+import unittest
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import numpy
+
+# elements per block; a few hundred KiB per temporary keeps a block's working set in cache
+BLOCK_ELEMENTS = 1 << 15
+# compiled plans kept; beyond this the least recently used are dropped
+MAX_PLANS = 256
+
+
+class Expression(object):
+    """An elementwise/broadcast expression that is recorded rather than computed.
+
+    Operators on Expressions build a tree; evaluate() runs the whole tree one
+    cache-sized block at a time, so intermediate results only ever exist as
+    block-sized scratch and the one full-size array is the output.
+    """
+
+    def __init__(self, ufunc, args):
+        self.ufunc = ufunc
+        # arrays become leaves, Python/numpy scalars stay constants in the plan
+        self.args = tuple(arg if isinstance(arg, Expression) or numpy.isscalar(arg) else Leaf(arg)
+                          for arg in args)
+
+    def __add__(self, other):
+        return Expression(numpy.add, (self, other))
+
+    def __radd__(self, other):
+        return Expression(numpy.add, (other, self))
+
+    def __sub__(self, other):
+        return Expression(numpy.subtract, (self, other))
+
+    def __rsub__(self, other):
+        return Expression(numpy.subtract, (other, self))
+
+    def __mul__(self, other):
+        return Expression(numpy.multiply, (self, other))
+
+    def __rmul__(self, other):
+        return Expression(numpy.multiply, (other, self))
+
+    def __truediv__(self, other):
+        return Expression(numpy.true_divide, (self, other))
+
+    def __rtruediv__(self, other):
+        return Expression(numpy.true_divide, (other, self))
+
+    __div__, __rdiv__ = __truediv__, __rtruediv__
+
+    def __pow__(self, other):
+        # numpy computes a**2 with square; do the same so results are identical
+        if isinstance(other, (int, float)) and other == 2:
+            return Expression(numpy.square, (self,))
+        return Expression(numpy.power, (self, other))
+
+    def __rpow__(self, other):
+        return Expression(numpy.power, (other, self))
+
+    def __neg__(self):
+        return Expression(numpy.negative, (self,))
+
+    def __abs__(self):
+        return Expression(numpy.absolute, (self,))
+
+    def __lt__(self, other):
+        return Expression(numpy.less, (self, other))
+
+    def __le__(self, other):
+        return Expression(numpy.less_equal, (self, other))
+
+    def __gt__(self, other):
+        return Expression(numpy.greater, (self, other))
+
+    def __ge__(self, other):
+        return Expression(numpy.greater_equal, (self, other))
+
+    # & and | are bitwise, as on arrays (and the same as logical on booleans)
+    def __and__(self, other):
+        return Expression(numpy.bitwise_and, (self, other))
+
+    def __rand__(self, other):
+        return Expression(numpy.bitwise_and, (other, self))
+
+    def __or__(self, other):
+        return Expression(numpy.bitwise_or, (self, other))
+
+    def __ror__(self, other):
+        return Expression(numpy.bitwise_or, (other, self))
+
+    def __getitem__(self, index):
+        raise TypeError("only arrays wrapped by lazy() can be indexed, not expressions")
+
+    def leaves(self):
+        found = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Leaf):
+                if not any(node is other for other in found):
+                    found.append(node)
+            elif isinstance(node, Expression):
+                stack.extend(reversed(node.args))
+        return found
+
+    @property
+    def shape(self):
+        return numpy.broadcast_shapes(*[leaf.array.shape for leaf in self.leaves()])
+
+    def evaluate(self, out=None, block_elements=BLOCK_ELEMENTS, threads=None):
+        return evaluate(self, out, block_elements, threads)
+
+
+class Leaf(Expression):
+
+    def __init__(self, array):
+        Expression.__init__(self, None, ())
+        self.array = numpy.asarray(array)
+
+    def __getitem__(self, index):
+        return Leaf(self.array[index])
+
+
+def lazy(a):
+    """Wrap an array so that operations on it build an Expression."""
+    return a if isinstance(a, Expression) else Leaf(a)
+
+
+def apply(ufunc, *args):
+    """Record ufunc(*args), e.g. apply(numpy.sin, x)."""
+    return Expression(ufunc, args)
+
+
+class _Plan(object):
+    # Straight-line code for an expression: each step is (ufunc, operands, target)
+    # where operands are ('leaf', i), ('const', i) or ('reg', r) and target a
+    # scratch register, or None for the output block. Constants are numbered in
+    # the order _signature meets them and supplied at run time, so one plan
+    # serves every value of them.
+
+    def __init__(self, expression, leaves, constants):
+        positions = dict((id(leaf), i) for i, leaf in enumerate(leaves))
+        nodes = []
+        numbered = []
+
+        def visit(node):
+            if isinstance(node, Leaf):
+                return ('leaf', positions[id(node)])
+            if not isinstance(node, Expression):
+                numbered.append(node)
+                return ('const', len(numbered) - 1)
+            operands = [visit(arg) for arg in node.args]
+            nodes.append((node.ufunc, operands))
+            return ('node', len(nodes) - 1)
+
+        visit(expression)
+        # dtypes follow from running the nodes on empty arrays of the leaves' dtypes
+        samples = [numpy.empty(0, dtype=leaf.array.dtype) for leaf in leaves]
+        values = []
+        for ufunc, operands in nodes:
+            args = [values[value] if kind == 'node'
+                    else self._value((kind, value), samples, constants, None)
+                    for kind, value in operands]
+            values.append(ufunc(*args))
+        self.dtype = values[-1].dtype if values else leaves[0].array.dtype
+
+        # registers are recycled, per dtype, once the node they hold has been consumed
+        last_use = {}
+        for j, (ufunc, operands) in enumerate(nodes):
+            for kind, value in operands:
+                if kind == 'node':
+                    last_use[value] = j
+        free = {}
+        register_of = {}
+        self.register_dtypes = []
+        self.steps = []
+        for j, (ufunc, operands) in enumerate(nodes):
+            mapped = []
+            for kind, value in operands:
+                if kind == 'node':
+                    mapped.append(('reg', register_of[value]))
+                    if last_use[value] == j:
+                        free.setdefault(values[value].dtype, []).append(register_of[value])
+                else:
+                    mapped.append((kind, value))
+            target = None
+            if j < len(nodes) - 1:
+                spare = free.get(values[j].dtype)
+                if spare:
+                    target = spare.pop()
+                else:
+                    target = len(self.register_dtypes)
+                    self.register_dtypes.append(values[j].dtype)
+                register_of[j] = target
+            self.steps.append((ufunc, mapped, target))
+
+    @staticmethod
+    def _value(operand, leaves, constants, registers):
+        kind, value = operand
+        if kind == 'leaf':
+            return leaves[value]
+        if kind == 'reg':
+            return registers[value]
+        return constants[value]
+
+    def run(self, leaves, constants, out, scratch):
+        if not self.steps:
+            out[...] = leaves[0]
+        for ufunc, operands, target in self.steps:
+            args = [self._value(op, leaves, constants, scratch) for op in operands]
+            ufunc(*args, out=out if target is None else scratch[target])
+
+
+_plans = OrderedDict()
+
+
+def _signature(node, positions, constants):
+    # constants enter the signature by type only; their values go to constants
+    if isinstance(node, Leaf):
+        return 'L%d' % positions[id(node)]
+    if isinstance(node, Expression):
+        return '%s(%s)' % (node.ufunc.__name__,
+                           ','.join(_signature(arg, positions, constants) for arg in node.args))
+    constants.append(node)
+    return 'C:%s' % type(node).__name__
+
+
+def compile_expression(expression, shape):
+    """(plan, leaves, constants): the cached plan for expression's structure, dtypes and shape."""
+    leaves = expression.leaves()
+    positions = dict((id(leaf), i) for i, leaf in enumerate(leaves))
+    constants = []
+    key = (_signature(expression, positions, constants),
+           tuple(leaf.array.dtype.str for leaf in leaves), tuple(shape))
+    plan = _plans.pop(key, None)
+    if plan is None:
+        plan = _Plan(expression, leaves, constants)
+        if len(_plans) >= MAX_PLANS:
+            _plans.popitem(last=False)
+    _plans[key] = plan
+    return plan, leaves, constants
+
+
+def _blocks(shape, block_elements):
+    # split along the outermost axis whose trailing sub-array fits in a block
+    ndim = len(shape)
+    axis = ndim - 1
+    while axis > 0 and int(numpy.prod(shape[axis:])) <= block_elements:
+        axis -= 1
+    if ndim == 0:
+        return [()]
+    inner = int(numpy.prod(shape[axis + 1:]))
+    step = max(block_elements // max(inner, 1), 1)
+    blocks = []
+    for outer in numpy.ndindex(*shape[:axis]):
+        for lo in range(0, shape[axis], step):
+            blocks.append(outer + (slice(lo, min(lo + step, shape[axis])),))
+    return blocks
+
+
+def _leaf_array(leaf, shape, out):
+    # a leaf overlapping out at any other alignment would be read after earlier
+    # blocks had overwritten it, so it is copied first as numpy's ufuncs do
+    a = numpy.broadcast_to(leaf.array, shape)
+    if not numpy.may_share_memory(a, out):
+        return a
+    if (a.strides == out.strides and
+            a.__array_interface__['data'][0] == out.__array_interface__['data'][0]):
+        return a
+    return numpy.broadcast_to(leaf.array.copy(), shape)
+
+
+def evaluate(expression, out=None, block_elements=BLOCK_ELEMENTS, threads=None):
+    """Compute expression block by block into out (allocated if not given).
+
+    threads > 1 hands contiguous runs of blocks to a thread pool; numpy
+    releases the GIL inside the ufunc loops.
+    """
+    expression = lazy(expression)
+    shape = expression.shape
+    plan, leaves, constants = compile_expression(expression, shape)
+    if out is None:
+        out = numpy.empty(shape, dtype=plan.dtype)
+    elif out.shape != shape:
+        raise ValueError("out has shape %s, expected %s" % (out.shape, shape))
+    arrays = [_leaf_array(leaf, shape, out) for leaf in leaves]
+    blocks = _blocks(shape, block_elements)
+
+    def run(group):
+        scratch, scratch_shape = None, None
+        for index in group:
+            views = [a[index] for a in arrays]
+            target = out[index]
+            if scratch_shape != target.shape:
+                scratch_shape = target.shape
+                scratch = [numpy.empty(target.shape, dtype=dtype) for dtype in plan.register_dtypes]
+            plan.run(views, constants, target, scratch)
+
+    if threads is None or threads <= 1 or len(blocks) == 1:
+        run(blocks)
+    else:
+        per_thread = -(-len(blocks) // threads)
+        pool = ThreadPool(threads)
+        try:
+            pool.map(run, [blocks[i:i + per_thread] for i in range(0, len(blocks), per_thread)])
+        finally:
+            pool.close()
+            pool.join()
+    return out
+
+
+class LazyExpressionTest(unittest.TestCase):
+
+    def test_newaxis_addition(self):
+        a = numpy.array([0.0, 10.0, 20.0, 30.0])
+        b = numpy.array([1.0, 2.0, 3.0])
+        c = (lazy(a)[:, numpy.newaxis] + b).evaluate()
+        numpy.testing.assert_array_equal(c, a[:, numpy.newaxis] + b)
+
+    def test_mandelbrot_step_is_identical(self):
+        y, x = numpy.ogrid[-1.4:1.4:300j, -2:0.8:400j]
+        c = x + y*1j
+        z = c * (0.3 - 0.2j)
+        for threads in (None, 4):
+            result = evaluate(lazy(z)**2 + c, block_elements=1000, threads=threads)
+            numpy.testing.assert_array_equal(result, z**2 + c)
+
+    def test_long_chain_with_mixed_dtypes(self):
+        rng = numpy.random.RandomState(0)
+        a = rng.randint(0, 10, size=(50, 1))
+        b = rng.normal(size=(1, 70)).astype(numpy.float32)
+        c = rng.normal(size=70)
+        expected = (a * b - 2) / (abs(c) + 1) + apply_direct(a, b)
+        expression = (lazy(a) * b - 2) / (abs(lazy(c)) + 1) + apply(numpy.sin, lazy(a) * b)
+        numpy.testing.assert_array_almost_equal(expression.evaluate(block_elements=64), expected)
+        self.assertEqual(expression.evaluate().dtype, expected.dtype)
+
+    def test_out_target(self):
+        a = numpy.arange(12.).reshape(3, 4)
+        out = numpy.zeros((3, 4))
+        result = evaluate(2 * lazy(a) + 1, out=out, block_elements=4)
+        self.assertTrue(result is out)
+        numpy.testing.assert_array_equal(out, 2 * a + 1)
+        self.assertRaises(ValueError, evaluate, lazy(a) + 1, numpy.zeros(3))
+
+    def test_out_overlapping_a_leaf(self):
+        a = numpy.arange(10)
+        numpy.testing.assert_array_equal(evaluate(lazy(a)[::-1] + 1, out=a, block_elements=2),
+                                         numpy.arange(10, 0, -1))
+        b = numpy.arange(12.).reshape(3, 4)
+        expected = b + b[0]
+        evaluate(lazy(b) + lazy(b)[0], out=b, block_elements=4)
+        numpy.testing.assert_array_equal(b, expected)
+        c = numpy.arange(6.)
+        evaluate(2 * lazy(c), out=c, block_elements=2)
+        numpy.testing.assert_array_equal(c, 2 * numpy.arange(6.))
+
+    def test_comparison_and_plain_leaf(self):
+        a = numpy.arange(10)
+        numpy.testing.assert_array_equal(evaluate((lazy(a) > 4) & (lazy(a) < 8)), (a > 4) & (a < 8))
+        copy = evaluate(lazy(a))
+        numpy.testing.assert_array_equal(copy, a)
+        self.assertFalse(numpy.shares_memory(copy, a))
+
+    def test_plan_cache(self):
+        _plans.clear()
+        a, b = numpy.ones((4, 5)), numpy.ones(5)
+        evaluate(lazy(a) * b + 1)
+        evaluate(lazy(a * 2) * (b + 3) + 1)
+        self.assertEqual(len(_plans), 1)
+        evaluate(lazy(a.astype(numpy.float32)) * b + 1)
+        self.assertEqual(len(_plans), 2)
+        # constants are plan inputs: new values reuse the plan
+        for k in range(5):
+            numpy.testing.assert_array_equal(evaluate(lazy(a) * b + k), a * b + k)
+        self.assertEqual(len(_plans), 2)
+        evaluate(lazy(a) * b + 1.5)
+        self.assertEqual(len(_plans), 3)
+
+    def test_bitwise_operators(self):
+        a = numpy.array([1, 2, 3, 6])
+        numpy.testing.assert_array_equal(evaluate(lazy(a) & 3), a & 3)
+        numpy.testing.assert_array_equal(evaluate(lazy(a) | 8), a | 8)
+        numpy.testing.assert_array_equal(evaluate(5 & lazy(a)), 5 & a)
+        numpy.testing.assert_array_equal(evaluate(4 | lazy(a)), 4 | a)
+
+    def test_expressions_cannot_be_indexed(self):
+        self.assertRaises(TypeError, lambda: (lazy(numpy.ones(3)) + 1)[0])
+
+
+def apply_direct(a, b):
+    return numpy.sin(a * b)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(LazyExpressionTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
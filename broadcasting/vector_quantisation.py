@@ -0,0 +1,110 @@
+import unittest
+import numpy
+
+
+def nearest_codes(observations, codes, chunk_size=1024, return_distance=True,
+                  empty=numpy.empty):
+    """Index of (and distance to) the nearest code for every row of observations.
+
+    Uses |x - c|**2 = |x|**2 - 2 x.c + |c|**2 so each chunk of observations
+    costs one matrix product into a (chunk_size, K) buffer instead of an
+    (N, K, d) broadcast of differences. Every array the function needs,
+    results included, comes from empty(shape, dtype).
+    """
+    observations = numpy.asarray(observations)
+    codes = numpy.asarray(codes)
+    single = observations.ndim == 1
+    observations = numpy.atleast_2d(observations)
+    if observations.shape[1] != codes.shape[1]:
+        raise ValueError("observations have %d features, codes have %d"
+                         % (observations.shape[1], codes.shape[1]))
+    dtype = numpy.result_type(observations.dtype, codes.dtype, numpy.float32)
+    if observations.dtype != dtype:
+        cast = empty(observations.shape, dtype)
+        cast[...] = observations
+        observations = cast
+    codes_t = empty(codes.shape[::-1], dtype)
+    codes_t[...] = codes.T
+    code_sq = empty(codes.shape[0], dtype)
+    numpy.einsum('ij,ij->j', codes_t, codes_t, out=code_sq)
+
+    n = observations.shape[0]
+    rows = min(chunk_size, n)
+    index = empty(n, numpy.intp)
+    scores = empty((rows, codes.shape[0]), dtype)
+    if return_distance:
+        distance = empty(n, dtype)
+        norms = empty(rows, dtype)
+        # flat offset of each row of scores (0, k, 2k, ...) for gathering the winners,
+        # built in place by a cumsum so that it needs no storage beyond empty's
+        offsets, flat = empty(rows, numpy.intp), empty(rows, numpy.intp)
+        offsets[:1] = 0
+        offsets[1:] = codes.shape[0]
+        numpy.cumsum(offsets, out=offsets)
+    for start in range(0, n, chunk_size):
+        block = observations[start:start + chunk_size]
+        m = block.shape[0]
+        s = scores[:m]
+        # -2 x.c + |c|**2 ranks codes the same way as the full distance
+        numpy.dot(block, codes_t, out=s)
+        s *= -2
+        s += code_sq
+        s.argmin(axis=1, out=index[start:start + m])
+        if return_distance:
+            best = distance[start:start + m]
+            numpy.add(offsets[:m], index[start:start + m], out=flat[:m])
+            numpy.take(s.reshape(-1), flat[:m], out=best)
+            numpy.einsum('ij,ij->i', block, block, out=norms[:m])
+            best += norms[:m]
+            # cancellation can leave tiny negatives for exact matches
+            numpy.maximum(best, 0, out=best)
+            numpy.sqrt(best, out=best)
+
+    if single:
+        return (index[0], distance[0]) if return_distance else index[0]
+    return (index, distance) if return_distance else index
+
+
+class VectorQuantisationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codes = numpy.array([[102., 203.],
+                                  [132., 193.],
+                                  [45., 155.],
+                                  [57., 173.]])
+
+    def test_single_observation(self):
+        index, distance = nearest_codes(numpy.array([111., 188.]), self.codes)
+        self.assertEqual(index, 0)
+        self.assertAlmostEqual(distance, numpy.sqrt(9.**2 + 15.**2))
+
+    def test_matches_broadcasting(self):
+        rng = numpy.random.RandomState(0)
+        observations = rng.uniform(0, 250, (1001, 2))
+        diff = self.codes[numpy.newaxis, :, :] - observations[:, numpy.newaxis, :]
+        dist = numpy.sqrt(numpy.sum(diff**2, axis=-1))
+        index, distance = nearest_codes(observations, self.codes, chunk_size=64)
+        numpy.testing.assert_array_equal(index, dist.argmin(axis=1))
+        numpy.testing.assert_array_almost_equal(distance, dist.min(axis=1))
+
+    def test_index_only(self):
+        rng = numpy.random.RandomState(1)
+        codes = rng.normal(size=(300, 8))
+        observations = rng.normal(size=(500, 8))
+        index = nearest_codes(observations, codes, chunk_size=100, return_distance=False)
+        expected, _ = nearest_codes(observations, codes)
+        numpy.testing.assert_array_equal(index, expected)
+
+    def test_exact_match_has_zero_distance(self):
+        index, distance = nearest_codes(self.codes[::-1], self.codes)
+        numpy.testing.assert_array_equal(index, [3, 2, 1, 0])
+        numpy.testing.assert_array_almost_equal(distance, numpy.zeros(4))
+
+    def test_mismatched_features(self):
+        self.assertRaises(ValueError, nearest_codes, numpy.zeros((3, 3)), self.codes)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(VectorQuantisationTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
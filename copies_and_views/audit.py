@@ -0,0 +1,351 @@
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import numpy
+
+_NUMPY_DIR = os.path.dirname(numpy.__file__)
+
+
+def _root(a):
+    # the array that actually owns the memory a looks at
+    while isinstance(a.base, numpy.ndarray):
+        a = a.base
+    return a
+
+
+def _arrays(x):
+    if isinstance(x, numpy.ndarray):
+        return [x]
+    if isinstance(x, (list, tuple)):
+        return [a for item in x for a in _arrays(item)]
+    if isinstance(x, dict):
+        return [a for item in x.values() for a in _arrays(item)]
+    return []
+
+
+def _plain(x):
+    if isinstance(x, Tracked):
+        return x.view(numpy.ndarray)
+    if type(x) in (list, tuple):
+        return type(x)(_plain(item) for item in x)
+    if isinstance(x, dict):
+        return dict((key, _plain(item)) for key, item in x.items())
+    return x
+
+
+def _regular(index):
+    # True when a 1-D index array picks the same elements a slice would
+    index = numpy.asarray(index)
+    if index.ndim != 1:
+        return False
+    if index.dtype == bool:
+        hits = numpy.flatnonzero(index)
+        return hits.size == 0 or hits[-1] - hits[0] + 1 == hits.size
+    if index.dtype.kind not in 'iu':
+        return False
+    if index.size < 2:
+        return True
+    if not ((index >= 0).all() or (index < 0).all()):
+        return False
+    step = numpy.diff(index)
+    return bool(step[0] != 0 and (step == step[0]).all())
+
+
+def _fancy_view_possible(index):
+    components = index if isinstance(index, tuple) else (index,)
+    advanced = [c for c in components if isinstance(c, (list, numpy.ndarray))]
+    return len(advanced) == 1 and _regular(advanced[0])
+
+
+def _call_site():
+    frame = sys._getframe(1)
+    while frame is not None and (frame.f_code in _INTERNAL
+                                 or frame.f_code.co_filename.startswith(_NUMPY_DIR)):
+        frame = frame.f_back
+    if frame is None:
+        return '<unknown>'
+    return '%s:%d in %s' % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+
+
+class Tracked(numpy.ndarray):
+    """An ndarray whose operations report the buffers they allocate to a CopyAudit.
+
+    Results of operations on Tracked arrays are Tracked as well, so tracking
+    the inputs of a hot loop is enough to see every copy made inside it.
+    """
+
+    def __array_finalize__(self, obj):
+        self._audit = getattr(obj, '_audit', None)
+
+    def _record(self, op, sources, results, view_possible=False):
+        audit = self._audit
+        if audit is None or not audit.active:
+            return
+        roots = set(id(_root(a)) for a in _arrays(sources))
+        # an upcast result is wider than one of the arrays it was computed from
+        narrowest = min([a.dtype.itemsize for a in _arrays(sources)] or [0])
+        for result in _arrays(results):
+            if id(_root(result)) not in roots:
+                audit._add(op, result, view_possible,
+                           result.dtype.kind != 'b' and result.dtype.itemsize > narrowest)
+
+    def _wrap(self, result):
+        if type(result) is numpy.ndarray:
+            result = result.view(Tracked)
+            result._audit = self._audit
+            return result
+        if type(result) in (list, tuple):
+            return type(result)(self._wrap(item) for item in result)
+        return result
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        out = kwargs.get('out')
+        if out is not None:
+            kwargs['out'] = _plain(out)
+        result = getattr(ufunc, method)(*_plain(inputs), **kwargs)
+        if out is not None:
+            return out[0] if len(out) == 1 else out
+        name = ufunc.__name__ if method == '__call__' else '%s.%s' % (ufunc.__name__, method)
+        self._record(name, inputs, result)
+        return self._wrap(result)
+
+    def __array_function__(self, func, types, args, kwargs):
+        result = func(*_plain(args), **_plain(kwargs))
+        self._record(func.__name__, (args, kwargs), result)
+        return self._wrap(result)
+
+    def __getitem__(self, index):
+        result = numpy.ndarray.__getitem__(self, index)
+        if isinstance(result, numpy.ndarray):
+            self._record('getitem', self, result, _fancy_view_possible(index))
+        return result
+
+    def copy(self, *args, **kwargs):
+        result = numpy.ndarray.copy(self, *args, **kwargs)
+        self._record('copy', self, result)
+        return result
+
+    def astype(self, dtype, *args, **kwargs):
+        result = numpy.ndarray.astype(self, dtype, *args, **kwargs)
+        self._record('astype', self, result, numpy.dtype(dtype) == self.dtype)
+        return result
+
+    def flatten(self, *args, **kwargs):
+        result = numpy.ndarray.flatten(self, *args, **kwargs)
+        self._record('flatten', self, result, self.flags.c_contiguous)
+        return result
+
+    def ravel(self, *args, **kwargs):
+        result = numpy.ndarray.ravel(self, *args, **kwargs)
+        self._record('ravel', self, result)
+        return result
+
+    def reshape(self, *args, **kwargs):
+        result = numpy.ndarray.reshape(self, *args, **kwargs)
+        self._record('reshape', self, result)
+        return result
+
+    def take(self, indices, *args, **kwargs):
+        result = numpy.ndarray.take(self, indices, *args, **kwargs)
+        self._record('take', self, result, _regular(indices))
+        return result
+
+    def compress(self, condition, *args, **kwargs):
+        result = numpy.ndarray.compress(self, condition, *args, **kwargs)
+        self._record('compress', self, result, _regular(numpy.asarray(condition, dtype=bool)))
+        return result
+
+    def repeat(self, *args, **kwargs):
+        result = numpy.ndarray.repeat(self, *args, **kwargs)
+        self._record('repeat', self, result)
+        return result
+
+
+class CopyAudit(object):
+    """Opt-in record of the new buffers array operations allocate inside a with block.
+
+        with CopyAudit() as audit:
+            a = audit.track(a)
+            ...hot loop...
+        report = audit.report()
+
+    Only operations on arrays passed through track() (and on their results)
+    are seen. With trace_memory=True the peak of all traced allocations in
+    the block is reported as well, at the cost of running under tracemalloc.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.active = False
+        self.entries = []
+        self.peak_bytes = None
+        self._started_tracing = False
+
+    def track(self, a):
+        tracked = numpy.asarray(a).view(Tracked)
+        tracked._audit = self
+        return tracked
+
+    def _add(self, op, result, view_possible, upcast):
+        self.entries.append({'op': op, 'site': _call_site(), 'nbytes': int(result.nbytes),
+                             'shape': list(result.shape), 'dtype': result.dtype.str,
+                             'view_possible': bool(view_possible), 'upcast': bool(upcast)})
+
+    def __enter__(self):
+        self.active = True
+        if self.trace_memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc_info):
+        self.active = False
+        if self.trace_memory:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1] - self._baseline
+            if self._started_tracing:
+                tracemalloc.stop()
+        return False
+
+    def report(self):
+        """A JSON-ready summary of the copies, grouped by (call site, operation)."""
+        sites = {}
+        for entry in self.entries:
+            key = (entry['site'], entry['op'])
+            site = sites.get(key)
+            if site is None:
+                site = sites[key] = {'site': entry['site'], 'op': entry['op'], 'count': 0,
+                                     'nbytes': 0, 'avoidable': 0, 'avoidable_nbytes': 0,
+                                     'upcasts': 0}
+            site['count'] += 1
+            site['nbytes'] += entry['nbytes']
+            if entry['view_possible']:
+                site['avoidable'] += 1
+                site['avoidable_nbytes'] += entry['nbytes']
+            site['upcasts'] += entry['upcast']
+        return {'count': len(self.entries),
+                'nbytes': sum(entry['nbytes'] for entry in self.entries),
+                'avoidable_nbytes': sum(entry['nbytes'] for entry in self.entries
+                                        if entry['view_possible']),
+                'peak_bytes': self.peak_bytes,
+                'sites': sorted(sites.values(), key=lambda site: (-site['nbytes'], site['site']))}
+
+
+_INTERNAL = set(f.__code__ for f in list(vars(Tracked).values()) + [CopyAudit._add, _call_site]
+                if hasattr(f, '__code__'))
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_reports(before, after):
+    """Per (site, op) changes in copy count and bytes between two reports, largest first."""
+    old = dict(((site['site'], site['op']), site) for site in before['sites'])
+    new = dict(((site['site'], site['op']), site) for site in after['sites'])
+    changes = []
+    for key in set(old) | set(new):
+        a, b = old.get(key, {}), new.get(key, {})
+        change = {'site': key[0], 'op': key[1],
+                  'count': b.get('count', 0) - a.get('count', 0),
+                  'nbytes': b.get('nbytes', 0) - a.get('nbytes', 0)}
+        if change['count'] or change['nbytes']:
+            changes.append(change)
+    return sorted(changes, key=lambda change: (-abs(change['nbytes']), change['site']))
+
+
+class CopyAuditTest(unittest.TestCase):
+
+    def test_views_are_not_counted(self):
+        with CopyAudit() as audit:
+            a = audit.track(numpy.array([[1, 2, 3, 4], [5, 6, 7, 8]]))
+            b = a.view()
+            c = a[:, 3]
+            d = a.T.reshape(8)
+            e = a.reshape(4, 2)
+        self.assertFalse(b.flags.owndata)
+        self.assertTrue(numpy.shares_memory(c, a) and numpy.shares_memory(e, a))
+        self.assertEqual([entry['op'] for entry in audit.entries], ['reshape'])
+        self.assertFalse(audit.entries[0]['view_possible'])
+        self.assertEqual(audit.entries[0]['nbytes'], d.nbytes)
+
+    def test_avoidable_copies_are_flagged(self):
+        with CopyAudit() as audit:
+            a = audit.track(numpy.arange(12.).reshape(3, 4))
+            a[[0, 1]]
+            a[:, [0, 2]]
+            a[numpy.array([False, True, True])]
+            a[[2, 0, 1]]
+            a[a > 4]
+            a.astype(float)
+            a.astype(numpy.float32)
+            a.flatten()
+            a.copy()
+        flags = [(entry['op'], entry['view_possible']) for entry in audit.entries]
+        self.assertEqual(flags, [('getitem', True), ('getitem', True), ('getitem', True),
+                                 ('getitem', False), ('greater', False), ('getitem', False),
+                                 ('astype', True), ('astype', False), ('flatten', True),
+                                 ('copy', False)])
+
+    def test_upcasts_and_results_stay_tracked(self):
+        with CopyAudit() as audit:
+            a = audit.track(numpy.ones((10, 10), dtype=numpy.float32))
+            b = a * 2
+            c = b + numpy.ones(10)
+            c.sum(axis=0)
+        self.assertTrue(isinstance(c, Tracked))
+        self.assertEqual([(entry['op'], entry['upcast']) for entry in audit.entries],
+                         [('multiply', False), ('add', True), ('add.reduce', False)])
+        c[[0]]
+        self.assertEqual(len(audit.entries), 3)
+
+    def test_report_by_call_site(self):
+        with CopyAudit(trace_memory=True) as audit:
+            a = audit.track(numpy.zeros(1000))
+            for i in range(3):
+                a[[1, 2, 3]]
+            numpy.concatenate([a, a])
+        report = audit.report()
+        self.assertEqual(report['count'], 4)
+        self.assertEqual(report['nbytes'], 3 * 24 + 16000)
+        self.assertEqual(report['avoidable_nbytes'], 3 * 24)
+        self.assertEqual([site['op'] for site in report['sites']], ['concatenate', 'getitem'])
+        self.assertEqual(report['sites'][1]['count'], 3)
+        self.assertTrue(os.path.basename(__file__).split('.')[0] in report['sites'][0]['site'])
+        self.assertTrue(report['peak_bytes'] >= 16000)
+
+    def test_save_and_compare(self):
+        def run(copies):
+            with CopyAudit() as audit:
+                a = audit.track(numpy.zeros(100))
+                for i in range(copies):
+                    a.copy()
+            return audit.report()
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'before.json')
+            save_report(run(1), path)
+            changes = compare_reports(load_report(path), run(3))
+            self.assertEqual(len(changes), 1)
+            self.assertEqual((changes[0]['op'], changes[0]['count'], changes[0]['nbytes']),
+                             ('copy', 2, 1600))
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(CopyAuditTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,5 +1,5 @@
 import unittest
-from numpy.ma.core import array
+from the_basics.construction import array
 import numpy
 
 
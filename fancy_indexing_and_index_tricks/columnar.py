@@ -0,0 +1,232 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy
+
+MANIFEST = 'fields.json'
+
+
+class ColumnarArray(object):
+    """Struct-of-arrays counterpart of a structured array such as [('r','f4'),('g','f4'),('b','f4')].
+
+    Each field is its own contiguous array, reached as c['r'] or c.r, so maths
+    on one channel streams through memory instead of striding over the others.
+    """
+
+    def __init__(self, columns):
+        columns = OrderedDict(columns)
+        if not columns:
+            raise ValueError("a ColumnarArray needs at least one field")
+        shapes = set(numpy.shape(column) for column in columns.values())
+        if len(shapes) != 1:
+            raise ValueError("fields have different shapes: %s" % sorted(shapes))
+        self.__dict__['_columns'] = OrderedDict((name, numpy.asanyarray(column))
+                                                for name, column in columns.items())
+
+    @classmethod
+    def zeros(cls, shape, dtype):
+        dtype = numpy.dtype(dtype)
+        return cls((name, numpy.zeros(shape, dtype=dtype.fields[name][0])) for name in dtype.names)
+
+    @classmethod
+    def from_structured(cls, structured, copy=True):
+        """Split a structured array into columns.
+
+        With copy=False the columns are the field views of structured itself
+        (no copy, but strided like the original layout).
+        """
+        structured = numpy.asarray(structured)
+        if structured.dtype.names is None:
+            raise ValueError("expected a structured array, got dtype %s" % structured.dtype)
+        if copy:
+            return cls((name, numpy.ascontiguousarray(structured[name]))
+                       for name in structured.dtype.names)
+        columnar = cls((name, structured[name]) for name in structured.dtype.names)
+        columnar.__dict__['_structured'] = structured
+        return columnar
+
+    def _structured_base(self):
+        # the structured array whose fields the columns are, if they are exactly that
+        first = next(iter(self._columns.values()))
+        for base in (self.__dict__.get('_structured'), first.base):
+            if (not isinstance(base, numpy.ndarray) or base.dtype.names != self.names or
+                    base.shape != self.shape):
+                continue
+            if all(column.dtype == base[name].dtype and column.strides == base[name].strides and
+                   column.__array_interface__['data'] == base[name].__array_interface__['data']
+                   for name, column in self._columns.items()):
+                return base
+        return None
+
+    def to_structured(self, out=None):
+        """Interleave the columns into a structured array.
+
+        Columns that are the fields of one structured array, as from
+        from_structured(copy=False), give that array back without a copy.
+        """
+        if out is None:
+            base = self._structured_base()
+            if base is not None:
+                return base
+            out = numpy.empty(self.shape, dtype=self.dtype)
+        elif out.shape != self.shape or out.dtype.names != self.names:
+            raise ValueError("out must have shape %s and fields %s" % (self.shape, self.names))
+        for name, column in self._columns.items():
+            out[name] = column
+        return out
+
+    @property
+    def names(self):
+        return tuple(self._columns)
+
+    @property
+    def dtype(self):
+        return numpy.dtype([(name, column.dtype) for name, column in self._columns.items()])
+
+    @property
+    def shape(self):
+        return next(iter(self._columns.values())).shape
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._columns[key]
+        return ColumnarArray((name, column[key]) for name, column in self._columns.items())
+
+    def __setitem__(self, key, value):
+        if isinstance(key, str):
+            self._columns[key][...] = value
+            return
+        value = numpy.asarray(value)
+        if value.dtype.names is not None:
+            for name, column in self._columns.items():
+                column[key] = value[name]
+        else:
+            # one value per field along the last axis, like the tuples in img.flat = [(0, 0, 0), ...]
+            if value.ndim == 0 or value.shape[-1] != len(self._columns):
+                raise ValueError("expected %d values per element" % len(self._columns))
+            for i, column in enumerate(self._columns.values()):
+                column[key] = value[..., i]
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_columns'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self._columns:
+            self._columns[name][...] = value
+        else:
+            raise AttributeError("cannot add attribute %r to a ColumnarArray" % name)
+
+    def save(self, directory):
+        """Write every field as <name>.npy in directory, plus a manifest of the field order."""
+        for name in self.names:
+            if not name or '/' in name or os.sep in name or (os.altsep and os.altsep in name):
+                raise ValueError("field name %r cannot be used as a file name" % (name,))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, column in self._columns.items():
+            numpy.save(os.path.join(directory, name + '.npy'), column)
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump({'names': list(self.names), 'shape': list(self.shape)}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open a bundle written by save(), memory-mapping each field by default."""
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        return cls((name, numpy.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+                   for name in manifest['names'])
+
+
+class ColumnarArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rgb = [('r', 'float32'), ('g', 'float32'), ('b', 'float32')]
+
+    def test_like_record_array(self):
+        img = ColumnarArray.zeros((2, 2), self.rgb)
+        img[...] = numpy.array([(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]).reshape(2, 2, 3)
+        expected = numpy.zeros((2, 2), self.rgb)
+        expected.flat = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+        numpy.testing.assert_array_equal(img.to_structured(), expected)
+        numpy.testing.assert_array_equal(img.r, expected.view(numpy.recarray).r)
+        self.assertEqual(img.dtype, expected.dtype)
+        self.assertEqual(img.shape, (2, 2))
+
+    def test_columns_are_contiguous(self):
+        structured = numpy.zeros((4, 5), self.rgb)
+        img = ColumnarArray.from_structured(structured)
+        self.assertTrue(all(img[name].flags.c_contiguous for name in img.names))
+        self.assertFalse(numpy.shares_memory(img.g, structured))
+
+    def test_from_structured_without_copy(self):
+        structured = numpy.zeros((4, 5), self.rgb)
+        img = ColumnarArray.from_structured(structured, copy=False)
+        img.g[1, 2] = 7
+        self.assertEqual(structured['g'][1, 2], 7)
+        self.assertTrue(img.to_structured() is structured)
+        rows = structured[1:3]
+        self.assertTrue(ColumnarArray.from_structured(rows, copy=False).to_structured() is rows)
+        by_hand = ColumnarArray((name, structured[name]) for name in structured.dtype.names)
+        self.assertTrue(by_hand.to_structured() is structured)
+        # a subset of the fields, or a slice of the columns, still has to be interleaved
+        for part in (ColumnarArray([('r', structured['r']), ('b', structured['b'])]), img[1:]):
+            copied = part.to_structured()
+            self.assertFalse(numpy.shares_memory(copied, structured))
+            numpy.testing.assert_array_equal(copied['b'], part.b)
+
+    def test_slicing_and_assignment(self):
+        img = ColumnarArray.zeros((3, 4), self.rgb)
+        img.b = 2
+        img['r'][0] = 1
+        part = img[1:]
+        self.assertEqual(part.shape, (2, 4))
+        self.assertTrue(numpy.shares_memory(part.b, img.b))
+        self.assertEqual(img.r.sum(), 4)
+        self.assertRaises(AttributeError, setattr, img, 'alpha', 1)
+        self.assertRaises(AttributeError, getattr, img, 'alpha')
+
+    def test_save_and_load_bundle(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            img = ColumnarArray.from_structured(
+                numpy.array([[(0, 0, 0), (1, 0, 0)], [(0, 1, 0), (0, 0, 1)]], self.rgb))
+            img.save(os.path.join(tmp, 'img'))
+            loaded = ColumnarArray.load(os.path.join(tmp, 'img'))
+            self.assertEqual(loaded.names, ('r', 'g', 'b'))
+            self.assertTrue(isinstance(loaded.r, numpy.memmap))
+            numpy.testing.assert_array_equal(loaded.to_structured(), img.to_structured())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_save_rejects_path_like_names(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for name in ('../r', 'a' + os.sep + 'b', ''):
+                img = ColumnarArray([(name, numpy.zeros(3))])
+                self.assertRaises(ValueError, img.save, os.path.join(tmp, 'img'))
+            self.assertEqual(os.listdir(tmp), [])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_mismatched_fields(self):
+        self.assertRaises(ValueError, ColumnarArray, [('r', numpy.zeros(3)), ('g', numpy.zeros(4))])
+        self.assertRaises(ValueError, ColumnarArray.from_structured, numpy.zeros(3))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(ColumnarArrayTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
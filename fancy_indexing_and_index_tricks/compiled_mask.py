@@ -0,0 +1,255 @@
+import unittest
+import hashlib
+from collections import OrderedDict
+import numpy
+from linear_algebra.sparse import _index_dtype
+
+# spans are copied slice by slice up to this many runs, expanded to indices beyond
+SPAN_LOOP_MAX = 64
+
+
+class CompiledMask(object):
+    """A boolean mask scanned once and kept as flat indices or as runs of True.
+
+    Whichever form is smaller is kept: int32 flat indices (4 bytes per True
+    element) or (start, stop) spans (8 bytes per run), so masks made of long
+    runs compress well and scattered sparse masks stay as plain indices.
+    gather/assign then behave like a[mask] and a[mask] = value without
+    touching the mask again.
+    """
+
+    def __init__(self, mask):
+        mask = numpy.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.size = mask.size
+        flat = mask.reshape(-1)
+        itype = _index_dtype(self.size)
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], flat, [False]))))
+        self.count = int(numpy.count_nonzero(flat))
+        if len(edges) < self.count:
+            self.kind = 'spans'
+            self.spans = edges.astype(itype).reshape(-1, 2)
+            self.flat_indices = None
+        else:
+            self.kind = 'indices'
+            self.flat_indices = numpy.flatnonzero(flat).astype(itype)
+            self.spans = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return (self.spans if self.kind == 'spans' else self.flat_indices).nbytes
+
+    def indices(self):
+        """Flat indices of the True elements (expanded from the spans if need be)."""
+        if self.kind == 'indices':
+            return self.flat_indices
+        starts, stops = self.spans[:, 0], self.spans[:, 1]
+        lengths = stops - starts
+        # position within the output plus the start of the span each one falls in
+        first = numpy.cumsum(lengths) - lengths
+        return numpy.arange(self.count) + numpy.repeat(starts - first, lengths)
+
+    def nonzero(self):
+        return numpy.unravel_index(self.indices(), self.shape)
+
+    def _flat_view(self, a):
+        # a with the masked axes flattened into one, or None if that would copy
+        if a.shape[:len(self.shape)] != self.shape:
+            raise IndexError("mask of shape %s does not match array of shape %s"
+                             % (self.shape, a.shape))
+        view = a.view()
+        try:
+            view.shape = (self.size,) + a.shape[len(self.shape):]
+        except AttributeError:
+            return None
+        return view
+
+    def _runs(self):
+        offset = 0
+        for start, stop in self.spans:
+            yield slice(start, stop), slice(offset, offset + stop - start)
+            offset += stop - start
+
+    def gather(self, a, out=None):
+        """a[mask], optionally into out."""
+        a = numpy.asarray(a)
+        flat = self._flat_view(a)
+        if flat is None:
+            flat = a.reshape((self.size,) + a.shape[len(self.shape):])
+        if out is None:
+            out = numpy.empty((self.count,) + flat.shape[1:], dtype=a.dtype)
+        elif out.shape != (self.count,) + flat.shape[1:]:
+            raise ValueError("out has shape %s, expected %s"
+                             % (out.shape, (self.count,) + flat.shape[1:]))
+        if self.kind == 'spans' and len(self.spans) <= SPAN_LOOP_MAX:
+            for source, target in self._runs():
+                out[target] = flat[source]
+        else:
+            numpy.take(flat, self.indices(), axis=0, out=out)
+        return out
+
+    def assign(self, a, value):
+        """a[mask] = value, in place; value is a scalar or one entry per True element."""
+        flat = self._flat_view(a)
+        if flat is None:
+            a[self.nonzero()] = value
+            return a
+        value = numpy.asarray(value)
+        if self.kind == 'spans' and len(self.spans) <= SPAN_LOOP_MAX:
+            # a view with one entry per True element, as a[mask] = value broadcasts it
+            value = numpy.broadcast_to(value, (self.count,) + a.shape[len(self.shape):])
+            for target, source in self._runs():
+                flat[target] = value[source]
+        else:
+            flat[self.indices()] = value
+        return a
+
+    def columns(self, a):
+        """a[:, mask] for a 1-D mask over the columns of a."""
+        a = numpy.asarray(a)
+        if len(self.shape) != 1 or a.shape[1] != self.size:
+            raise IndexError("column mask of shape %s does not match array of shape %s"
+                             % (self.shape, a.shape))
+        return numpy.take(a, self.indices(), axis=1)
+
+
+def select_pairs(a, rows, cols):
+    """a[b1, b2] for compiled 1-D row and column masks: the elements at paired positions."""
+    a = numpy.asarray(a)
+    if len(rows) != len(cols) and 1 not in (len(rows), len(cols)):
+        raise IndexError("shape mismatch: masks select %d rows and %d columns"
+                         % (len(rows), len(cols)))
+    if rows.shape != a.shape[:1] or cols.shape != a.shape[1:2]:
+        raise IndexError("masks of shapes %s, %s do not match array of shape %s"
+                         % (rows.shape, cols.shape, a.shape))
+    return a[rows.indices(), cols.indices()]
+
+
+class MaskCache(object):
+    """Compiled masks keyed by mask content, least recently used dropped past maxsize."""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._masks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(mask):
+        mask = numpy.ascontiguousarray(mask, dtype=bool)
+        return mask.shape, hashlib.sha1(mask.view(numpy.uint8)).hexdigest()
+
+    def compile(self, mask):
+        if isinstance(mask, CompiledMask):
+            return mask
+        key = self.key(mask)
+        compiled = self._masks.pop(key, None)
+        if compiled is None:
+            self.misses += 1
+            compiled = CompiledMask(mask)
+            if len(self._masks) >= self.maxsize:
+                self._masks.popitem(last=False)
+        else:
+            self.hits += 1
+        self._masks[key] = compiled
+        return compiled
+
+    def clear(self):
+        self._masks.clear()
+
+    def __len__(self):
+        return len(self._masks)
+
+
+_cache = MaskCache()
+
+
+def compile_mask(mask):
+    """The CompiledMask for mask, from a process-wide content-keyed cache."""
+    return _cache.compile(mask)
+
+
+class CompiledMaskTest(unittest.TestCase):
+
+    def test_tutorial_boolean_indexing(self):
+        a = numpy.arange(12).reshape(3, 4)
+        b = compile_mask(a > 4)
+        b.assign(a, 0)
+        numpy.testing.assert_array_equal(a, [[0, 1, 2, 3], [4, 0, 0, 0], [0, 0, 0, 0]])
+        a = numpy.arange(12).reshape(3, -1)
+        b1 = CompiledMask([False, True, True])
+        b2 = CompiledMask([True, False, True, False])
+        numpy.testing.assert_array_equal(b1.gather(a), [[4, 5, 6, 7], [8, 9, 10, 11]])
+        numpy.testing.assert_array_equal(b2.columns(a), [[0, 2], [4, 6], [8, 10]])
+        numpy.testing.assert_array_equal(select_pairs(a, b1, b2), [4, 10])
+
+    def test_picks_the_denser_form(self):
+        blocks = numpy.zeros(1000, dtype=bool)
+        blocks[100:300] = blocks[500:900] = True
+        compiled = CompiledMask(blocks)
+        self.assertEqual((compiled.kind, compiled.nbytes), ('spans', 16))
+        scattered = numpy.zeros(1000, dtype=bool)
+        scattered[::97] = True
+        compiled = CompiledMask(scattered)
+        self.assertEqual(compiled.kind, 'indices')
+        self.assertEqual(compiled.flat_indices.dtype, numpy.int32)
+
+    def test_matches_numpy_for_both_forms(self):
+        rng = numpy.random.RandomState(0)
+        runs = numpy.repeat(rng.uniform(size=(40, 50)) < 0.3, 4, axis=1)
+        for mask in (rng.uniform(size=(40, 200)) < 0.01, runs, runs[:, :8]):
+            compiled = CompiledMask(mask)
+            a = rng.normal(size=mask.shape + (3,))
+            numpy.testing.assert_array_equal(compiled.gather(a), a[mask])
+            numpy.testing.assert_array_equal(compiled.indices(), numpy.flatnonzero(mask))
+            expected, got = a.copy(), a.copy()
+            expected[mask] = -1
+            numpy.testing.assert_array_equal(compiled.assign(got, -1), expected)
+            values = numpy.arange(mask.sum() * 3.).reshape(-1, 3)
+            expected[mask] = values
+            numpy.testing.assert_array_equal(compiled.assign(got, values), expected)
+
+    def test_row_value_as_long_as_count(self):
+        mask = numpy.array([True, True, False, True, True, True, False])
+        for a in (numpy.zeros((7, 5)), numpy.zeros((7, 5, 1))[..., 0]):
+            expected = a.copy()
+            expected[mask] = numpy.arange(5)
+            numpy.testing.assert_array_equal(CompiledMask(mask).assign(a, numpy.arange(5)),
+                                             expected)
+            expected[mask] = numpy.arange(5)[:, numpy.newaxis]
+            numpy.testing.assert_array_equal(
+                CompiledMask(mask).assign(a, numpy.arange(5)[:, numpy.newaxis]), expected)
+        single = numpy.arange(7) == 4
+        numpy.testing.assert_array_equal(CompiledMask(single).assign(numpy.zeros(7), [3]),
+                                         3 * single)
+
+    def test_non_contiguous_target(self):
+        mask = numpy.zeros((4, 5), dtype=bool)
+        mask[1, 1:4] = mask[3, 0] = True
+        a = numpy.asfortranarray(numpy.arange(20.).reshape(4, 5))
+        b = numpy.arange(40.).reshape(4, 10)[:, ::2]
+        for target in (a, b):
+            expected = target.copy()
+            expected[mask] = 7
+            numpy.testing.assert_array_equal(CompiledMask(mask).assign(target, 7), expected)
+            numpy.testing.assert_array_equal(CompiledMask(mask).gather(target), target[mask])
+
+    def test_cache_by_content(self):
+        cache = MaskCache(maxsize=2)
+        mask = numpy.arange(10) % 3 == 0
+        first = cache.compile(mask)
+        self.assertTrue(cache.compile(mask.copy()) is first)
+        cache.compile(numpy.roll(mask, 1))
+        cache.compile(~mask)
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 3, 2))
+        self.assertFalse(cache.compile(mask) is first)
+        self.assertRaises(IndexError, first.gather, numpy.zeros(9))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(CompiledMaskTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
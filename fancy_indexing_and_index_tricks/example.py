@@ -1,5 +1,5 @@
 import unittest
-from numpy.ma.core import arange, array, sin, zeros
+from the_basics.construction import arange, array, sin, zeros
 import numpy
 from numpy.core.function_base import linspace
 from numpy.lib.index_tricks import ogrid, ix_
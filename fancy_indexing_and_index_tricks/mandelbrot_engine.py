@@ -0,0 +1,140 @@
+import unittest
+import numpy
+
+
+def escape_time(c, maxit=20, out=None):
+    """Iteration at which each point of c diverges, maxit if it never does."""
+    c = numpy.asarray(c)
+    if out is None:
+        out = numpy.empty(c.shape, dtype=int)
+    elif out.shape != c.shape:
+        raise ValueError("out has shape %s, expected %s" % (out.shape, c.shape))
+    cbuf = numpy.array(c, dtype=complex).ravel()
+    divtime = out.reshape(-1)
+    _escape_time(cbuf, maxit, divtime)
+    if not numpy.may_share_memory(divtime, out):
+        out[...] = divtime.reshape(out.shape)
+    return out
+
+
+def _escape_time(c, maxit, divtime, empty=numpy.empty):
+    # Active-set iteration: after every step the points that are still live are
+    # packed to the front of preallocated buffers, so each pass only touches
+    # (and only builds masks for) the points that have not escaped yet.
+    # c is used as scratch and clobbered; empty(shape, dtype) supplies the
+    # other buffers (e.g. from a tricks_and_tips.arena.ScratchArena).
+    n = c.size
+    divtime[...] = maxit
+    z, zspare, cspare = empty(n, c.dtype), empty(n, c.dtype), empty(n, c.dtype)
+    z[...] = c
+    idx, idxspare = empty(n, numpy.intp), empty(n, numpy.intp)
+    # arange(n) written in place (0, 1, 1, ... accumulated) rather than copied
+    # from numpy.arange(n), which would allocate n indices on every call even
+    # when empty hands out reused arena buffers
+    idx[:1] = 0
+    idx[1:] = 1
+    numpy.cumsum(idx, out=idx)
+    diverge = empty(n, bool)
+    live = n
+    # as in the reference, points whose real part stays small never count as
+    # escaped and may overflow to inf/nan; that is expected, not an error
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        for i in range(maxit):
+            if live == 0:
+                break
+            zl, cl, dl = z[:live], c[:live], diverge[:live]
+            numpy.square(zl, out=zl)
+            numpy.add(zl, cl, out=zl)
+            # same divergence test as the reference implementation
+            tl = zspare[:live]
+            numpy.multiply(zl, numpy.conj(2), out=tl)
+            numpy.greater(tl, 2**2, out=dl)
+            if not dl.any():
+                continue
+            divtime[idx[:live][dl]] = i
+            numpy.logical_not(dl, out=dl)
+            kept = numpy.count_nonzero(dl)
+            numpy.compress(dl, zl, out=zspare[:kept])
+            numpy.compress(dl, cl, out=cspare[:kept])
+            numpy.compress(dl, idx[:live], out=idxspare[:kept])
+            z, zspare = zspare, z
+            c, cspare = cspare, c
+            idx, idxspare = idxspare, idx
+            live = kept
+    return divtime
+
+
+def _reference_mandelbrot(h, w, maxit=20):
+    # the tutorial's loop (fancy_indexing_and_index_tricks/example.py), kept here
+    # because the tutorial module itself is Python 2 and cannot be imported
+    y, x = numpy.ogrid[-1.4:1.4:h*1j, -2:0.8:w*1j]
+    c = x + y*1j
+    z = c
+    divtime = maxit + numpy.zeros(z.shape, dtype=int)
+    # points that escape between resets overflow to inf/nan, as in the tutorial
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        for i in range(maxit):
+            z = z**2 + c
+            diverge = z*numpy.conj(2) > 2**2
+            div_now = diverge & (divtime == maxit)
+            divtime[div_now] = i
+            z[diverge] = 2
+    return divtime
+
+
+def _active_mandelbrot(h, w, maxit=20):
+    y, x = numpy.ogrid[-1.4:1.4:h*1j, -2:0.8:w*1j]
+    c = numpy.empty(h*w, dtype=complex)
+    numpy.add(x, y*1j, out=c.reshape(h, w))
+    divtime = numpy.empty((h, w), dtype=int)
+    _escape_time(c, maxit, divtime.reshape(-1))
+    return divtime
+
+
+ENGINES = {'active': _active_mandelbrot,
+           'reference': _reference_mandelbrot}
+
+
+def mandelbrot(h, w, maxit=20, engine='active'):
+    try:
+        compute = ENGINES[engine]
+    except KeyError:
+        raise ValueError("unknown engine %r, expected one of %s" % (engine, sorted(ENGINES)))
+    return compute(h, w, maxit)
+
+
+class MandelbrotEngineTest(unittest.TestCase):
+
+    def test_active_matches_reference(self):
+        for h, w, maxit in [(4, 4, 1), (30, 40, 20), (64, 48, 100), (1, 7, 5)]:
+            numpy.testing.assert_array_equal(mandelbrot(h, w, maxit),
+                                             mandelbrot(h, w, maxit, engine='reference'))
+
+    def test_active_maxit_one(self):
+        numpy.testing.assert_array_equal(mandelbrot(4, 4, maxit=1), numpy.ones((4, 4), dtype=int))
+
+    def test_zero_iterations(self):
+        numpy.testing.assert_array_equal(mandelbrot(3, 5, maxit=0), numpy.zeros((3, 5), dtype=int))
+
+    def test_escape_time_into_out(self):
+        y, x = numpy.ogrid[-1.4:1.4:20j, -2:0.8:30j]
+        c = x + y*1j
+        before = c.copy()
+        out = numpy.empty((20, 30), dtype=numpy.int32)
+        result = escape_time(c, 50, out=out)
+        self.assertTrue(result is out)
+        numpy.testing.assert_array_equal(out, mandelbrot(20, 30, 50, engine='reference'))
+        numpy.testing.assert_array_equal(c, before)
+
+    def test_escape_time_wrong_out_shape(self):
+        self.assertRaises(ValueError, escape_time, numpy.zeros((2, 2), dtype=complex), 5,
+                          numpy.empty((2, 3), dtype=int))
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, mandelbrot, 4, 4, 1, 'fast')
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(MandelbrotEngineTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
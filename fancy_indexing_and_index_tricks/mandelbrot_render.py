@@ -0,0 +1,169 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from multiprocessing import Pool
+import numpy
+from numpy.lib.format import open_memmap
+from fancy_indexing_and_index_tricks.mandelbrot_engine import mandelbrot, escape_time
+
+
+class Viewport(namedtuple('Viewport', 'ymin ymax xmin xmax')):
+    """Region of the complex plane, laid out like ogrid[ymin:ymax:h*1j, xmin:xmax:w*1j]."""
+
+    __slots__ = ()
+
+    def zoomed(self, factor, centre=None):
+        if centre is None:
+            centre = complex((self.xmin + self.xmax) / 2., (self.ymin + self.ymax) / 2.)
+        half_w = (self.xmax - self.xmin) / (2. * factor)
+        half_h = (self.ymax - self.ymin) / (2. * factor)
+        return Viewport(centre.imag - half_h, centre.imag + half_h,
+                        centre.real - half_w, centre.real + half_w)
+
+    def grid(self, h, w, rows=None, cols=None):
+        # Same arithmetic as ogrid, restricted to a block of rows and columns,
+        # so a tile holds exactly the values of the matching slice of the full plane.
+        r0, r1 = rows or (0, h)
+        c0, c1 = cols or (0, w)
+        y = _axis(self.ymin, self.ymax, h, r0, r1)
+        x = _axis(self.xmin, self.xmax, w, c0, c1)
+        c = numpy.empty((r1 - r0, c1 - c0), dtype=complex)
+        numpy.add(x[numpy.newaxis, :], y[:, numpy.newaxis]*1j, out=c)
+        return c
+
+
+DEFAULT_VIEWPORT = Viewport(-1.4, 1.4, -2., 0.8)
+
+
+def _axis(start, stop, n, lo, hi):
+    step = (stop - start) / float(n - 1) if n != 1 else 1
+    return numpy.arange(lo, hi, dtype=float) * step + start
+
+
+def tiles(h, w, tile_shape):
+    th, tw = tile_shape
+    for r0 in range(0, h, th):
+        for c0 in range(0, w, tw):
+            yield r0, min(r0 + th, h), c0, min(c0 + tw, w)
+
+
+def _render_tile(args):
+    path, viewport, h, w, maxit, (r0, r1, c0, c1) = args
+    divtime = numpy.load(path, mmap_mode='r+')
+    escape_time(viewport.grid(h, w, (r0, r1), (c0, c1)), maxit, out=divtime[r0:r1, c0:c1])
+    divtime.flush()
+    del divtime
+    return r0, c0
+
+
+def render(path, h, w, maxit=20, viewport=DEFAULT_VIEWPORT, tile_shape=(256, 256),
+           processes=None, resume=True):
+    """Render divtime for viewport into the .npy file at path, one tile per task.
+
+    Finished tiles are recorded next to the output, so an interrupted render
+    started again with resume=True only computes what is missing.
+    """
+    viewport = Viewport(*viewport)
+    tile_shape = tuple(tile_shape)
+    meta = {'h': h, 'w': w, 'maxit': maxit, 'viewport': list(viewport),
+            'tile_shape': list(tile_shape)}
+    meta_path, done_path = path + '.json', path + '.tiles.npy'
+    ny = -(-h // tile_shape[0])
+    nx = -(-w // tile_shape[1])
+
+    if resume and os.path.exists(meta_path) and os.path.exists(path) and os.path.exists(done_path):
+        with open(meta_path) as f:
+            previous = json.load(f)
+        if previous != meta:
+            raise ValueError("%s was rendered with different parameters %s" % (path, previous))
+        done = open_memmap(done_path, mode='r+')
+    else:
+        open_memmap(path, mode='w+', dtype=int, shape=(h, w)).flush()
+        done = open_memmap(done_path, mode='w+', dtype=bool, shape=(ny, nx))
+        done.flush()
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    todo = [(path, viewport, h, w, maxit, t) for t in tiles(h, w, tile_shape)
+            if not done[t[0] // tile_shape[0], t[2] // tile_shape[1]]]
+    if processes == 1:
+        finished = map(_render_tile, todo)
+        pool = None
+    else:
+        pool = Pool(processes)
+        finished = pool.imap_unordered(_render_tile, todo)
+    try:
+        for r0, c0 in finished:
+            done[r0 // tile_shape[0], c0 // tile_shape[1]] = True
+            done.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    del done
+    return numpy.load(path, mmap_mode='r+')
+
+
+class MandelbrotRenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'divtime.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_default_grid_is_ogrid(self):
+        y, x = numpy.ogrid[-1.4:1.4:13*1j, -2:0.8:17*1j]
+        numpy.testing.assert_array_equal(DEFAULT_VIEWPORT.grid(13, 17), x+y*1j)
+        numpy.testing.assert_array_equal(DEFAULT_VIEWPORT.grid(13, 17, (3, 8), (5, 9)),
+                                         (x+y*1j)[3:8, 5:9])
+
+    def test_render_matches_single_process(self):
+        divtime = render(self.path, 50, 70, maxit=30, tile_shape=(16, 32), processes=2)
+        numpy.testing.assert_array_equal(divtime, mandelbrot(50, 70, 30, engine='reference'))
+        self.assertTrue(isinstance(divtime, numpy.memmap))
+
+    def test_default_pool_and_single_tile(self):
+        divtime = render(self.path, 33, 45, maxit=25)
+        numpy.testing.assert_array_equal(divtime, mandelbrot(33, 45, 25, engine='reference'))
+        self.assertEqual(numpy.load(self.path + '.tiles.npy').shape, (1, 1))
+
+    def test_resume_skips_finished_tiles(self):
+        render(self.path, 20, 20, maxit=10, tile_shape=(10, 10), processes=1)
+        divtime = numpy.load(self.path, mmap_mode='r+')
+        divtime[:10, :10] = -1
+        divtime.flush()
+        del divtime
+        done = numpy.load(self.path + '.tiles.npy', mmap_mode='r+')
+        done[1, 1] = False
+        done.flush()
+        del done
+        divtime = render(self.path, 20, 20, maxit=10, tile_shape=(10, 10), processes=1)
+        self.assertTrue((divtime[:10, :10] == -1).all())
+        numpy.testing.assert_array_equal(divtime[10:, 10:],
+                                         mandelbrot(20, 20, 10, engine='reference')[10:, 10:])
+
+    def test_resume_with_other_parameters(self):
+        render(self.path, 8, 8, maxit=5, processes=1)
+        self.assertRaises(ValueError, render, self.path, 8, 8, 6, DEFAULT_VIEWPORT, (256, 256), 1)
+        divtime = render(self.path, 8, 8, maxit=6, processes=1, resume=False)
+        numpy.testing.assert_array_equal(divtime, mandelbrot(8, 8, 6))
+
+    def test_zoomed_viewport(self):
+        viewport = DEFAULT_VIEWPORT.zoomed(4, centre=-0.75+0.1j)
+        self.assertAlmostEqual(viewport.xmax - viewport.xmin, 0.7)
+        self.assertAlmostEqual((viewport.ymax + viewport.ymin) / 2., 0.1)
+        divtime = render(self.path, 24, 30, maxit=40, viewport=viewport, tile_shape=(7, 11),
+                         processes=2)
+        y, x = numpy.ogrid[viewport.ymin:viewport.ymax:24j, viewport.xmin:viewport.xmax:30j]
+        numpy.testing.assert_array_equal(divtime, escape_time(x+y*1j, 40))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(MandelbrotRenderTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,317 @@
+import unittest
+import numpy
+from the_basics.streaming import BLOCK_BYTES
+
+
+def _axes(axis, ndim):
+    if axis is None:
+        return tuple(range(ndim))
+    if isinstance(axis, (int, numpy.integer)):
+        axis = (axis,)
+    axes = tuple(sorted(set(int(a) % ndim for a in axis)))
+    if len(axes) != len(tuple(axis)):
+        raise ValueError("repeated axis in %s" % (axis,))
+    return axes
+
+
+class OuterGrid(object):
+    """f over the open grid numpy.ix_(*vectors), evaluated a block at a time.
+
+        grid = OuterGrid(lambda a, b, c: a + b + c, a, b, c)
+        grid.sum(axis=2)              # == (ax + bx + cx).sum(axis=2)
+        grid.argmin()                 # (i, j, k) of the smallest cell
+
+    f receives one ix_-shaped operand per vector (restricted to the block)
+    and must work elementwise, so any box of the grid can be computed on its
+    own. Reductions fold the blocks into an accumulator of the kept axes, so
+    no more than block_bytes of the full product (at 8 bytes a cell) exists
+    at once, however many cells the grid has.
+    """
+
+    def __init__(self, f, *vectors, **kwargs):
+        block_bytes = kwargs.pop('block_bytes', BLOCK_BYTES)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments %s" % ', '.join(sorted(kwargs)))
+        if not vectors:
+            raise ValueError("OuterGrid needs at least one vector")
+        self.f = f
+        self.vectors = tuple(numpy.asarray(v) for v in vectors)
+        for v in self.vectors:
+            if v.ndim != 1:
+                raise ValueError("grid vectors must be 1-D, got shape %s" % (v.shape,))
+        self.shape = tuple(len(v) for v in self.vectors)
+        self.ndim = len(self.shape)
+        self.size = int(numpy.prod(self.shape, dtype=numpy.int64))
+        self.block_cells = max(block_bytes // 8, 1)
+
+    def boxes(self):
+        """Tuples of slices, in C order, tiling the grid in blocks of at most block_cells."""
+        # whole trailing axes fit in a block; the axis before them is cut into
+        # runs, and every axis before that is stepped one index at a time
+        inner, split = 1, self.ndim
+        while split > 0 and inner * self.shape[split - 1] <= self.block_cells:
+            split -= 1
+            inner *= self.shape[split]
+        if split == 0:
+            yield tuple(slice(0, n) for n in self.shape)
+            return
+        step = max(self.block_cells // inner, 1)
+        for lead in numpy.ndindex(*self.shape[:split - 1]):
+            for start in range(0, self.shape[split - 1], step):
+                yield (tuple(slice(i, i + 1) for i in lead)
+                       + (slice(start, min(start + step, self.shape[split - 1])),)
+                       + tuple(slice(0, n) for n in self.shape[split:]))
+
+    def evaluate(self, box):
+        """f over one box of the grid, shaped like the box."""
+        values = numpy.asarray(self.f(*numpy.ix_(*[v[s] for v, s in zip(self.vectors, box)])))
+        shape = tuple(s.stop - s.start for s in box)
+        if values.shape != shape:
+            values = numpy.broadcast_to(values, shape)
+        return values
+
+    def blocks(self):
+        for box in self.boxes():
+            yield box, self.evaluate(box)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.materialize() if dtype is None else self.materialize().astype(dtype)
+
+    def materialize(self):
+        """The full product as an array; only sensible for small grids."""
+        out = None
+        for box, values in self.blocks():
+            if out is None:
+                out = numpy.empty(self.shape, dtype=values.dtype)
+            out[box] = values
+        return out
+
+    def _fold(self, axis, reduce, combine):
+        # accumulate reduce(block, axes, keepdims) into the kept axes
+        axes = _axes(axis, self.ndim)
+        kept = tuple(1 if i in axes else n for i, n in enumerate(self.shape))
+        out = None
+        for box, values in self.blocks():
+            partial = reduce(values, axis=axes, keepdims=True)
+            target = tuple(slice(0, 1) if i in axes else s for i, s in enumerate(box))
+            if out is None:
+                out = numpy.empty(kept, dtype=partial.dtype)
+                seen = numpy.zeros(kept, dtype=bool)
+            # boxes sharing kept positions cover them exactly, so each target is all new or all seen
+            if not seen[target].any():
+                out[target] = partial
+                seen[target] = True
+            else:
+                combine(out[target], partial, out=out[target])
+        return out.reshape([n for i, n in enumerate(kept) if i not in axes])[()]
+
+    def sum(self, axis=None):
+        return self._fold(axis, numpy.sum, numpy.add)
+
+    def mean(self, axis=None):
+        axes = _axes(axis, self.ndim)
+        count = numpy.prod([self.shape[i] for i in axes])
+        return self.sum(axis) / float(count)
+
+    def min(self, axis=None):
+        return self._fold(axis, numpy.min, numpy.minimum)
+
+    def max(self, axis=None):
+        return self._fold(axis, numpy.max, numpy.maximum)
+
+    def _range(self):
+        # (min, max) of the whole grid from a single pass; NaN propagates as in min()
+        lo = hi = None
+        for box, values in self.blocks():
+            lo = values.min() if lo is None else numpy.minimum(lo, values.min())
+            hi = values.max() if hi is None else numpy.maximum(hi, values.max())
+        return lo, hi
+
+    def _arg(self, axis, largest):
+        axes = _axes(axis, self.ndim)
+        rest = tuple(i for i in range(self.ndim) if i not in axes)
+        kept = tuple(self.shape[i] for i in rest)
+        best = where = None
+        for box, values in self.blocks():
+            # reduced axes last and flattened, so one argmin per kept position
+            local = numpy.transpose(values, rest + axes)
+            local = local.reshape(local.shape[:len(rest)] + (-1,))
+            pick = local.argmax(axis=-1) if largest else local.argmin(axis=-1)
+            value = numpy.take_along_axis(local, pick[..., numpy.newaxis], axis=-1)[..., 0]
+            reduced = numpy.unravel_index(pick, [box[i].stop - box[i].start for i in axes])
+            # the trailing Ellipsis keeps best[target] a view even with no kept axes
+            target = tuple(box[i] for i in rest) + (Ellipsis,)
+            if best is None:
+                best = numpy.empty(kept, dtype=value.dtype)
+                where = numpy.zeros((len(axes),) + kept, dtype=numpy.intp)
+                seen = numpy.zeros(kept, dtype=bool)
+            current = best[target]
+            # blocks arrive in C order, so keeping strict improvements keeps the first hit;
+            # NaN wins as in numpy.argmin, and a NaN already kept is never replaced
+            better = ~seen[target] | ((value > current) if largest else (value < current))
+            better |= (value != value) & (current == current)
+            current[better] = value[better]
+            seen[target] = True
+            for k, i in enumerate(axes):
+                where[(k,) + target][better] = reduced[k][better] + box[i].start
+        index = [None] * self.ndim
+        grids = numpy.indices(kept, sparse=True) if rest else ()
+        for k, i in enumerate(rest):
+            index[i] = grids[k]
+        for k, i in enumerate(axes):
+            index[i] = where[k]
+        if not rest:
+            return tuple(int(i) for i in index)
+        return tuple(index)
+
+    def argmin(self, axis=None):
+        """Grid coordinates of the minimum: one index (array) per grid axis.
+
+        With axis=None this is a tuple of ints; otherwise each entry is an
+        array broadcasting over the kept axes (a plain arange, ix_-style, for
+        a kept axis), so grid values at the result are the minima and
+        vectors[i][result[i]] are the parameters that produced them.
+        """
+        return self._arg(axis, False)
+
+    def argmax(self, axis=None):
+        """As argmin, for the maximum."""
+        return self._arg(axis, True)
+
+    def histogram(self, bins=10, range=None, weights=None):
+        """(counts, edges) as numpy.histogram of the whole grid.
+
+        Without range (and with integer bins) one extra pass finds min and max.
+        weights, if given, is another callable evaluated like f.
+        """
+        if range is None and numpy.ndim(bins) == 0:
+            range = tuple(float(v) for v in self._range())
+        edges = numpy.histogram_bin_edges([], bins=bins, range=range)
+        weight = OuterGrid(weights, *self.vectors) if weights is not None else None
+        counts = None
+        for box, values in self.blocks():
+            w = weight.evaluate(box).reshape(-1) if weight is not None else None
+            part = numpy.histogram(values.reshape(-1), bins=edges, weights=w)[0]
+            counts = part if counts is None else counts + part
+        return counts, edges
+
+    def where(self, condition):
+        """(index, values) for the cells where condition(values) is true.
+
+        index is a tuple of per-axis coordinate arrays in C order, like
+        numpy.nonzero on the full product.
+        """
+        found, kept = [[] for i in self.shape], []
+        for box, values in self.blocks():
+            hits = numpy.nonzero(condition(values))
+            for k, s in enumerate(box):
+                found[k].append(hits[k] + s.start)
+            kept.append(values[hits])
+        return tuple(numpy.concatenate(f).astype(numpy.intp) for f in found), numpy.concatenate(kept)
+
+
+def outer(f, *vectors, **kwargs):
+    """OuterGrid(f, *vectors): a lazy f(*numpy.ix_(*vectors))."""
+    return OuterGrid(f, *vectors, **kwargs)
+
+
+class OuterGridTest(unittest.TestCase):
+
+    def test_tutorial_ix_sum(self):
+        a = numpy.array([1, 2, 3, 4])
+        b = numpy.array([5, 6, 7])
+        c = numpy.array([8, 9, 10, 11, 12])
+        ax, bx, cx = numpy.ix_(a, b, c)
+        full = ax + bx + cx
+        for block_bytes in (8, 48, 1 << 20):
+            grid = outer(lambda x, y, z: x + y + z, a, b, c, block_bytes=block_bytes)
+            numpy.testing.assert_array_equal(numpy.asarray(grid), full)
+            self.assertEqual(grid.sum(), full.sum())
+            for axis in (0, 1, 2, (0, 2), (-1, 1)):
+                numpy.testing.assert_array_equal(grid.sum(axis=axis), full.sum(axis=axis))
+                numpy.testing.assert_array_equal(grid.min(axis=axis), full.min(axis=axis))
+                numpy.testing.assert_array_equal(grid.max(axis=axis), full.max(axis=axis))
+            self.assertEqual(grid.argmin(), (0, 0, 0))
+            self.assertEqual(full[grid.argmax()], 4 + 7 + 12)
+
+    def test_boxes_tile_the_grid(self):
+        grid = OuterGrid(numpy.multiply, numpy.arange(7), numpy.arange(5), numpy.arange(3),
+                         block_bytes=8 * 4)
+        seen = numpy.zeros(grid.shape, dtype=int)
+        for box in grid.boxes():
+            self.assertTrue(seen[box].size <= 4)
+            seen[box] += 1
+        numpy.testing.assert_array_equal(seen, 1)
+
+    def test_argmin_is_per_axis_index_tuple(self):
+        rng = numpy.random.RandomState(0)
+        x, y, z = rng.normal(size=6), rng.normal(size=4), rng.normal(size=5)
+        f = lambda a, b, c: (a - b) ** 2 + numpy.sin(c) * a
+        full = f(*numpy.ix_(x, y, z))
+        grid = OuterGrid(f, x, y, z, block_bytes=8 * 7)
+        self.assertEqual(grid.argmin(), numpy.unravel_index(full.argmin(), full.shape))
+        for axis in (0, 1, 2, (1, 2)):
+            index = grid.argmin(axis=axis)
+            self.assertEqual(len(index), 3)
+            numpy.testing.assert_array_equal(full[index], full.min(axis=axis))
+        index = grid.argmax(axis=1)
+        numpy.testing.assert_array_equal(index[1], full.argmax(axis=1))
+        numpy.testing.assert_array_equal(index[0], numpy.arange(6)[:, numpy.newaxis])
+
+    def test_histogram_and_where(self):
+        x, y = numpy.linspace(-1, 1, 40), numpy.linspace(0, 2, 30)
+        f = lambda a, b: a * b
+        full = f(*numpy.ix_(x, y))
+        grid = OuterGrid(f, x, y, block_bytes=8 * 50)
+        counts, edges = grid.histogram(bins=7)
+        expected_counts, expected_edges = numpy.histogram(full, bins=7)
+        numpy.testing.assert_array_equal(counts, expected_counts)
+        numpy.testing.assert_array_almost_equal(edges, expected_edges)
+        counts, _ = grid.histogram(bins=[-2, 0, 2], weights=lambda a, b: a + b)
+        numpy.testing.assert_array_almost_equal(
+            counts, numpy.histogram(full, bins=[-2, 0, 2], weights=numpy.add(*numpy.ix_(x, y)))[0])
+        index, values = grid.where(lambda v: v > 1.5)
+        expected = numpy.nonzero(full > 1.5)
+        numpy.testing.assert_array_equal(index[0], expected[0])
+        numpy.testing.assert_array_equal(index[1], expected[1])
+        numpy.testing.assert_array_equal(values, full[expected])
+        self.assertAlmostEqual(grid.mean(), full.mean())
+
+    def test_nan_wins_like_numpy(self):
+        x, y = numpy.array([1., numpy.nan, 0.]), numpy.array([0., 1.])
+        full = numpy.add.outer(x, y)
+        for block_bytes in (8, 16, 1 << 20):
+            grid = OuterGrid(numpy.add, x, y, block_bytes=block_bytes)
+            self.assertEqual(grid.argmin(), numpy.unravel_index(full.argmin(), full.shape))
+            self.assertEqual(grid.argmax(), (1, 0))
+            numpy.testing.assert_array_equal(grid.argmin(axis=0)[0], full.argmin(axis=0))
+            self.assertTrue(numpy.isnan(full[grid.argmin()]) and numpy.isnan(grid.min()))
+
+    def test_histogram_range_in_one_pass(self):
+        calls = []
+
+        def f(a, b):
+            calls.append(1)
+            return a * b
+        grid = OuterGrid(f, numpy.linspace(-1, 1, 40), numpy.linspace(0, 2, 30),
+                         block_bytes=8 * 400)
+        grid.histogram(bins=5)
+        self.assertEqual(len(calls), 2 * len(list(grid.boxes())))
+
+    def test_never_materialises_large_grids(self):
+        n = 2000
+        grid = OuterGrid(lambda a, b, c: a * b + c, numpy.ones(n), numpy.ones(n),
+                         numpy.arange(n, dtype=float), block_bytes=1 << 20)
+        # 8e9 cells, 64 GB if stored; a fold only ever holds one block of 2**17
+        blocks = grid.boxes()
+        box = next(blocks)
+        self.assertEqual(grid.evaluate(box).size, (1 << 17) // n * n)
+        small = OuterGrid(grid.f, numpy.ones(30), numpy.ones(20), numpy.arange(10.),
+                          block_bytes=8 * 10)
+        numpy.testing.assert_array_equal(small.sum(axis=(0, 1)), 600 * numpy.arange(10.) + 600)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(OuterGridTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,138 @@
+import unittest
+import os
+import shutil
+import tempfile
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import numpy
+from shape_manipulation.chunking import iter_chunks
+from the_basics.streaming import open_output
+
+# rows of the index image expanded per step; keeps the band and its colours in cache
+BAND_BYTES = 1 << 16
+
+
+def _palette(palette):
+    palette = numpy.asarray(palette)
+    if palette.ndim != 2:
+        raise ValueError("palette must be (entries, channels), got shape %s" % (palette.shape,))
+    if palette.min() < 0 or palette.max() > 255:
+        raise ValueError("palette values must fit in uint8")
+    return numpy.ascontiguousarray(palette, dtype=numpy.uint8)
+
+
+def apply_palette(image, palette, out=None, band_bytes=BAND_BYTES):
+    """palette[image] for a uint8/uint16 index image, written band by band into out.
+
+    out is any uint8 (H, W, channels) target open_output accepts; no wider
+    integer intermediate of the whole frame is built.
+    """
+    image = numpy.asarray(image)
+    if image.dtype not in (numpy.uint8, numpy.uint16):
+        raise TypeError("index image must be uint8 or uint16, got %s" % image.dtype)
+    palette = _palette(palette)
+    shape = image.shape + palette.shape[1:]
+    out = open_output(out, shape, numpy.uint8, exact_dtype=True)
+    if image.size == 0:
+        return out
+    for band in iter_chunks(image, max_bytes=band_bytes):
+        if band.view.size and band.view.max() >= palette.shape[0]:
+            raise IndexError("index %d is out of range for a palette of %d entries"
+                             % (band.view.max(), palette.shape[0]))
+        # indices were checked above, so take can write straight into out unbuffered
+        numpy.take(palette, band.view, axis=0, out=out[band.start:band.stop], mode='clip')
+    return out
+
+
+def map_frames(frames, palette, outputs=None, threads=None, band_bytes=BAND_BYTES):
+    """Colour a sequence of index frames, yielding each result in order.
+
+    outputs, if given, supplies the buffer for each frame (e.g. the slices of a
+    memmapped (T, H, W, 3) array). threads > 1 colours that many frames at once.
+    """
+    palette = _palette(palette)
+    if outputs is None:
+        jobs = ((frame, None) for frame in frames)
+    else:
+        jobs = zip(frames, outputs)
+
+    def colour(job):
+        return apply_palette(job[0], palette, job[1], band_bytes)
+
+    if threads is None or threads <= 1:
+        for job in jobs:
+            yield colour(job)
+        return
+    # at most `threads` frames are read ahead of the consumer
+    pool = ThreadPool(threads)
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(colour, (job,)))
+            if len(pending) == threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+class PaletteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.palette = numpy.array([[0, 0, 0],
+                                    [255, 0, 0],
+                                    [0, 255, 0],
+                                    [0, 0, 255],
+                                    [255, 255, 255]])
+
+    def test_tutorial_image(self):
+        image = numpy.array([[0, 1, 2, 0], [0, 3, 4, 0]], dtype=numpy.uint8)
+        colour_image = apply_palette(image, self.palette)
+        self.assertEqual(colour_image.dtype, numpy.uint8)
+        numpy.testing.assert_array_equal(colour_image, self.palette[image])
+
+    def test_uint16_in_many_bands(self):
+        rng = numpy.random.RandomState(0)
+        palette = rng.randint(0, 256, size=(1000, 4))
+        image = rng.randint(0, 1000, size=(97, 31)).astype(numpy.uint16)
+        numpy.testing.assert_array_equal(apply_palette(image, palette, band_bytes=100),
+                                         palette[image])
+
+    def test_into_memmap(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            image = numpy.random.RandomState(1).randint(0, 5, size=(40, 30)).astype(numpy.uint8)
+            out = apply_palette(image, self.palette, out=os.path.join(tmp, 'frame.npy'),
+                                band_bytes=64)
+            self.assertTrue(isinstance(out, numpy.memmap))
+            numpy.testing.assert_array_equal(out, self.palette[image])
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_rejects_bad_input(self):
+        image = numpy.array([[0, 5]], dtype=numpy.uint8)
+        self.assertRaises(IndexError, apply_palette, image, self.palette)
+        self.assertRaises(TypeError, apply_palette, image.astype(int), self.palette)
+        self.assertRaises(ValueError, apply_palette, image, self.palette * 2)
+        self.assertRaises(ValueError, apply_palette, image[:, :1], self.palette,
+                          numpy.empty((1, 1, 3), dtype=int))
+
+    def test_frame_sequences(self):
+        rng = numpy.random.RandomState(2)
+        frames = rng.randint(0, 5, size=(6, 20, 10)).astype(numpy.uint8)
+        expected = self.palette[frames]
+        for threads in (None, 3):
+            results = list(map_frames(iter(frames), self.palette, threads=threads))
+            numpy.testing.assert_array_equal(numpy.array(results), expected)
+        out = numpy.zeros((6, 20, 10, 3), dtype=numpy.uint8)
+        for result in map_frames(frames, self.palette, outputs=out, threads=2):
+            self.assertTrue(numpy.shares_memory(result, out))
+        numpy.testing.assert_array_equal(out, expected)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(PaletteTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,512 @@
+"""Mandelbrot tiles over HTTP, computed in a process pool and cached.
+
+    python -m fancy_indexing_and_index_tricks.tile_server --port 8080
+    python -m fancy_indexing_and_index_tricks.tile_server --unix /tmp/tiles.sock --disk /tmp/tiles
+
+GET /tile/{zoom}/{x}/{y}?maxit=N returns the tile as .npy bytes; GET /metrics
+returns request counts, hit rates and latency percentiles as JSON.
+"""
+import unittest
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+from fancy_indexing_and_index_tricks.mandelbrot_engine import escape_time, mandelbrot
+from fancy_indexing_and_index_tricks.mandelbrot_render import DEFAULT_VIEWPORT
+
+TILE_SIZE = 256
+MAX_ZOOM = 30
+MAX_MAXIT = 10000
+CACHE_BYTES = 1 << 28
+# latencies kept for the percentiles in /metrics
+LATENCY_WINDOW = 10000
+
+
+class TileKey(namedtuple('TileKey', 'zoom x y maxit')):
+    """Tile (x, y) of the 2**zoom by 2**zoom tiling of the default viewport."""
+
+    __slots__ = ()
+
+    def filename(self):
+        return '%d_%d_%d_%d.npy' % self
+
+
+def compute_tile(key, tile_size=TILE_SIZE):
+    """divtime for one tile: the matching block of mandelbrot(n, n, maxit), n = tile_size * 2**zoom.
+
+    Module level so that it can be sent to a process pool.
+    """
+    n = tile_size << key.zoom
+    rows = (key.y * tile_size, (key.y + 1) * tile_size)
+    cols = (key.x * tile_size, (key.x + 1) * tile_size)
+    return escape_time(DEFAULT_VIEWPORT.grid(n, n, rows, cols), key.maxit)
+
+
+class TileCache(object):
+    """Tiles held in memory up to max_bytes, least recently used dropped first.
+
+    With a directory, every tile is also written there as <zoom>_<x>_<y>_<maxit>.npy
+    and a memory miss falls back to that file before the tile is recomputed.
+    get/put do the disk work in the calling thread; inside an event loop use
+    lookup, then load/store, which run it in the loop's default executor.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._tiles = OrderedDict()
+        self.nbytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.filename())
+
+    def lookup(self, key):
+        """The tile if it is in memory, else None (not counted as a miss)."""
+        tile = self._tiles.pop(key, None)
+        if tile is not None:
+            self._tiles[key] = tile
+            self.memory_hits += 1
+        return tile
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        try:
+            return numpy.load(self._path(key))
+        except IOError:
+            return None
+
+    def _write(self, key, tile):
+        if self.directory is None:
+            return
+        # written under a temporary name and renamed, so readers never see half a tile
+        path = self._path(key)
+        partial = path + '.%d.part' % os.getpid()
+        with open(partial, 'wb') as f:
+            numpy.save(f, tile)
+        os.replace(partial, path)
+
+    def _loaded(self, key, tile):
+        if tile is None:
+            self.misses += 1
+        else:
+            self.disk_hits += 1
+            self._remember(key, tile)
+        return tile
+
+    def get(self, key):
+        tile = self.lookup(key)
+        return tile if tile is not None else self._loaded(key, self._read(key))
+
+    def put(self, key, tile):
+        self._remember(key, tile)
+        self._write(key, tile)
+
+    async def load(self, key):
+        """After a lookup miss: the tile from the disk tier, or None (a miss)."""
+        tile = None
+        if self.directory is not None:
+            tile = await asyncio.get_running_loop().run_in_executor(None, self._read, key)
+        return self._loaded(key, tile)
+
+    async def store(self, key, tile):
+        self._remember(key, tile)
+        if self.directory is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, key, tile)
+
+    def _remember(self, key, tile):
+        if key in self._tiles:
+            self.nbytes -= self._tiles.pop(key).nbytes
+        self._tiles[key] = tile
+        self.nbytes += tile.nbytes
+        while self.nbytes > self.max_bytes and self._tiles:
+            self.nbytes -= self._tiles.popitem(last=False)[1].nbytes
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+
+def _npy_bytes(tile):
+    buf = io.BytesIO()
+    numpy.save(buf, tile)
+    return buf.getvalue()
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_tile_path(target, tile_size=TILE_SIZE, default_maxit=20):
+    """TileKey for '/tile/{zoom}/{x}/{y}?maxit=N', or BadRequest."""
+    path, _, query = target.partition('?')
+    parts = path.strip('/').split('/')
+    if len(parts) != 4 or parts[0] != 'tile':
+        raise BadRequest("expected /tile/{zoom}/{x}/{y}, got %s" % path)
+    params = dict(p.partition('=')[::2] for p in query.split('&') if p)
+    try:
+        zoom, x, y = (int(p) for p in parts[1:])
+        maxit = int(params.get('maxit', default_maxit))
+    except ValueError:
+        raise BadRequest("tile coordinates and maxit must be integers: %s" % target)
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise BadRequest("zoom must be between 0 and %d, got %d" % (MAX_ZOOM, zoom))
+    if not (0 <= x < 1 << zoom and 0 <= y < 1 << zoom):
+        raise BadRequest("tile (%d, %d) is outside the %d x %d tiles of zoom %d"
+                         % (x, y, 1 << zoom, 1 << zoom, zoom))
+    if not 1 <= maxit <= MAX_MAXIT:
+        raise BadRequest("maxit must be between 1 and %d, got %d" % (MAX_MAXIT, maxit))
+    return TileKey(zoom, x, y, maxit)
+
+
+class TileServer(object):
+    """asyncio HTTP front end for compute_tile.
+
+    Misses go to executor (a ProcessPoolExecutor of processes workers unless
+    one is given); requests for a tile that is already being loaded from disk
+    or computed wait on the same future instead of starting another one.
+    """
+
+    def __init__(self, cache=None, executor=None, processes=None, tile_size=TILE_SIZE):
+        self.cache = cache if cache is not None else TileCache()
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ProcessPoolExecutor(processes)
+        self.tile_size = tile_size
+        self._pending = {}
+        self._server = None
+        self._connections = set()
+        self.requests = 0
+        self.errors = 0
+        self.computed = 0
+        self.coalesced = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    async def get_tile(self, key):
+        tile = self.cache.lookup(key)
+        if tile is not None:
+            return tile
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+        else:
+            pending = self._pending[key] = asyncio.ensure_future(self._fetch(key))
+            pending.add_done_callback(lambda done: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, key):
+        # the disk tier, then the pool; file I/O stays off the event loop
+        tile = await self.cache.load(key)
+        if tile is None:
+            loop = asyncio.get_running_loop()
+            tile = await loop.run_in_executor(self.executor, compute_tile, key, self.tile_size)
+            self.computed += 1
+            await self.cache.store(key, tile)
+        return tile
+
+    def metrics(self):
+        cache = self.cache
+        # requests that waited on another's load or computation count as lookups, not hits
+        lookups = cache.memory_hits + cache.disk_hits + cache.misses + self.coalesced
+        hits = cache.memory_hits + cache.disk_hits
+        latencies = numpy.array(self.latencies, dtype=float)
+        if len(latencies):
+            p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99])
+        else:
+            p50 = p90 = p99 = None
+        return {'requests': self.requests, 'errors': self.errors,
+                'computed': self.computed, 'coalesced': self.coalesced,
+                'in_flight': len(self._pending),
+                'memory_hits': cache.memory_hits, 'disk_hits': cache.disk_hits,
+                'misses': cache.misses,
+                'hit_rate': hits / float(lookups) if lookups else None,
+                'cached_tiles': len(cache), 'cached_bytes': cache.nbytes,
+                'evictions': cache.evictions,
+                'latency_s': {'p50': p50, 'p90': p90, 'p99': p99,
+                              'max': float(latencies.max()) if len(latencies) else None}}
+
+    async def respond(self, method, target):
+        """(status, content type, body) for one request."""
+        if method != 'GET':
+            return 405, 'text/plain', b'only GET is supported\n'
+        if target.partition('?')[0].rstrip('/') == '/metrics':
+            return 200, 'application/json', json.dumps(self.metrics()).encode('ascii')
+        try:
+            key = parse_tile_path(target, self.tile_size)
+        except BadRequest as e:
+            return (400 if target.startswith('/tile/') else 404), 'text/plain', \
+                (str(e) + '\n').encode('ascii')
+        start = time.time()
+        tile = await self.get_tile(key)
+        self.latencies.append(time.time() - start)
+        return 200, 'application/x-npy', _npy_bytes(tile)
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive; just enough for GET requests without bodies
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if not header.strip():
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    status, ctype, body = 400, 'text/plain', b'malformed request line\n'
+                    version, headers['connection'] = 'HTTP/1.0', 'close'
+                else:
+                    self.requests += 1
+                    try:
+                        status, ctype, body = await self.respond(method, target)
+                    except Exception as e:
+                        status, ctype, body = 500, 'text/plain', (repr(e) + '\n').encode('utf-8')
+                if status >= 400:
+                    self.errors += 1
+                close = (headers.get('connection') == 'close'
+                         or (version == 'HTTP/1.0' and headers.get('connection') != 'keep-alive'))
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n%s\r\n'
+                              % (status, _REASONS.get(status, 'Error'), ctype, len(body),
+                                 'Connection: close\r\n' if close else '')).encode('latin-1'))
+                writer.write(body)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self._connections.discard(asyncio.current_task())
+
+    async def start(self, host='127.0.0.1', port=8080, unix_path=None):
+        """Listen on host:port, or on the Unix socket unix_path; port 0 picks a free port."""
+        # start the pool workers before any socket exists: workers forked later
+        # would inherit open client connections and hold them open after close
+        await asyncio.get_running_loop().run_in_executor(self.executor, os.getpid)
+        if unix_path is not None:
+            self._server = await asyncio.start_unix_server(self.handle, unix_path)
+        else:
+            self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()
+
+    async def close(self, timeout=1.):
+        """Stop listening, give open connections timeout seconds to finish, then cancel them."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._connections:
+            done, stragglers = await asyncio.wait(self._connections, timeout=timeout)
+            for task in stragglers:
+                task.cancel()
+        if self._own_executor:
+            self.executor.shutdown()
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class Client(object):
+    """One keep-alive HTTP connection to a TileServer (over TCP or a Unix socket)."""
+
+    def __init__(self, host='127.0.0.1', port=8080, unix_path=None):
+        self.host, self.port, self.unix_path = host, port, unix_path
+        self._reader = self._writer = None
+
+    async def _connect(self):
+        if self.unix_path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.unix_path)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def get(self, target):
+        """(status, body bytes) for GET target."""
+        if self._writer is None:
+            await self._connect()
+        self._writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\n\r\n'
+                            % (target, self.host)).encode('latin-1'))
+        await self._writer.drain()
+        status = int((await self._reader.readline()).split()[1])
+        length, close = 0, False
+        while True:
+            header = (await self._reader.readline()).decode('latin-1')
+            if not header.strip():
+                break
+            name, _, value = header.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+            elif name.strip().lower() == 'connection':
+                close = value.strip().lower() == 'close'
+        body = await self._reader.readexactly(length)
+        if close:
+            await self.close()
+        return status, body
+
+    async def tile(self, zoom, x, y, maxit=20):
+        status, body = await self.get('/tile/%d/%d/%d?maxit=%d' % (zoom, x, y, maxit))
+        if status != 200:
+            raise ValueError("tile request failed with %d: %s" % (status, body.decode('utf-8')))
+        return numpy.load(io.BytesIO(body))
+
+    async def metrics(self):
+        return json.loads((await self.get('/metrics'))[1].decode('ascii'))
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._reader = self._writer = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m fancy_indexing_and_index_tricks.tile_server',
+                                     description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--processes', type=int, help='pool size (default: one per CPU)')
+    parser.add_argument('--cache-mb', type=float, default=CACHE_BYTES / 2. ** 20)
+    parser.add_argument('--disk', help='directory for the .npy tile tier')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = TileServer(TileCache(int(args.cache_mb * 2 ** 20), args.disk),
+                            processes=args.processes, tile_size=args.tile_size)
+        await server.start(args.host, args.port, args.unix)
+        sys.stdout.write("serving tiles on %s\n" % (args.unix or '%s:%d' % server.address[:2],))
+        sys.stdout.flush()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+class TileServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_tiles_are_blocks_of_the_full_plane(self):
+        numpy.testing.assert_array_equal(compute_tile(TileKey(0, 0, 0, 30), 64),
+                                         mandelbrot(64, 64, maxit=30))
+        full = mandelbrot(128, 128, maxit=30)
+        numpy.testing.assert_array_equal(compute_tile(TileKey(1, 1, 0, 30), 64), full[:64, 64:])
+        numpy.testing.assert_array_equal(compute_tile(TileKey(1, 0, 1, 30), 64), full[64:, :64])
+
+    def test_parse_tile_path(self):
+        self.assertEqual(parse_tile_path('/tile/3/5/1?maxit=50'), TileKey(3, 5, 1, 50))
+        self.assertEqual(parse_tile_path('/tile/0/0/0'), TileKey(0, 0, 0, 20))
+        for bad in ('/tile/1/2/0', '/tile/a/0/0', '/tile/0/0/0?maxit=0', '/tiles/0/0/0',
+                    '/tile/0/0'):
+            self.assertRaises(BadRequest, parse_tile_path, bad)
+
+    def test_cache_is_byte_bounded_with_disk_tier(self):
+        cache = TileCache(max_bytes=2 * 64 * 64 * 8, directory=os.path.join(self.tmp, 'tiles'))
+        keys = [TileKey(1, x, 0, 10) for x in range(2)] + [TileKey(2, 0, 0, 10)]
+        for key in keys:
+            self.assertTrue(cache.get(key) is None)
+            cache.put(key, compute_tile(key, 64))
+        self.assertEqual((len(cache), cache.evictions), (2, 1))
+        self.assertFalse(keys[0] in cache)
+        numpy.testing.assert_array_equal(cache.get(keys[0]), compute_tile(keys[0], 64))
+        self.assertTrue(cache.get(keys[2]) is not None)
+        self.assertEqual((cache.memory_hits, cache.disk_hits, cache.misses), (1, 1, 3))
+        self.assertEqual(sorted(os.listdir(cache.directory)),
+                         sorted(key.filename() for key in keys))
+
+    def test_http_round_trip_with_coalescing(self):
+        async def scenario(unix_path):
+            server = TileServer(TileCache(directory=tempfile.mkdtemp(dir=self.tmp)),
+                                processes=1, tile_size=32)
+            await server.start(port=0, unix_path=unix_path)
+            host, port = server.address[:2] if unix_path is None else (None, None)
+            clients = [Client(host, port, unix_path) for i in range(4)]
+            try:
+                tiles = await asyncio.gather(*[c.tile(1, 1, 1, maxit=25) for c in clients])
+                again = await clients[0].tile(1, 1, 1, maxit=25)
+                status, body = await clients[1].get('/tile/1/2/0')
+                missing, _ = await clients[2].get('/nowhere')
+                metrics = await clients[3].metrics()
+            finally:
+                for c in clients:
+                    await c.close()
+                await server.close()
+            return tiles + [again], status, missing, metrics
+
+        for unix_path in (None, os.path.join(self.tmp, 'tiles.sock')):
+            tiles, status, missing, metrics = asyncio.run(scenario(unix_path))
+            expected = mandelbrot(64, 64, maxit=25)[32:, 32:]
+            for tile in tiles:
+                numpy.testing.assert_array_equal(tile, expected)
+            self.assertEqual((status, missing), (400, 404))
+            # one computation shared by four concurrent requests, then one memory hit;
+            # /metrics counts itself among the requests
+            self.assertEqual((metrics['requests'], metrics['errors']), (8, 2))
+            self.assertEqual((metrics['computed'], metrics['coalesced']), (1, 3))
+            self.assertEqual((metrics['memory_hits'], metrics['misses']), (1, 1))
+            self.assertAlmostEqual(metrics['hit_rate'], 0.2)
+            self.assertTrue(metrics['latency_s']['p50'] >= 0)
+
+    def test_disk_tier_after_restart(self):
+        directory = os.path.join(self.tmp, 'disk')
+        key = TileKey(2, 3, 1, 15)
+
+        async def scenario():
+            warm = TileCache(directory=directory)
+            await warm.store(key, compute_tile(key, 16))
+            server = TileServer(TileCache(directory=directory), processes=1, tile_size=16)
+            try:
+                tiles = await asyncio.gather(*[server.get_tile(key) for i in range(3)])
+            finally:
+                await server.close()
+            return tiles, server.metrics()
+
+        tiles, metrics = asyncio.run(scenario())
+        for tile in tiles:
+            numpy.testing.assert_array_equal(tile, mandelbrot(64, 64, maxit=15)[16:32, 48:])
+        self.assertEqual((metrics['disk_hits'], metrics['coalesced'], metrics['computed']),
+                         (1, 2, 0))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        sys.exit(main())
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TileServerTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,202 @@
+import unittest
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+import numpy
+from shape_manipulation.chunking import iter_chunks
+from the_basics.streaming import BLOCK_BYTES, open_array
+
+TopK = namedtuple('TopK', 'indices values companions')
+TopK.__doc__ = """Result of top_k: k indices along the axis, the values there and
+the companion arrays gathered at the same positions."""
+
+
+def _select(values, k, largest):
+    # positions of the k largest (smallest) entries along axis 0, in no particular order
+    n = values.shape[0]
+    if k >= n:
+        return numpy.broadcast_to(numpy.arange(n).reshape((n,) + (1,) * (values.ndim - 1)),
+                                  values.shape).copy()
+    if largest:
+        return numpy.argpartition(values, n - k, axis=0)[n - k:]
+    return numpy.argpartition(values, k - 1, axis=0)[:k]
+
+
+def _aligned(companion, axis, ndim):
+    # a companion is either 1-D along axis (like `time`) or shaped like the data
+    companion = numpy.asarray(companion)
+    if companion.ndim == 1 and ndim > 1:
+        return companion.reshape((-1,) + (1,) * (ndim - 1))
+    return numpy.moveaxis(companion, axis, 0)
+
+
+def _gather(aligned, index):
+    if aligned.shape[1:] != index.shape[1:]:
+        aligned = numpy.broadcast_to(aligned, aligned.shape[:1] + index.shape[1:])
+    return numpy.take_along_axis(aligned, index, axis=0)
+
+
+def _finish(index, values, companions, axis, largest, sort):
+    if sort:
+        order = numpy.argsort(values, axis=0, kind='stable')
+        if largest:
+            order = order[::-1]
+        index = numpy.take_along_axis(index, order, axis=0)
+        values = numpy.take_along_axis(values, order, axis=0)
+        companions = [numpy.take_along_axis(c, order, axis=0) for c in companions]
+    return TopK(numpy.moveaxis(index, 0, axis), numpy.moveaxis(values, 0, axis),
+                tuple(numpy.moveaxis(c, 0, axis) for c in companions))
+
+
+def _check_k(k):
+    if k < 1:
+        raise ValueError("k must be at least 1, got %d" % k)
+
+
+def top_k(data, k, axis=0, largest=True, sort=True, companions=()):
+    """The k largest (or smallest) entries of data along axis, without a full sort.
+
+    argpartition picks the k positions in O(n); only those k are then sorted.
+    The result's indices/values have length min(k, n) along axis, and each
+    companion (1-D along axis, like `time`, or shaped like data) is gathered
+    at the same positions:
+
+        ind, top, (when,) = top_k(data, 1, axis=0, companions=[time])
+    """
+    _check_k(k)
+    data = numpy.asarray(data)
+    axis = axis % data.ndim
+    values = numpy.moveaxis(data, axis, 0)
+    index = _select(values, k, largest)
+    aligned = [_aligned(c, axis, data.ndim) for c in companions]
+    return _finish(index, numpy.take_along_axis(values, index, axis=0),
+                   [_gather(c, index) for c in aligned], axis, largest, sort)
+
+
+class StreamingTopK(object):
+    """A running top-k along axis over blocks of an array fed in order.
+
+    Only k candidates per lane (plus one block) are held at a time, so the
+    whole array never needs to be in memory.
+    """
+
+    def __init__(self, k, axis=0, largest=True):
+        _check_k(k)
+        self.k = k
+        self.axis = axis
+        self.largest = largest
+        self.seen = 0
+        self._index = None
+        self._values = None
+        self._companions = None
+
+    def update(self, block, companions=()):
+        """Add the next block along axis; companions are the matching blocks of each companion."""
+        block = numpy.asarray(block)
+        axis = self.axis % block.ndim
+        values = numpy.moveaxis(block, axis, 0)
+        if values.shape[0] == 0:
+            return self
+        index = _select(values, self.k, self.largest)
+        aligned = [_aligned(c, axis, block.ndim) for c in companions]
+        candidates = [index + self.seen, numpy.take_along_axis(values, index, axis=0)]
+        candidates.extend(_gather(c, index) for c in aligned)
+        self.seen += values.shape[0]
+        if self._index is not None:
+            previous = [self._index, self._values] + self._companions
+            candidates = [numpy.concatenate([old, new]) for old, new in zip(previous, candidates)]
+            keep = _select(candidates[1], self.k, self.largest)
+            candidates = [numpy.take_along_axis(c, keep, axis=0) for c in candidates]
+        self._index, self._values, self._companions = candidates[0], candidates[1], candidates[2:]
+        return self
+
+    def result(self, sort=True):
+        if self._index is None:
+            raise ValueError("no data has been added")
+        axis = self.axis % self._values.ndim
+        return _finish(self._index, self._values, self._companions, axis, self.largest, sort)
+
+
+def streaming_top_k(source, k, axis=0, largest=True, companions=(), block_bytes=BLOCK_BYTES):
+    """top_k of an array or .npy path read block by block along axis (through a memmap)."""
+    a = open_array(source)
+    axis = axis % a.ndim
+    companions = [open_array(c) for c in companions]
+    running = StreamingTopK(k, axis, largest)
+    for chunk in iter_chunks(a, axis=axis, max_bytes=block_bytes):
+        parts = []
+        for c in companions:
+            if c.ndim == 1:
+                parts.append(c[chunk.start:chunk.stop])
+            else:
+                parts.append(c[(slice(None),) * axis + (slice(chunk.start, chunk.stop),)])
+        running.update(chunk.view, parts)
+    return running.result()
+
+
+class TopKTest(unittest.TestCase):
+
+    def test_tutorial_argmax_gather(self):
+        time = numpy.linspace(20, 145, 5)
+        data = numpy.sin(numpy.arange(20).reshape(5, 4))
+        ind = data.argmax(axis=0)
+        index, values, (time_max,) = top_k(data, 1, axis=0, companions=[time])
+        numpy.testing.assert_array_equal(index[0], ind)
+        numpy.testing.assert_array_equal(values[0], data[ind, range(data.shape[1])])
+        numpy.testing.assert_array_equal(time_max[0], time[ind])
+
+    def test_matches_full_sort(self):
+        rng = numpy.random.RandomState(0)
+        data = rng.normal(size=(300, 40))
+        for axis in (0, 1):
+            for largest in (True, False):
+                index, values, (same,) = top_k(data, 7, axis=axis, largest=largest,
+                                               companions=[data * 2])
+                expected = numpy.sort(data, axis=axis)
+                expected = numpy.take(expected, range(-1, -8, -1) if largest else range(7),
+                                      axis=axis)
+                numpy.testing.assert_array_equal(values, expected)
+                numpy.testing.assert_array_equal(numpy.take_along_axis(data, index, axis), values)
+                numpy.testing.assert_array_equal(same, values * 2)
+
+    def test_k_at_least_length(self):
+        data = numpy.array([[3, 1], [2, 5]])
+        index, values, _ = top_k(data, 5, axis=1)
+        numpy.testing.assert_array_equal(values, [[3, 1], [5, 2]])
+        numpy.testing.assert_array_equal(index, [[0, 1], [1, 0]])
+        self.assertRaises(ValueError, top_k, data, 0)
+
+    def test_streaming_matches_in_memory(self):
+        rng = numpy.random.RandomState(1)
+        data = rng.normal(size=(1000, 6))
+        time = numpy.arange(1000) * 0.5
+        expected = top_k(data, 5, axis=0, companions=[time])
+        running = StreamingTopK(5, axis=0)
+        for lo in range(0, 1000, 64):
+            running.update(data[lo:lo + 64], [time[lo:lo + 64]])
+        result = running.result()
+        for got, want in zip(result[:2] + result[2], expected[:2] + expected[2]):
+            numpy.testing.assert_array_equal(got, want)
+        self.assertRaises(ValueError, StreamingTopK(3).result)
+
+    def test_streaming_from_npy(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            rng = numpy.random.RandomState(2)
+            data = rng.normal(size=(8, 500))
+            path = os.path.join(tmp, 'data.npy')
+            numpy.save(path, data)
+            result = streaming_top_k(path, 3, axis=1, largest=False, companions=[data + 1],
+                                     block_bytes=8 * 8 * 37)
+            expected = top_k(data, 3, axis=1, largest=False)
+            numpy.testing.assert_array_equal(result.indices, expected.indices)
+            numpy.testing.assert_array_equal(result.companions[0], expected.values + 1)
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(TopKTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
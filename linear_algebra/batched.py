@@ -0,0 +1,272 @@
+import unittest
+import numpy
+
+# largest n handled by the closed-form (adjugate) kernels
+CLOSED_FORM_MAX = 4
+
+
+def _stack(a):
+    a = numpy.asarray(a)
+    if a.ndim != 3 or a.shape[1] != a.shape[2]:
+        raise ValueError("expected an (N, n, n) stack of square matrices, got %s" % (a.shape,))
+    return a.astype(numpy.result_type(a.dtype, float), copy=False)
+
+
+def _det_adjugate(a):
+    # closed forms on the (n, n, N) component planes so every term is a contiguous vector op
+    n = a.shape[-1]
+    m = numpy.ascontiguousarray(a.transpose(1, 2, 0))
+    adj = numpy.empty_like(m)
+    if n == 1:
+        det = m[0, 0]
+        adj[0, 0] = 1
+    elif n == 2:
+        det = m[0, 0]*m[1, 1] - m[0, 1]*m[1, 0]
+        adj[0, 0], adj[0, 1] = m[1, 1], -m[0, 1]
+        adj[1, 0], adj[1, 1] = -m[1, 0], m[0, 0]
+    elif n == 3:
+        # the columns of the adjugate are cross products of the rows
+        for j, (p, q) in enumerate(((1, 2), (2, 0), (0, 1))):
+            adj[0, j] = m[p, 1]*m[q, 2] - m[p, 2]*m[q, 1]
+            adj[1, j] = m[p, 2]*m[q, 0] - m[p, 0]*m[q, 2]
+            adj[2, j] = m[p, 0]*m[q, 1] - m[p, 1]*m[q, 0]
+        det = m[0, 0]*adj[0, 0] + m[0, 1]*adj[1, 0] + m[0, 2]*adj[2, 0]
+    else:
+        # 2x2 minors of the top (s) and bottom (c) row pairs
+        s0 = m[0, 0]*m[1, 1] - m[1, 0]*m[0, 1]
+        s1 = m[0, 0]*m[1, 2] - m[1, 0]*m[0, 2]
+        s2 = m[0, 0]*m[1, 3] - m[1, 0]*m[0, 3]
+        s3 = m[0, 1]*m[1, 2] - m[1, 1]*m[0, 2]
+        s4 = m[0, 1]*m[1, 3] - m[1, 1]*m[0, 3]
+        s5 = m[0, 2]*m[1, 3] - m[1, 2]*m[0, 3]
+        c5 = m[2, 2]*m[3, 3] - m[3, 2]*m[2, 3]
+        c4 = m[2, 1]*m[3, 3] - m[3, 1]*m[2, 3]
+        c3 = m[2, 1]*m[3, 2] - m[3, 1]*m[2, 2]
+        c2 = m[2, 0]*m[3, 3] - m[3, 0]*m[2, 3]
+        c1 = m[2, 0]*m[3, 2] - m[3, 0]*m[2, 2]
+        c0 = m[2, 0]*m[3, 1] - m[3, 0]*m[2, 1]
+        det = s0*c5 - s1*c4 + s2*c3 + s3*c2 - s4*c1 + s5*c0
+        adj[0, 0] = m[1, 1]*c5 - m[1, 2]*c4 + m[1, 3]*c3
+        adj[0, 1] = -m[0, 1]*c5 + m[0, 2]*c4 - m[0, 3]*c3
+        adj[0, 2] = m[3, 1]*s5 - m[3, 2]*s4 + m[3, 3]*s3
+        adj[0, 3] = -m[2, 1]*s5 + m[2, 2]*s4 - m[2, 3]*s3
+        adj[1, 0] = -m[1, 0]*c5 + m[1, 2]*c2 - m[1, 3]*c1
+        adj[1, 1] = m[0, 0]*c5 - m[0, 2]*c2 + m[0, 3]*c1
+        adj[1, 2] = -m[3, 0]*s5 + m[3, 2]*s2 - m[3, 3]*s1
+        adj[1, 3] = m[2, 0]*s5 - m[2, 2]*s2 + m[2, 3]*s1
+        adj[2, 0] = m[1, 0]*c4 - m[1, 1]*c2 + m[1, 3]*c0
+        adj[2, 1] = -m[0, 0]*c4 + m[0, 1]*c2 - m[0, 3]*c0
+        adj[2, 2] = m[3, 0]*s4 - m[3, 1]*s2 + m[3, 3]*s0
+        adj[2, 3] = -m[2, 0]*s4 + m[2, 1]*s2 - m[2, 3]*s0
+        adj[3, 0] = -m[1, 0]*c3 + m[1, 1]*c1 - m[1, 2]*c0
+        adj[3, 1] = m[0, 0]*c3 - m[0, 1]*c1 + m[0, 2]*c0
+        adj[3, 2] = -m[3, 0]*s3 + m[3, 1]*s1 - m[3, 2]*s0
+        adj[3, 3] = m[2, 0]*s3 - m[2, 1]*s1 + m[2, 2]*s0
+    return det.copy(), adj.transpose(2, 0, 1)
+
+
+def _singular(det, a, log=False):
+    # |det| compared against Hadamard's bound (product of the row norms)
+    n = a.shape[-1]
+    norms = numpy.sqrt(numpy.einsum('...ij,...ij->...i', a, a))
+    tol = n * numpy.finfo(a.dtype).eps
+    if log:
+        sign, logdet = det
+        # a zero row gives log(0) = -inf in both, and -inf - -inf is NaN (singular)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            bound = numpy.log(norms).sum(axis=-1)
+            return (sign == 0) | ~(logdet - bound > numpy.log(tol))
+    return ~(numpy.abs(det) > tol * norms.prod(axis=-1))
+
+
+def _chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+def det_batched(a):
+    """Determinants of an (N, n, n) stack."""
+    a = _stack(a)
+    if a.shape[-1] <= CLOSED_FORM_MAX:
+        return _det_adjugate(a)[0]
+    return numpy.linalg.det(a)
+
+
+def inv_batched(a, chunk_size=65536):
+    """Inverses of an (N, n, n) stack and a mask of the singular matrices.
+
+    Singular matrices do not raise; their inverses are filled with NaN.
+    """
+    a = _stack(a)
+    n = a.shape[-1]
+    if n <= CLOSED_FORM_MAX:
+        det, adj = _det_adjugate(a)
+        singular = _singular(det, a)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            inv = adj / det[:, numpy.newaxis, numpy.newaxis]
+        inv[singular] = numpy.nan
+        return inv, singular
+
+    inv = numpy.full(a.shape, numpy.nan, dtype=a.dtype)
+    singular = numpy.empty(a.shape[0], dtype=bool)
+    for s in _chunks(a.shape[0], chunk_size):
+        block = a[s]
+        singular[s] = _singular(numpy.linalg.slogdet(block), block, log=True)
+        ok = numpy.flatnonzero(~singular[s]) + s.start
+        if ok.size:
+            inv[ok] = numpy.linalg.inv(a[ok])
+    return inv, singular
+
+
+def solve_batched(a, b, chunk_size=65536):
+    """Solve a[i] x[i] = b[i] for an (N, n, n) stack; b is (N, n) or (N, n, k).
+
+    Returns x and a mask of the singular systems, whose solutions are NaN.
+    """
+    a = _stack(a)
+    b = numpy.asarray(b)
+    vector = b.ndim == 2
+    if vector:
+        b = b[:, :, numpy.newaxis]
+    if b.ndim != 3 or b.shape[:2] != a.shape[:2]:
+        raise ValueError("b has shape %s, expected (%d, %d) or (%d, %d, k)"
+                         % ((b.shape,) + a.shape[:2] + a.shape[:2]))
+    n = a.shape[-1]
+    if n <= CLOSED_FORM_MAX:
+        inv, singular = inv_batched(a)
+        x = numpy.matmul(inv, b)
+    else:
+        dtype = numpy.result_type(a.dtype, b.dtype)
+        x = numpy.full(b.shape, numpy.nan, dtype=dtype)
+        singular = numpy.empty(a.shape[0], dtype=bool)
+        for s in _chunks(a.shape[0], chunk_size):
+            block = a[s]
+            singular[s] = _singular(numpy.linalg.slogdet(block), block, log=True)
+            ok = numpy.flatnonzero(~singular[s]) + s.start
+            if ok.size:
+                x[ok] = numpy.linalg.solve(a[ok], b[ok])
+    if vector:
+        x = x[:, :, 0]
+    return x, singular
+
+
+def _eig2(a):
+    p, q = a[:, 0, 0], a[:, 0, 1]
+    r, s = a[:, 1, 0], a[:, 1, 1]
+    half_trace = (p + s) / 2.
+    root = numpy.sqrt((half_trace**2 - (p*s - q*r)).astype(complex))
+    w = numpy.stack((half_trace + root, half_trace - root), axis=-1)
+
+    # (q, w - p) and (w - s, r) both solve (a - w) v = 0; keep the better scaled one
+    first = numpy.stack((q[:, numpy.newaxis] + 0*w, w - p[:, numpy.newaxis]), axis=1)
+    second = numpy.stack((w - s[:, numpy.newaxis], r[:, numpy.newaxis] + 0*w), axis=1)
+    n1 = numpy.sqrt((numpy.abs(first)**2).sum(axis=1))
+    n2 = numpy.sqrt((numpy.abs(second)**2).sum(axis=1))
+    v = numpy.where((n1 >= n2)[:, numpy.newaxis, :], first, second)
+    norm = numpy.maximum(n1, n2)
+    scale = numpy.abs(a).max(axis=(1, 2))[:, numpy.newaxis]
+    degenerate = norm <= numpy.finfo(float).eps * scale
+    # a multiple of the identity: any basis is an eigenbasis
+    v[:, :, 0][degenerate[:, 0]] = (1, 0)
+    v[:, :, 1][degenerate[:, 1]] = (0, 1)
+    norm[degenerate] = 1
+    v /= norm[:, numpy.newaxis, :]
+    return w, v
+
+
+def eig_batched(a, chunk_size=65536):
+    """Eigenvalues (N, n) and eigenvectors (N, n, n, in columns) of an (N, n, n) stack."""
+    a = _stack(a)
+    if a.shape[-1] == 2:
+        w, v = _eig2(a)
+    else:
+        w = numpy.empty(a.shape[:2], dtype=complex)
+        v = numpy.empty(a.shape, dtype=complex)
+        for s in _chunks(a.shape[0], chunk_size):
+            w[s], v[s] = numpy.linalg.eig(a[s])
+    if not numpy.iscomplexobj(a) and (w.imag == 0).all():
+        return w.real.copy(), v.real.copy()
+    return w, v
+
+
+class BatchedLinearAlgebraTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(0)
+
+    def test_det(self):
+        for n in (1, 2, 3, 4, 6):
+            a = self.rng.normal(size=(50, n, n))
+            numpy.testing.assert_array_almost_equal(det_batched(a), numpy.linalg.det(a))
+
+    def test_inv(self):
+        for n in (1, 2, 3, 4, 5):
+            a = self.rng.normal(size=(40, n, n))
+            inv, singular = inv_batched(a, chunk_size=16)
+            self.assertFalse(singular.any())
+            numpy.testing.assert_array_almost_equal(inv, numpy.linalg.inv(a))
+
+    def test_tutorial_inverse(self):
+        a = numpy.array([[[1., 2.],
+                          [3., 4.]]])
+        inv, singular = inv_batched(a)
+        numpy.testing.assert_array_almost_equal(inv[0], numpy.array([[-2., 1.],
+                                                                     [1.5, -.5]]))
+
+    def test_solve(self):
+        a = numpy.array([[3, 2, -1],
+                         [2, -2, 4],
+                         [-1, 0.5, -1]])
+        x, singular = solve_batched(a[numpy.newaxis], numpy.array([[1, -2, 0]]))
+        numpy.testing.assert_array_almost_equal(x[0], numpy.linalg.solve(a, [1, -2, 0]))
+        for n in (2, 3, 4, 7):
+            a = self.rng.normal(size=(30, n, n))
+            b = self.rng.normal(size=(30, n, 2))
+            x, singular = solve_batched(a, b, chunk_size=8)
+            numpy.testing.assert_array_almost_equal(x, numpy.linalg.solve(a, b))
+
+    def test_singular_mask(self):
+        for n in (2, 3, 6):
+            a = self.rng.normal(size=(5, n, n))
+            a[1, 0] = a[1, 1]
+            a[3] = 0
+            b = self.rng.normal(size=(5, n))
+            x, singular = solve_batched(a, b)
+            numpy.testing.assert_array_equal(singular, [False, True, False, True, False])
+            self.assertTrue(numpy.isnan(x[singular]).all())
+            ok = ~singular
+            numpy.testing.assert_array_almost_equal(
+                x[ok], numpy.linalg.solve(a[ok], b[ok][:, :, numpy.newaxis])[:, :, 0])
+
+    def test_eig(self):
+        for n in (2, 3, 5):
+            a = self.rng.normal(size=(100, n, n))
+            w, v = eig_batched(a, chunk_size=32)
+            numpy.testing.assert_array_almost_equal(numpy.einsum('nij,njk->nik', a, v),
+                                                    v * w[:, numpy.newaxis, :])
+            numpy.testing.assert_array_almost_equal(numpy.sort_complex(w.ravel()),
+                                                    numpy.sort_complex(numpy.linalg.eigvals(a).ravel()))
+
+    def test_eig_special_cases(self):
+        a = numpy.array([[[.8, .3],
+                          [.2, .7]],
+                         [[2., 0.],
+                          [0., 2.]],
+                         [[1., 0.],
+                          [0., 3.]],
+                         [[0., -1.],
+                          [1., 0.]]])
+        w, v = eig_batched(a)
+        self.assertTrue(numpy.iscomplexobj(w))
+        numpy.testing.assert_array_almost_equal(numpy.einsum('nij,njk->nik', a, v),
+                                                v * w[:, numpy.newaxis, :])
+        numpy.testing.assert_array_almost_equal(numpy.abs(numpy.linalg.det(v)) > 0.5, True)
+        w, v = eig_batched(a[:3])
+        self.assertFalse(numpy.iscomplexobj(w))
+        numpy.testing.assert_array_almost_equal(numpy.sort(w[0]), [.5, 1.])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(BatchedLinearAlgebraTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,213 @@
+import unittest
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy
+
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                         'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+class SharedArray(object):
+    """ndarray whose buffer lives in a multiprocessing.shared_memory block.
+
+    spec is the (name, shape, dtype) triple other processes use to attach,
+    so arrays cross process boundaries without their payload being pickled.
+    """
+
+    def __init__(self, shape, dtype=float, name=None):
+        shape = tuple(shape)
+        dtype = numpy.dtype(dtype)
+        nbytes = max(int(numpy.prod(shape)) * dtype.itemsize, 1)
+        self.owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self.owner, size=nbytes)
+        self.array = numpy.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        self.spec = (self._shm.name, shape, dtype.str)
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+
+    @classmethod
+    def copy_of(cls, a):
+        a = numpy.asarray(a)
+        shared = cls(a.shape, a.dtype)
+        shared.array[...] = a
+        return shared
+
+    def close(self):
+        # drop the view first, the block cannot be closed while it is exported
+        self.array = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _init_worker(blas_threads):
+    global _thread_limits
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    _thread_limits = threadpool_limits(blas_threads)
+
+
+def _blas_thread_settings():
+    return dict((k, os.environ.get(k)) for k in BLAS_THREAD_VARIABLES)
+
+
+def _eig_block(task):
+    a_spec, w_spec, v_spec, lo, hi, hermitian = task
+    a, w, v = SharedArray.attach(a_spec), SharedArray.attach(w_spec), SharedArray.attach(v_spec)
+    try:
+        decompose = numpy.linalg.eigh if hermitian else numpy.linalg.eig
+        w.array[lo:hi], v.array[lo:hi] = decompose(a.array[lo:hi])
+    finally:
+        for shared in (a, w, v):
+            shared.close()
+    return lo, hi
+
+
+class EigenExecutor(object):
+    """Spread the eigen-decompositions of an (N, n, n) stack over worker processes.
+
+    Workers attach to shared-memory input and output blocks and write their
+    slice of the results in place. blas_threads caps the BLAS/OpenMP threads in
+    each worker (via the usual environment variables, and threadpoolctl when it
+    is installed) so processes * blas_threads can be kept within the core count.
+    """
+
+    def __init__(self, processes=None, blas_threads=1, chunk_size=256, start_method='spawn'):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.blas_threads = blas_threads
+        self.chunk_size = chunk_size
+        # spawned workers read these before importing numpy
+        saved = _blas_thread_settings()
+        os.environ.update((k, str(blas_threads)) for k in BLAS_THREAD_VARIABLES)
+        try:
+            context = multiprocessing.get_context(start_method)
+            self._pool = context.Pool(self.processes, _init_worker, (blas_threads,))
+        finally:
+            for k, value in saved.items():
+                if value is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = value
+
+    def eig(self, a, hermitian=False, out=None):
+        """Eigenvalues and eigenvectors of every matrix in a, as SharedArrays (w, v).
+
+        a may be a SharedArray, which is used in place, or any array, which is
+        copied into a shared block once. out=(w, v) reuses preallocated outputs.
+        The caller closes the returned SharedArrays.
+        """
+        created = not isinstance(a, SharedArray)
+        own_out = out is None
+        shape = numpy.shape(a.array if not created else a)
+        if len(shape) != 3 or shape[1] != shape[2]:
+            raise ValueError("expected an (N, n, n) stack of square matrices, got %s" % (shape,))
+        shared_a = SharedArray.copy_of(a) if created else a
+        dtype = shared_a.array.dtype
+        try:
+            if out is None:
+                if hermitian:
+                    v_dtype = numpy.result_type(dtype, numpy.float64)
+                    w_dtype = numpy.finfo(v_dtype).dtype
+                else:
+                    v_dtype = w_dtype = numpy.result_type(dtype, numpy.complex128)
+                out = (SharedArray(shape[:2], w_dtype), SharedArray(shape, v_dtype))
+            w, v = out
+            tasks = [(shared_a.spec, w.spec, v.spec, lo, min(lo + self.chunk_size, shape[0]),
+                      hermitian) for lo in range(0, shape[0], self.chunk_size)]
+            for _ in self._pool.imap_unordered(_eig_block, tasks):
+                pass
+        except BaseException:
+            # outputs made here are the caller's only on success
+            if own_out and out is not None:
+                for shared in out:
+                    shared.close()
+            raise
+        finally:
+            if created:
+                shared_a.close()
+        return w, v
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EigenExecutorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = EigenExecutor(processes=2, blas_threads=1, chunk_size=16)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.close()
+
+    def test_general_eig(self):
+        a = numpy.random.RandomState(0).normal(size=(50, 4, 4))
+        w, v = self.executor.eig(a)
+        with w, v:
+            numpy.testing.assert_array_almost_equal(numpy.einsum('nij,njk->nik', a, v.array),
+                                                    v.array * w.array[:, numpy.newaxis, :])
+            numpy.testing.assert_array_almost_equal(w.array, numpy.linalg.eigvals(a))
+
+    def test_hermitian_into_preallocated_output(self):
+        m = numpy.random.RandomState(1).normal(size=(40, 3, 3))
+        a = SharedArray.copy_of(m + m.transpose(0, 2, 1))
+        out = (SharedArray((40, 3)), SharedArray((40, 3, 3)))
+        with a, out[0], out[1]:
+            w, v = self.executor.eig(a, hermitian=True, out=out)
+            self.assertTrue(w is out[0] and v is out[1])
+            expected_w, expected_v = numpy.linalg.eigh(a.array)
+            numpy.testing.assert_array_almost_equal(w.array, expected_w)
+            numpy.testing.assert_array_almost_equal(numpy.abs(v.array), numpy.abs(expected_v))
+
+    def test_failure_frees_created_outputs(self):
+        def blocks():
+            # shared_memory blocks on Linux; elsewhere there is nothing to list
+            if not os.path.isdir('/dev/shm'):
+                return set()
+            return set(name for name in os.listdir('/dev/shm') if name.startswith('psm_'))
+        a = numpy.zeros((4, 3, 3))
+        a[2, 0, 0] = numpy.nan
+        before = blocks()
+        self.assertRaises(numpy.linalg.LinAlgError, self.executor.eig, a)
+        self.assertEqual(blocks() - before, set())
+
+    def test_tutorial_matrix(self):
+        a = numpy.array([[[.8, .3],
+                          [.2, .7]]])
+        w, v = self.executor.eig(a)
+        with w, v:
+            numpy.testing.assert_array_almost_equal(numpy.sort(w.array[0].real), [.5, 1.])
+
+    def test_worker_blas_threads(self):
+        settings = self.executor._pool.apply(_blas_thread_settings)
+        self.assertEqual(settings['OPENBLAS_NUM_THREADS'], '1')
+        self.assertEqual(settings['OMP_NUM_THREADS'], '1')
+
+    def test_rejects_non_square(self):
+        self.assertRaises(ValueError, self.executor.eig, numpy.zeros((2, 3, 4)))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(EigenExecutorTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -3,8 +3,8 @@ from numpy.core.numeric import array, arange
 import numpy
 from numpy.linalg.linalg import inv, solve, eig
 from numpy.lib.twodim_base import eye
-from numpy.ma.extras import dot
-from numpy.ma.core import trace
+from the_basics.construction import dot
+from the_basics.construction import trace
 
 class LinearAlgebraTest(unittest.TestCase):
 
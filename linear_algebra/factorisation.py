@@ -0,0 +1,232 @@
+import unittest
+import hashlib
+import weakref
+from collections import OrderedDict
+import numpy
+from numpy.linalg import LinAlgError
+from scipy.linalg import lu_factor, lu_solve, cho_factor, cho_solve
+
+
+def _floating(b):
+    # real input becomes float, complex stays complex
+    b = numpy.asarray(b)
+    return b.astype(numpy.result_type(b, float), copy=False)
+
+
+class Factorisation(object):
+    """LU (or Cholesky, for Hermitian positive definite a) factors of a square matrix."""
+
+    def __init__(self, a):
+        a = numpy.asarray(a)
+        a = a.astype(numpy.result_type(a, float), copy=False)
+        if a.ndim != 2 or a.shape[0] != a.shape[1]:
+            raise LinAlgError("expected a square matrix, got shape %s" % (a.shape,))
+        if not numpy.isfinite(a).all():
+            raise ValueError("matrix contains infs or NaNs")
+        self.shape = a.shape
+        self.kind = None
+        if numpy.array_equal(a, a.conj().T):
+            try:
+                self._factors = cho_factor(a, check_finite=False)
+                self.kind = 'cholesky'
+            except LinAlgError:
+                pass
+        if self.kind is None:
+            self._factors = lu_factor(a, check_finite=False)
+            if (numpy.diag(self._factors[0]) == 0).any():
+                raise LinAlgError("Singular matrix")
+            self.kind = 'lu'
+        self._pending = []
+
+    def solve(self, b):
+        b = _floating(b)
+        if b.shape[0] != self.shape[0]:
+            raise ValueError("b has %d rows, expected %d" % (b.shape[0], self.shape[0]))
+        if self.kind == 'cholesky':
+            return cho_solve(self._factors, b, check_finite=False)
+        return lu_solve(self._factors, b, check_finite=False)
+
+    def submit(self, b):
+        """Queue a right-hand side for the next flush(); returns its position."""
+        self._pending.append(_floating(b))
+        return len(self._pending) - 1
+
+    def flush(self):
+        """Solve every queued right-hand side in one multi-column solve."""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return []
+        widths = [1 if b.ndim == 1 else b.shape[1] for b in pending]
+        x = self.solve(numpy.column_stack(pending))
+        bounds = numpy.cumsum([0] + widths)
+        return [x[:, lo] if b.ndim == 1 else x[:, lo:hi]
+                for b, lo, hi in zip(pending, bounds[:-1], bounds[1:])]
+
+
+class FactorisedSolver(object):
+    """solve(a, b) that factorises each coefficient matrix once and reuses it.
+
+    Factorisations are kept in an LRU of maxsize entries keyed either by the
+    content of a ('content') or by the array object itself ('identity'). With
+    'identity' a must be an ndarray and the caller must not modify it in place
+    between solves. Entries with submitted right-hand sides that have not been
+    flushed yet are never evicted, so the cache can run past maxsize until
+    they are.
+    """
+
+    def __init__(self, maxsize=32, key='content'):
+        if key not in ('content', 'identity'):
+            raise ValueError("key must be 'content' or 'identity', got %r" % (key,))
+        self.maxsize = maxsize
+        self.key = key
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def _key(self, a):
+        if self.key == 'identity':
+            if not isinstance(a, numpy.ndarray):
+                raise ValueError("key='identity' needs an ndarray, got %s" % type(a).__name__)
+            return id(a)
+        a = numpy.ascontiguousarray(a)
+        return (a.shape, a.dtype.str, hashlib.sha1(a.view(numpy.uint8)).hexdigest())
+
+    def factorise(self, a):
+        key = self._key(a)
+        entry = self._cache.get(key)
+        if entry is not None and (entry[0] is None or entry[0]() is a):
+            self.hits += 1
+            self._cache[key] = self._cache.pop(key)
+            return entry[1]
+        self.misses += 1
+        factorisation = Factorisation(a)
+        owner = weakref.ref(a) if self.key == 'identity' else None
+        self._cache[key] = (owner, factorisation)
+        self._evict()
+        return factorisation
+
+    def _evict(self):
+        # least recently used first, skipping factorisations with queued work
+        # and the one just used
+        idle = [key for key, (owner, f) in list(self._cache.items())[:-1] if not f._pending]
+        for key in idle[:max(len(self._cache) - self.maxsize, 0)]:
+            del self._cache[key]
+
+    def solve(self, a, b):
+        return self.factorise(a).solve(b)
+
+    def submit(self, a, b):
+        return self.factorise(a).submit(b)
+
+    def flush(self, a):
+        """Solutions for the right-hand sides submitted against a, in submission order."""
+        solutions = self.factorise(a).flush()
+        self._evict()
+        return solutions
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class FactorisedSolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.a = numpy.array([[3, 2, -1],
+                              [2, -2, 4],
+                              [-1, 0.5, -1]])
+        self.b = numpy.array([1, -2, 0])
+
+    def test_solve_matches_numpy(self):
+        solver = FactorisedSolver()
+        numpy.testing.assert_array_almost_equal(solver.solve(self.a, self.b),
+                                                numpy.linalg.solve(self.a, self.b))
+        self.assertEqual(solver.factorise(self.a).kind, 'lu')
+
+    def test_spd_uses_cholesky(self):
+        rng = numpy.random.RandomState(0)
+        m = rng.normal(size=(5, 5))
+        a = numpy.dot(m, m.T) + 5 * numpy.eye(5)
+        b = rng.normal(size=(5, 3))
+        factorisation = Factorisation(a)
+        self.assertEqual(factorisation.kind, 'cholesky')
+        numpy.testing.assert_array_almost_equal(factorisation.solve(b), numpy.linalg.solve(a, b))
+
+    def test_symmetric_indefinite_falls_back_to_lu(self):
+        a = numpy.array([[1., 2.],
+                         [2., 1.]])
+        factorisation = Factorisation(a)
+        self.assertEqual(factorisation.kind, 'lu')
+        numpy.testing.assert_array_almost_equal(factorisation.solve([3., 3.]), [1., 1.])
+
+    def test_complex_hermitian(self):
+        a = numpy.array([[2, 1j], [-1j, 3]])
+        b = numpy.array([1, 1j])
+        factorisation = Factorisation(a)
+        self.assertEqual(factorisation.kind, 'cholesky')
+        numpy.testing.assert_array_almost_equal(factorisation.solve(b), [0.8, 0.6j])
+        solver = FactorisedSolver()
+        numpy.testing.assert_array_almost_equal(solver.solve(a, b), numpy.linalg.solve(a, b))
+        real = numpy.array([[1., 2.], [3., 4.]])
+        numpy.testing.assert_array_almost_equal(solver.solve(real, b), numpy.linalg.solve(real, b))
+        solver.submit(a, b)
+        solver.submit(a, [1., 0.])
+        for x, rhs in zip(solver.flush(a), (b, [1., 0.])):
+            numpy.testing.assert_array_almost_equal(x, numpy.linalg.solve(a, rhs))
+
+    def test_cache_hits_and_eviction(self):
+        solver = FactorisedSolver(maxsize=2)
+        solver.solve(self.a, self.b)
+        solver.solve(self.a.copy(), self.b)
+        self.assertEqual((solver.hits, solver.misses), (1, 1))
+        solver.solve(2 * self.a, self.b)
+        solver.solve(3 * self.a, self.b)
+        self.assertEqual(len(solver), 2)
+        solver.solve(self.a, self.b)
+        self.assertEqual(solver.misses, 4)
+
+    def test_identity_key(self):
+        solver = FactorisedSolver(key='identity')
+        solver.solve(self.a, self.b)
+        solver.solve(self.a, self.b)
+        solver.solve(self.a.copy(), self.b)
+        self.assertEqual((solver.hits, solver.misses), (1, 2))
+
+    def test_stacked_pending_solves(self):
+        solver = FactorisedSolver()
+        rhs = [self.b, numpy.array([[1., 0.], [0., 1.], [0., 0.]]), numpy.array([0., 0., 1.])]
+        for b in rhs:
+            solver.submit(self.a, b)
+        solutions = solver.factorise(self.a).flush()
+        self.assertEqual([x.shape for x in solutions], [(3,), (3, 2), (3,)])
+        for b, x in zip(rhs, solutions):
+            numpy.testing.assert_array_almost_equal(x, numpy.linalg.solve(self.a, b))
+        self.assertEqual(solver.factorise(self.a).flush(), [])
+
+    def test_pending_survive_eviction(self):
+        solver = FactorisedSolver(maxsize=1)
+        solver.submit(self.a, self.b)
+        numpy.testing.assert_array_almost_equal(solver.solve(2 * self.a, self.b),
+                                                numpy.linalg.solve(2 * self.a, self.b))
+        self.assertEqual(len(solver), 2)
+        solutions = solver.flush(self.a)
+        self.assertEqual(len(solutions), 1)
+        numpy.testing.assert_array_almost_equal(solutions[0], numpy.linalg.solve(self.a, self.b))
+        self.assertEqual(len(solver), 1)
+
+    def test_identity_key_needs_an_array(self):
+        solver = FactorisedSolver(key='identity')
+        self.assertRaises(ValueError, solver.solve, self.a.tolist(), self.b)
+        FactorisedSolver().solve(self.a.tolist(), self.b)
+
+    def test_singular(self):
+        self.assertRaises(LinAlgError, Factorisation, numpy.array([[1., 2.], [2., 4.]]))
+        self.assertRaises(LinAlgError, Factorisation, numpy.ones((2, 3)))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(FactorisedSolverTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
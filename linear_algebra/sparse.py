@@ -0,0 +1,450 @@
+import unittest
+import numpy
+from numpy.linalg import LinAlgError
+
+
+def _index_dtype(*bounds):
+    # int32 indices halve the index arrays whenever every index fits
+    return numpy.int32 if max(bounds + (0,)) < numpy.iinfo(numpy.int32).max else numpy.int64
+
+
+def _expand(indptr):
+    # the outer index (row for CSR, column for CSC) of every stored entry
+    return numpy.repeat(numpy.arange(len(indptr) - 1, dtype=indptr.dtype), numpy.diff(indptr))
+
+
+def _scatter_sum(index, weights, length):
+    """out[index[j]] += weights[j] for 1-D or (n, k) weights, with bincount."""
+    columns = [weights] if weights.ndim == 1 else list(weights.T)
+    sums = []
+    for w in columns:
+        if numpy.iscomplexobj(w):
+            sums.append(numpy.bincount(index, w.real, length)
+                        + 1j * numpy.bincount(index, w.imag, length))
+        else:
+            sums.append(numpy.bincount(index, w, length))
+    if weights.ndim == 1:
+        return sums[0]
+    return numpy.column_stack(sums) if sums else numpy.zeros((length, 0))
+
+
+class SparseMatrix(object):
+    """Shared interface of the COO, CSR and CSC matrices below."""
+
+    shape = None
+    data = None
+    # lets ndarray @ sparse fall through to __rmatmul__
+    __array_ufunc__ = None
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self._arrays())
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def dot(self, x):
+        """self times a dense vector or (n, k) matrix."""
+        x = numpy.asarray(x)
+        if x.ndim not in (1, 2) or x.shape[0] != self.shape[1]:
+            raise ValueError("shapes %s and %s not aligned" % (self.shape, x.shape))
+        dtype = numpy.result_type(self.dtype, x.dtype)
+        return self._product(x).astype(dtype, copy=False)
+
+    def __matmul__(self, x):
+        return self.dot(x)
+
+    def __rmatmul__(self, x):
+        # x @ A == (A.T @ x.T).T, and A.T is free
+        return self.transpose().dot(numpy.asarray(x).T).T
+
+    def toarray(self):
+        rows, cols, data = self.triplets()
+        dense = numpy.zeros(self.shape, dtype=self.dtype)
+        numpy.add.at(dense, (rows, cols), data)
+        return dense
+
+    def diagonal(self):
+        rows, cols, data = self.triplets()
+        on = rows == cols
+        return _scatter_sum(rows[on], data[on], min(self.shape)).astype(self.dtype, copy=False)
+
+
+class COOMatrix(SparseMatrix):
+    """Coordinate format: one (row, column, value) triplet per entry, duplicates summed."""
+
+    format = 'coo'
+
+    def __init__(self, rows, cols, data, shape=None):
+        rows, cols = numpy.asarray(rows).ravel(), numpy.asarray(cols).ravel()
+        data = numpy.asarray(data)
+        if data.ndim == 0:
+            data = numpy.full(rows.shape, data)
+        data = data.ravel()
+        if not len(rows) == len(cols) == len(data):
+            raise ValueError("rows, cols and values must have the same length")
+        if shape is None:
+            shape = (int(rows.max()) + 1, int(cols.max()) + 1) if len(rows) else (0, 0)
+        shape = tuple(int(n) for n in shape)
+        if len(rows) and (rows.min() < 0 or cols.min() < 0
+                          or rows.max() >= shape[0] or cols.max() >= shape[1]):
+            raise ValueError("index out of range for shape %s" % (shape,))
+        itype = _index_dtype(*shape)
+        self.rows = rows.astype(itype, copy=False)
+        self.cols = cols.astype(itype, copy=False)
+        self.data = data
+        self.shape = shape
+
+    def _arrays(self):
+        return self.rows, self.cols, self.data
+
+    def triplets(self):
+        return self.rows, self.cols, self.data
+
+    def transpose(self):
+        # the index arrays are already of the index dtype, so they are reused as they are
+        return COOMatrix(self.cols, self.rows, self.data, self.shape[::-1])
+
+    def _product(self, x):
+        if x.ndim == 1:
+            return _scatter_sum(self.rows, self.data * x[self.cols], self.shape[0])
+        return _scatter_sum(self.rows, self.data[:, numpy.newaxis] * x[self.cols], self.shape[0])
+
+    def tocsr(self):
+        """Compress to CSR, sorting the entries and summing duplicates (vectorised)."""
+        n_rows, n_cols = self.shape
+        key = self.rows.astype(numpy.int64) * n_cols + self.cols
+        keys, inverse = numpy.unique(key, return_inverse=True)
+        data = _scatter_sum(inverse.ravel(), self.data, len(keys)).astype(self.dtype, copy=False)
+        itype = _index_dtype(n_rows, n_cols, len(keys))
+        indptr = numpy.zeros(n_rows + 1, dtype=itype)
+        numpy.cumsum(numpy.bincount(keys // n_cols, minlength=n_rows), out=indptr[1:])
+        return CSRMatrix(indptr, (keys % n_cols).astype(itype), data, self.shape)
+
+    def tocsc(self):
+        return self.transpose().tocsr().transpose()
+
+
+class _Compressed(SparseMatrix):
+    # indptr/indices/data compressed along the outer axis (rows for CSR, columns for CSC)
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = numpy.asarray(indptr)
+        self.indices = numpy.asarray(indices)
+        self.data = numpy.asarray(data)
+        self.shape = tuple(int(n) for n in shape)
+        if len(self.indices) != len(self.data) or self.indptr[-1] != len(self.data):
+            raise ValueError("indptr, indices and data do not describe the same entries")
+        self._outer = None
+
+    def _arrays(self):
+        return self.indptr, self.indices, self.data
+
+    @property
+    def outer(self):
+        if self._outer is None:
+            self._outer = _expand(self.indptr)
+        return self._outer
+
+
+class CSRMatrix(_Compressed):
+    """Compressed sparse rows; row i is indices/data[indptr[i]:indptr[i + 1]]."""
+
+    format = 'csr'
+
+    def triplets(self):
+        return self.outer, self.indices, self.data
+
+    def transpose(self):
+        """The transpose as a CSC matrix over the very same arrays (nothing is copied)."""
+        transposed = CSCMatrix(self.indptr, self.indices, self.data, self.shape[::-1])
+        transposed._outer = self._outer
+        return transposed
+
+    def _product(self, x):
+        # gather the x entries each row needs, then one reduceat over the row runs
+        products = self.data * x[self.indices] if x.ndim == 1 else \
+            self.data[:, numpy.newaxis] * x[self.indices]
+        out = numpy.zeros((self.shape[0],) + x.shape[1:], dtype=products.dtype)
+        starts = self.indptr[:-1]
+        filled = self.indptr[1:] > starts
+        if filled.any():
+            out[filled] = numpy.add.reduceat(products, starts[filled], axis=0)
+        return out
+
+
+class CSCMatrix(_Compressed):
+    """Compressed sparse columns; column j is indices/data[indptr[j]:indptr[j + 1]]."""
+
+    format = 'csc'
+
+    def triplets(self):
+        return self.indices, self.outer, self.data
+
+    def transpose(self):
+        transposed = CSRMatrix(self.indptr, self.indices, self.data, self.shape[::-1])
+        transposed._outer = self._outer
+        return transposed
+
+    def _product(self, x):
+        # each stored entry scatters data * x[column] into its row, via bincount
+        if x.ndim == 1:
+            return _scatter_sum(self.indices, self.data * x[self.outer], self.shape[0])
+        return _scatter_sum(self.indices, self.data[:, numpy.newaxis] * x[self.outer],
+                            self.shape[0])
+
+
+def from_triplets(rows, cols, values, shape=None, format='csr'):
+    """A 'csr', 'csc' or 'coo' matrix with a[rows[i], cols[i]] += values[i]."""
+    coo = COOMatrix(rows, cols, values, shape)
+    if format == 'coo':
+        return coo
+    if format == 'csr':
+        return coo.tocsr()
+    if format == 'csc':
+        return coo.tocsc()
+    raise ValueError("unknown format %r, expected 'csr', 'csc' or 'coo'" % format)
+
+
+def from_dense(a, format='csr'):
+    a = numpy.asarray(a)
+    rows, cols = numpy.nonzero(a)
+    return from_triplets(rows, cols, a[rows, cols], a.shape, format)
+
+
+def _operator(a):
+    if isinstance(a, SparseMatrix):
+        return a
+    a = numpy.asarray(a)
+    if a.ndim != 2:
+        raise LinAlgError("expected a matrix, got %d dimensions" % a.ndim)
+    return a
+
+
+def _diagonal(a):
+    d = a.diagonal() if isinstance(a, SparseMatrix) else numpy.diagonal(a)
+    d = numpy.asarray(d, dtype=float)
+    # Jacobi scaling, skipping rows without a usable diagonal
+    return numpy.where(d != 0, 1. / numpy.where(d != 0, d, 1), 1.)
+
+
+def _check_system(a, b):
+    if numpy.iscomplexobj(b) or numpy.issubdtype(a.dtype, numpy.complexfloating):
+        raise TypeError("cg and gmres solve real systems only, got %s a and %s b"
+                        % (a.dtype, b.dtype))
+    if a.shape[0] != a.shape[1]:
+        raise LinAlgError("expected a square matrix, got shape %s" % (a.shape,))
+    if b.shape[0] != a.shape[0]:
+        raise ValueError("b has %d rows, expected %d" % (b.shape[0], a.shape[0]))
+
+
+def cg(a, b, x0=None, tol=1e-10, maxiter=None):
+    """Solve a x = b for symmetric positive definite a by Jacobi-preconditioned conjugate gradients.
+
+    Stops when |b - a x| <= tol |b|; raises LinAlgError if that takes more
+    than maxiter (default 10 n) iterations.
+    """
+    a = _operator(a)
+    b = numpy.asarray(b)
+    _check_system(a, b)
+    b = b.astype(float, copy=False)
+    n = a.shape[0]
+    maxiter = 10 * n if maxiter is None else maxiter
+    inverse_diagonal = _diagonal(a)
+    x = numpy.zeros(n) if x0 is None else numpy.array(x0, dtype=float)
+    r = b - a.dot(x)
+    limit = tol * numpy.linalg.norm(b)
+    z = inverse_diagonal * r
+    p = z.copy()
+    rz = numpy.dot(r, z)
+    for iteration in range(maxiter + 1):
+        if numpy.linalg.norm(r) <= limit:
+            return x
+        if iteration == maxiter:
+            break
+        ap = a.dot(p)
+        alpha = rz / numpy.dot(p, ap)
+        x += alpha * p
+        r -= alpha * ap
+        z = inverse_diagonal * r
+        rz, previous = numpy.dot(r, z), rz
+        p *= rz / previous
+        p += z
+    raise LinAlgError("cg did not converge in %d iterations" % maxiter)
+
+
+def gmres(a, b, x0=None, tol=1e-10, maxiter=None, restart=30):
+    """Solve a x = b for general square a by restarted GMRES with Jacobi right preconditioning.
+
+    Same stopping rule and errors as cg(); maxiter counts inner iterations.
+    """
+    a = _operator(a)
+    b = numpy.asarray(b)
+    _check_system(a, b)
+    b = b.astype(float, copy=False)
+    n = a.shape[0]
+    maxiter = 10 * n if maxiter is None else maxiter
+    restart = max(1, min(restart, n))
+    inverse_diagonal = _diagonal(a)
+    x = numpy.zeros(n) if x0 is None else numpy.array(x0, dtype=float)
+    limit = tol * numpy.linalg.norm(b)
+    done = 0
+    while True:
+        r = b - a.dot(x)
+        beta = numpy.linalg.norm(r)
+        if beta <= limit:
+            return x
+        if done >= maxiter:
+            raise LinAlgError("gmres did not converge in %d iterations" % maxiter)
+        basis = numpy.zeros((restart + 1, n))
+        h = numpy.zeros((restart + 1, restart))
+        cs, sn = numpy.zeros(restart), numpy.zeros(restart)
+        g = numpy.zeros(restart + 1)
+        basis[0] = r / beta
+        g[0] = beta
+        k = 0
+        for j in range(restart):
+            w = a.dot(inverse_diagonal * basis[j])
+            # modified Gram-Schmidt against the Krylov basis so far
+            for i in range(j + 1):
+                h[i, j] = numpy.dot(basis[i], w)
+                w -= h[i, j] * basis[i]
+            h[j + 1, j] = numpy.linalg.norm(w)
+            if h[j + 1, j] != 0:
+                basis[j + 1] = w / h[j + 1, j]
+            # previous Givens rotations, then a new one to zero h[j + 1, j]
+            for i in range(j):
+                h[i, j], h[i + 1, j] = (cs[i] * h[i, j] + sn[i] * h[i + 1, j],
+                                        -sn[i] * h[i, j] + cs[i] * h[i + 1, j])
+            norm = numpy.hypot(h[j, j], h[j + 1, j])
+            cs[j], sn[j] = (1., 0.) if norm == 0 else (h[j, j] / norm, h[j + 1, j] / norm)
+            h[j, j], h[j + 1, j] = norm, 0.
+            g[j + 1], g[j] = -sn[j] * g[j], cs[j] * g[j]
+            k = j + 1
+            done += 1
+            if abs(g[k]) <= limit or h[j, j] == 0 or done >= maxiter:
+                break
+        if h[k - 1, k - 1] == 0:
+            raise LinAlgError("Singular matrix")
+        y = numpy.linalg.solve(numpy.triu(h[:k, :k]), g[:k])
+        x += inverse_diagonal * numpy.dot(y, basis[:k])
+
+
+SOLVERS = {'cg': cg, 'gmres': gmres}
+
+
+def _symmetric(a):
+    if isinstance(a, SparseMatrix):
+        mine, theirs = a.triplets(), a.transpose().triplets()
+        order = numpy.lexsort(mine[1::-1])
+        other = numpy.lexsort(theirs[1::-1])
+        return all(numpy.array_equal(m[order], t[other]) for m, t in zip(mine, theirs))
+    return numpy.array_equal(a, a.T)
+
+
+def solve(a, b, method='auto', tol=1e-10, maxiter=None):
+    """Iterative counterpart of numpy.linalg.solve(a, b) for sparse (or dense) real a.
+
+    method 'auto' picks cg for symmetric a with a positive diagonal and
+    gmres otherwise. b may be a vector or have one right-hand side per
+    column; a numpy.matrix b gives a numpy.matrix result, as solve() does.
+    """
+    a = _operator(a)
+    matrix = isinstance(b, numpy.matrix)
+    b = numpy.asarray(b)
+    _check_system(a, b)
+    if method == 'auto':
+        method = 'cg' if _symmetric(a) and (numpy.asarray(_diagonal(a)) > 0).all() else 'gmres'
+    try:
+        solver = SOLVERS[method]
+    except KeyError:
+        raise ValueError("unknown method %r, expected 'auto' or one of %s"
+                         % (method, sorted(SOLVERS)))
+    if b.ndim == 1:
+        x = solver(a, b, tol=tol, maxiter=maxiter)
+    else:
+        x = numpy.column_stack([solver(a, column, tol=tol, maxiter=maxiter) for column in b.T])
+    return numpy.asmatrix(x) if matrix else x
+
+
+class SparseMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.dense = numpy.where(rng.uniform(size=(30, 20)) < 0.1, rng.normal(size=(30, 20)), 0)
+        self.x = rng.normal(size=20)
+        self.xs = rng.normal(size=(20, 3))
+
+    def test_products_in_every_format(self):
+        for format in ('csr', 'csc', 'coo'):
+            a = from_dense(self.dense, format)
+            self.assertEqual(a.format, format)
+            numpy.testing.assert_array_almost_equal(a.toarray(), self.dense)
+            numpy.testing.assert_array_almost_equal(a.dot(self.x), self.dense.dot(self.x))
+            numpy.testing.assert_array_almost_equal(a @ self.xs, self.dense @ self.xs)
+            numpy.testing.assert_array_almost_equal(self.xs.T @ a.T, self.xs.T @ self.dense.T)
+            numpy.testing.assert_array_almost_equal(a.T.dot(numpy.ones(30)), self.dense.sum(axis=0))
+
+    def test_triplets_sum_duplicates(self):
+        a = from_triplets([0, 2, 0, 1], [1, 0, 1, 1], [1., 2., 3., 4.], shape=(3, 2))
+        numpy.testing.assert_array_equal(a.toarray(), [[0, 4], [0, 4], [2, 0]])
+        self.assertEqual(a.nnz, 3)
+        self.assertEqual(a.indices.dtype, numpy.int32)
+        self.assertRaises(ValueError, from_triplets, [0, 3], [0, 0], [1, 1], (3, 3))
+        self.assertRaises(ValueError, from_triplets, [0], [0], [1], format='dia')
+
+    def test_transpose_shares_data(self):
+        a = from_dense(self.dense)
+        t = a.T
+        self.assertEqual(t.format, 'csc')
+        self.assertEqual(t.shape, (20, 30))
+        self.assertTrue(t.data is a.data and t.indices is a.indices and t.indptr is a.indptr)
+        numpy.testing.assert_array_equal(t.toarray(), self.dense.T)
+        self.assertTrue(t.T.data is a.data)
+        numpy.testing.assert_array_equal(from_dense(self.dense, 'csc').T.toarray(), self.dense.T)
+
+    def test_matrix_class_system(self):
+        a = from_dense(numpy.matrix('1. 2.; 3. 4.'))
+        b = numpy.matrix('5. 7.')
+        x = solve(a, b.transpose())
+        self.assertTrue(isinstance(x, numpy.matrix))
+        numpy.testing.assert_array_almost_equal(x, numpy.matrix('-3.;4.'))
+
+    def test_iterative_solvers(self):
+        n = 200
+        rng = numpy.random.RandomState(1)
+        i = numpy.arange(n)
+        rows = numpy.concatenate([i, i[1:], i[:-1]])
+        cols = numpy.concatenate([i, i[:-1], i[1:]])
+        values = numpy.concatenate([numpy.full(n, 4.), numpy.full(2 * (n - 1), -1.)])
+        spd = from_triplets(rows, cols, values)
+        b = rng.normal(size=n)
+        expected = numpy.linalg.solve(spd.toarray(), b)
+        numpy.testing.assert_array_almost_equal(cg(spd, b), expected)
+        numpy.testing.assert_array_almost_equal(solve(spd, b), expected)
+        skew = from_triplets(numpy.append(rows, 0), numpy.append(cols, n - 1),
+                             numpy.append(values, 1.5))
+        expected = numpy.linalg.solve(skew.toarray(), b)
+        numpy.testing.assert_array_almost_equal(gmres(skew, b, restart=10), expected)
+        numpy.testing.assert_array_almost_equal(solve(skew, numpy.column_stack([b, 2 * b])),
+                                                numpy.column_stack([expected, 2 * expected]))
+        self.assertRaises(LinAlgError, cg, spd, b, maxiter=2)
+        self.assertRaises(ValueError, solve, spd, b, method='lu')
+        for solver in (cg, gmres, solve):
+            self.assertRaises(TypeError, solver, spd, b + 1j)
+            self.assertRaises(TypeError, solver, spd.toarray() * (1 + 1j), b)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(SparseMatrixTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,137 @@
+import unittest
+import numpy
+
+
+class ArrayBuilder(object):
+    """Collect rows (axis=0) or columns (axis=1, ...) into an array without vstack/hstack.
+
+    Items go into a preallocated buffer that grows geometrically, so n appends
+    copy O(n) elements in total instead of the O(n**2) of stacking after every
+    append. The growth axis is stored outermost so appends are contiguous writes.
+    """
+
+    def __init__(self, dtype=float, axis=0, capacity=16, growth=2.):
+        if growth <= 1:
+            raise ValueError("growth must be greater than 1")
+        self.dtype = numpy.dtype(dtype)
+        self.axis = axis
+        self.growth = growth
+        self._initial = max(int(capacity), 1)
+        self._buffer = None
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def capacity(self):
+        return 0 if self._buffer is None else self._buffer.shape[0]
+
+    @property
+    def shape(self):
+        if self._buffer is None:
+            return None
+        return self.finalize().shape
+
+    def _reserve(self, item_shape, count):
+        if self._buffer is None:
+            if self.axis > len(item_shape):
+                raise ValueError("axis %d out of range for items of shape %s"
+                                 % (self.axis, item_shape))
+            self._buffer = numpy.empty((max(self._initial, count),) + item_shape, self.dtype)
+            return
+        if item_shape != self._buffer.shape[1:]:
+            raise ValueError("cannot add items of shape %s to a builder of %s"
+                             % (item_shape, self._buffer.shape[1:]))
+        needed = self._length + count
+        if needed > self._buffer.shape[0]:
+            capacity = max(needed, int(numpy.ceil(self._buffer.shape[0] * self.growth)))
+            buffer = numpy.empty((capacity,) + item_shape, self.dtype)
+            buffer[:self._length] = self._buffer[:self._length]
+            self._buffer = buffer
+
+    def append(self, item):
+        """Add one row (or column, for axis=1) to the end."""
+        buffer = self._buffer
+        # fast path for the common case: an array of the right shape with room for it
+        if (buffer is not None and self._length < buffer.shape[0]
+                and getattr(item, 'shape', None) == buffer.shape[1:]):
+            buffer[self._length] = item
+            self._length += 1
+            return
+        item = numpy.asarray(item)
+        self._reserve(item.shape, 1)
+        self._buffer[self._length] = item
+        self._length += 1
+
+    def extend(self, arrays):
+        """Add blocks of rows (or columns), each stacked along axis like vstack/hstack operands."""
+        for block in arrays:
+            block = numpy.moveaxis(numpy.asarray(block), self.axis, 0)
+            self._reserve(block.shape[1:], block.shape[0])
+            self._buffer[self._length:self._length + block.shape[0]] = block
+            self._length += block.shape[0]
+
+    def finalize(self):
+        """The collected array, as a view of the buffer trimmed to what was added."""
+        if self._buffer is None:
+            raise ValueError("nothing has been added to the builder")
+        return numpy.moveaxis(self._buffer[:self._length], 0, self.axis)
+
+
+class ArrayBuilderTest(unittest.TestCase):
+
+    def test_rows_like_vstack(self):
+        a = numpy.array([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12]])
+        b = numpy.array([[13, 14, 15, 16], [17, 18, 19, 20], [21, 22, 23, 24]])
+        builder = ArrayBuilder(dtype=int, capacity=1)
+        for row in a:
+            builder.append(row)
+        builder.extend([b])
+        numpy.testing.assert_array_equal(builder.finalize(), numpy.vstack((a, b)))
+        self.assertEqual(len(builder), 6)
+
+    def test_columns_like_hstack(self):
+        a = numpy.array([[1, 2, 3, 4], [5, 6, 7, 8], [9, 10, 11, 12]])
+        b = numpy.array([[13, 14, 15, 16], [17, 18, 19, 20], [21, 22, 23, 24]])
+        builder = ArrayBuilder(dtype=int, axis=1)
+        builder.extend((a, b[:, :2]))
+        builder.append(b[:, 2])
+        builder.append(b[:, 3])
+        numpy.testing.assert_array_equal(builder.finalize(), numpy.hstack((a, b)))
+        self.assertEqual(builder.shape, (3, 8))
+
+    def test_column_stack(self):
+        builder = ArrayBuilder(axis=1)
+        builder.append(numpy.array([4., 2.]))
+        builder.append(numpy.array([2., 8.]))
+        numpy.testing.assert_array_equal(builder.finalize(), numpy.array([[4., 2.], [2., 8.]]))
+
+    def test_geometric_growth(self):
+        builder = ArrayBuilder(capacity=2)
+        capacities = set()
+        for i in range(1000):
+            builder.append(i)
+            capacities.add(builder.capacity)
+        self.assertTrue(len(capacities) <= 10)
+        numpy.testing.assert_array_equal(builder.finalize(), numpy.arange(1000.))
+
+    def test_finalize_is_a_view(self):
+        builder = ArrayBuilder(capacity=8)
+        builder.extend([numpy.ones((3, 2))])
+        result = builder.finalize()
+        self.assertFalse(result.flags.owndata)
+        self.assertTrue(numpy.shares_memory(result, builder._buffer))
+        self.assertEqual(result.shape, (3, 2))
+
+    def test_shape_mismatch(self):
+        builder = ArrayBuilder()
+        builder.append([1., 2.])
+        self.assertRaises(ValueError, builder.append, [1., 2., 3.])
+        self.assertRaises(ValueError, ArrayBuilder().finalize)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(ArrayBuilderTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,131 @@
+import unittest
+from collections import namedtuple
+import numpy
+
+
+class Chunk(namedtuple('Chunk', 'index axis start stop lo hi view')):
+    """One piece of an array from iter_chunks.
+
+    [start, stop) is the chunk's own range along axis; view covers [lo, hi),
+    which adds the halo on either side, clipped to the array.
+    """
+
+    __slots__ = ()
+
+    @property
+    def contiguous(self):
+        return self.view.flags.c_contiguous or self.view.flags.f_contiguous
+
+    @property
+    def core(self):
+        index = [slice(None)] * self.view.ndim
+        index[self.axis] = slice(self.start - self.lo, self.stop - self.lo)
+        return self.view[tuple(index)]
+
+    def packed(self):
+        """The view itself when contiguous, otherwise a single contiguous copy."""
+        return self.view if self.contiguous else numpy.ascontiguousarray(self.view)
+
+
+def _bounds(length, sections, sizes, max_bytes, slab_bytes, halo):
+    if sum(x is not None for x in (sections, sizes, max_bytes)) != 1:
+        raise ValueError("give exactly one of sections, sizes or max_bytes")
+    if sizes is not None:
+        if sum(sizes) != length or min(sizes) < 0:
+            raise ValueError("sizes must be non-negative and add up to %d" % length)
+        edges = numpy.cumsum([0] + list(sizes))
+        return zip(edges[:-1], edges[1:])
+    if max_bytes is not None:
+        step = max(int(max_bytes // max(slab_bytes, 1)) - 2 * halo, 1)
+        return ((lo, min(lo + step, length)) for lo in range(0, length, step))
+    try:
+        count = int(sections)
+    except TypeError:
+        # split points, as for hsplit(a, (3, 4))
+        edges = [0] + [min(max(int(i), 0), length) for i in sections] + [length]
+        return ((lo, max(lo, hi)) for lo, hi in zip(edges[:-1], edges[1:]))
+    if count <= 0:
+        raise ValueError("number of sections must be larger than 0")
+    # same section lengths as array_split
+    each, extra = divmod(length, count)
+    edges = numpy.cumsum([0] + extra * [each + 1] + (count - extra) * [each])
+    return zip(edges[:-1], edges[1:])
+
+
+def iter_chunks(a, sections=None, axis=0, sizes=None, max_bytes=None, halo=0):
+    """Yield views of a along axis, one Chunk at a time, without copying anything.
+
+    Chunks are given either by sections (a count or split points, as for
+    array_split/hsplit), by sizes (chunk lengths) or by max_bytes per chunk.
+    halo extends every view by that many neighbouring entries on each side.
+    """
+    a = numpy.asarray(a)
+    axis = axis % a.ndim
+    length = a.shape[axis]
+    slab_bytes = a.itemsize * (a.size // length if length else 0)
+    index = [slice(None)] * a.ndim
+    for i, (start, stop) in enumerate(_bounds(length, sections, sizes, max_bytes, slab_bytes,
+                                              halo)):
+        start, stop = int(start), int(stop)
+        lo, hi = max(start - halo, 0), min(stop + halo, length)
+        index[axis] = slice(lo, hi)
+        yield Chunk(i, axis, start, stop, lo, hi, a[tuple(index)])
+
+
+class ChunkingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.a = numpy.array([[8., 8., 3., 9., 0., 4., 3., 0., 0., 6., 4., 4.],
+                              [0., 3., 2., 9., 6., 0., 4., 5., 7., 5., 1., 4.]])
+
+    def test_like_hsplit(self):
+        for sections in (3, (3, 4)):
+            chunks = list(iter_chunks(self.a, sections, axis=1))
+            expected = numpy.hsplit(self.a, sections)
+            self.assertEqual(len(chunks), len(expected))
+            for chunk, part in zip(chunks, expected):
+                numpy.testing.assert_array_equal(chunk.view, part)
+                self.assertTrue(numpy.shares_memory(chunk.view, self.a))
+
+    def test_uneven_count_like_array_split(self):
+        a = numpy.arange(10)
+        for chunk, part in zip(iter_chunks(a, 4), numpy.array_split(a, 4)):
+            numpy.testing.assert_array_equal(chunk.view, part)
+
+    def test_sizes(self):
+        chunks = list(iter_chunks(self.a, axis=-1, sizes=[5, 0, 7]))
+        self.assertEqual([c.view.shape for c in chunks], [(2, 5), (2, 0), (2, 7)])
+        self.assertRaises(ValueError, list, iter_chunks(self.a, axis=1, sizes=[5, 5]))
+
+    def test_byte_budget(self):
+        a = numpy.zeros((100, 10))
+        chunks = list(iter_chunks(a, max_bytes=2400))
+        self.assertEqual([c.view.shape[0] for c in chunks], [30, 30, 30, 10])
+        self.assertTrue(all(c.contiguous and c.packed() is c.view for c in chunks))
+
+    def test_halo(self):
+        a = numpy.arange(10)
+        chunks = list(iter_chunks(a, 3, halo=2))
+        self.assertEqual([(c.lo, c.hi) for c in chunks], [(0, 6), (2, 9), (5, 10)])
+        numpy.testing.assert_array_equal(numpy.concatenate([c.core for c in chunks]), a)
+
+    def test_contiguity(self):
+        chunk = next(iter_chunks(self.a, 3, axis=1))
+        self.assertFalse(chunk.contiguous)
+        packed = chunk.packed()
+        self.assertTrue(packed.flags.c_contiguous)
+        numpy.testing.assert_array_equal(packed, chunk.view)
+
+    def test_lazy(self):
+        chunks = iter_chunks(numpy.zeros(10**6), max_bytes=8)
+        self.assertEqual(next(chunks).view.shape, (1,))
+
+    def test_one_way_of_chunking(self):
+        self.assertRaises(ValueError, list, iter_chunks(self.a))
+        self.assertRaises(ValueError, list, iter_chunks(self.a, 2, sizes=[1, 1]))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(ChunkingTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
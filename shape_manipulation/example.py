@@ -1,6 +1,6 @@
 import unittest
 from numpy import random
-from numpy.ma.core import floor, array
+from the_basics.construction import floor, array
 import numpy
 from numpy.core.shape_base import vstack, hstack
 from numpy.core.numeric import newaxis
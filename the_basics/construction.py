@@ -0,0 +1,179 @@
+import unittest
+import numpy
+import numpy.ma
+from the_basics import precision
+
+MaskedArray = numpy.ma.MaskedArray
+
+
+def _masked(*args):
+    return any(isinstance(arg, MaskedArray) for arg in args)
+
+
+def _lean(dtype):
+    # the dtype to build with when none was asked for: natural under the
+    # default policy, narrowed under a leaner one
+    policy = precision.get_policy()
+    return None if policy is precision.DEFAULT else policy.dtype_for(dtype)
+
+
+def array(data, dtype=None, mask=None, copy=True):
+    """A plain ndarray, or a masked array only when a mask is given (or data is masked)."""
+    if mask is None and not isinstance(data, MaskedArray):
+        a = numpy.array(data, dtype=dtype, copy=copy)
+        if dtype is None and _lean(a.dtype) not in (None, a.dtype):
+            a = precision.narrow(a, _lean(a.dtype), 'array')
+        return a
+    return numpy.ma.array(data, dtype=dtype, mask=numpy.ma.nomask if mask is None else mask,
+                          copy=copy)
+
+
+def _filled(make):
+    def construct(shape, dtype=None, mask=None):
+        a = make(shape, dtype=precision.get_policy().float if dtype is None else dtype)
+        return a if mask is None else numpy.ma.array(a, mask=mask, copy=False)
+    construct.__name__ = make.__name__
+    construct.__doc__ = "numpy.%s, masked only when a mask is given." % make.__name__
+    return construct
+
+
+zeros = _filled(numpy.zeros)
+ones = _filled(numpy.ones)
+empty = _filled(numpy.empty)
+
+
+def _lean_between(natural, bounds, op):
+    # the lean dtype for values between bounds, or None to build at natural
+    # width (recorded as an escape when the lean dtype could not hold them)
+    dtype = _lean(natural)
+    if dtype is None or dtype == natural:
+        return dtype
+    bounds = numpy.array(bounds, dtype=natural)
+    if precision.fits(bounds, dtype):
+        return dtype
+    precision.narrow(bounds, dtype, op)
+    return None
+
+
+def arange(*args, **kwargs):
+    mask = kwargs.pop('mask', None)
+    if kwargs.get('dtype') is None:
+        # every value lies between the start (0 by default) and the stop
+        kwargs['dtype'] = _lean_between(numpy.result_type(*args), (0,) + args[:2], 'arange')
+    a = numpy.arange(*args, **kwargs)
+    return a if mask is None else numpy.ma.array(a, mask=mask, copy=False)
+
+
+def linspace(start, stop, num=50, mask=None, **kwargs):
+    if kwargs.get('dtype') is None:
+        kwargs['dtype'] = _lean_between(numpy.result_type(start, stop, 1.), (start, stop),
+                                        'linspace')
+    a = numpy.linspace(start, stop, num, **kwargs)
+    return a if mask is None else numpy.ma.array(a, mask=mask, copy=False)
+
+
+def fromfunction(function, shape, dtype=None, **kwargs):
+    return numpy.fromfunction(function, shape,
+                              dtype=precision.get_policy().float if dtype is None else dtype,
+                              **kwargs)
+
+
+def _dispatch(name):
+    plain, masked = getattr(numpy, name), getattr(numpy.ma, name)
+    # plain results follow the dtype policy (see the_basics.precision)
+    if isinstance(plain, numpy.ufunc):
+        compute = precision.apply
+    else:
+        compute = precision.call
+
+    def call(*args, **kwargs):
+        if _masked(*args) or _masked(*kwargs.values()):
+            return masked(*args, **kwargs)
+        return compute(plain, *args, **kwargs)
+    call.__name__ = name
+    call.__doc__ = "numpy.%s, or numpy.ma.%s when an argument is masked." % (name, name)
+    return call
+
+
+sin = _dispatch('sin')
+cos = _dispatch('cos')
+exp = _dispatch('exp')
+floor = _dispatch('floor')
+sqrt = _dispatch('sqrt')
+dot = _dispatch('dot')
+trace = _dispatch('trace')
+argmin = _dispatch('argmin')
+argmax = _dispatch('argmax')
+
+
+class ConstructionTest(unittest.TestCase):
+
+    def test_plain_by_default(self):
+        for a in (array([1, 2, 3]), zeros((2, 3)), ones(3, dtype=int), empty((2, 2)),
+                  arange(12).reshape(3, 4), linspace(0, 1, 5), sin(arange(4)),
+                  fromfunction(lambda i, j: i + j, (2, 2))):
+            self.assertEqual(type(a), numpy.ndarray)
+        self.assertEqual(type(dot(array([[1, 1], [0, 1]]), array([[2, 0], [3, 4]]))), numpy.ndarray)
+
+    def test_masked_when_asked(self):
+        a = array([1, 2, 3], mask=[0, 1, 0])
+        self.assertTrue(isinstance(a, MaskedArray))
+        self.assertEqual(a.sum(), 4)
+        self.assertTrue(isinstance(zeros(3, mask=[1, 0, 0]), MaskedArray))
+        self.assertTrue(isinstance(arange(3, mask=[1, 0, 0]), MaskedArray))
+        self.assertTrue(isinstance(sin(a), MaskedArray))
+        self.assertTrue(sin(a).mask[1])
+        self.assertEqual(argmin(array([5, 1, 3], mask=[0, 1, 0])), 2)
+
+    def test_structured_dtype(self):
+        img = zeros((2, 2), [('r', 'float32'), ('g', 'float32'), ('b', 'float32')])
+        img.flat = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1)]
+        self.assertEqual(img['r'][0, 1], 1)
+        img = array([[(0, 0, 0), (1, 0, 0)], [(0, 1, 0), (0, 0, 1)]],
+                    {'names': ('r', 'g', 'b'), 'formats': ('f4', 'f4', 'f4')})
+        self.assertEqual(img['b'][1, 1], 1)
+
+    def test_results_match_masked_path(self):
+        a = arange(20).reshape(5, 4)
+        numpy.testing.assert_array_equal(sin(a), numpy.ma.sin(numpy.ma.arange(20).reshape(5, 4)))
+        self.assertEqual(trace(array([[1., 2.], [3., 4.]])), 5)
+        self.assertEqual(argmin(array([3., 1., 2.]), axis=0), 1)
+
+    def test_lean_policy_defaults(self):
+        with precision.policy('lean'):
+            self.assertEqual(zeros(3).dtype, numpy.float32)
+            self.assertEqual(array([1.5, 2]).dtype, numpy.float32)
+            self.assertEqual(array([1, 2]).dtype, numpy.int32)
+            self.assertEqual(array([1, 2], dtype=numpy.int64).dtype, numpy.int64)
+            self.assertEqual(arange(10, 30, 5).dtype, numpy.int32)
+            b = linspace(0, numpy.pi, 3)
+            self.assertEqual(b.dtype, numpy.float32)
+            self.assertEqual(exp(b * 1j).dtype, numpy.complex64)
+            self.assertEqual(sin(arange(4)).dtype, numpy.float32)
+            self.assertEqual(fromfunction(lambda i, j: i + j, (2, 2)).dtype, numpy.float32)
+        self.assertEqual(zeros(3).dtype, numpy.float64)
+        self.assertEqual(arange(3).dtype, numpy.dtype(int))
+
+    def test_lean_policy_keeps_out_of_range_values_wide(self):
+        precision.clear_escapes()
+        with precision.policy('lean'):
+            big = array([2 ** 40, 3])
+            self.assertEqual(big.dtype, numpy.int64)
+            numpy.testing.assert_array_equal(big, [2 ** 40, 3])
+            self.assertEqual(array([1e300]).dtype, numpy.float64)
+            self.assertEqual(array([1e300])[0], 1e300)
+            past = arange(2 ** 31 - 2, 2 ** 31 + 2)
+            self.assertEqual(past.dtype, numpy.int64)
+            numpy.testing.assert_array_equal(past[-2:], [2 ** 31, 2 ** 31 + 1])
+            self.assertEqual(linspace(0, 1e300, 3).dtype, numpy.float64)
+            self.assertEqual(linspace(0, 1e30, 3).dtype, numpy.float32)
+        self.assertEqual(sorted((row['op'], row['dtype'], row['kept'])
+                                for row in precision.escape_report()),
+                         [('arange', 'int64', 1), ('array', 'float64', 2), ('array', 'int64', 1),
+                          ('linspace', 'float64', 1)])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(ConstructionTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -2,9 +2,9 @@ import unittest
 from numpy.core.numeric import arange, array, zeros, ones, empty
 import numpy
 from numpy.core.function_base import linspace
-from numpy.ma.core import sin, exp, fromfunction
+from the_basics.construction import sin, exp, fromfunction
 from scipy.constants.constants import pi
-from numpy.ma.extras import dot
+from the_basics.construction import dot
 
 
 class AnExampleTest(unittest.TestCase):
@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+from shape_manipulation.chunking import iter_chunks
+from the_basics.streaming import BLOCK_BYTES, open_output
+
+
+def open_grid(shape, dtype=int):
+    """Broadcastable index vectors for shape, as ix_(arange(n0), arange(n1), ...) would give."""
+    grids = []
+    for k, n in enumerate(shape):
+        index = numpy.arange(n, dtype=dtype)
+        view = [1] * len(shape)
+        view[k] = n
+        grids.append(index.reshape(view))
+    return tuple(grids)
+
+
+def fromfunction_open(function, shape, dtype=float, **kwargs):
+    """Like fromfunction, but function gets open grids instead of full index arrays.
+
+    For a separable function only O(sum of shape) index storage is created;
+    the result is broadcast up to shape if function does not depend on every axis.
+    """
+    shape = tuple(shape)
+    result = numpy.asarray(function(*open_grid(shape, dtype), **kwargs))
+    if result.shape == shape:
+        return result
+    out = numpy.empty(shape, dtype=result.dtype)
+    out[...] = result
+    return out
+
+
+def evaluate_blocks(function, shape, out=None, dtype=float, index_dtype=int,
+                    block_bytes=BLOCK_BYTES, **kwargs):
+    """Evaluate function over open grids one block of rows at a time into out.
+
+    out is any target open_output accepts; a new one is of dtype.
+    """
+    shape = tuple(shape)
+    out = open_output(out, shape, dtype)
+    grids = open_grid(shape, index_dtype)
+    for chunk in iter_chunks(out, max_bytes=block_bytes):
+        rows = grids[0][chunk.start:chunk.stop]
+        chunk.view[...] = function(rows, *grids[1:], **kwargs)
+    return out
+
+
+def f(x, y):
+    return 10*(x+y)
+
+
+class GridEvaluationTest(unittest.TestCase):
+
+    def test_open_grid(self):
+        x, y = open_grid((5, 4))
+        self.assertEqual((x.shape, y.shape), ((5, 1), (1, 4)))
+        numpy.testing.assert_array_equal(x + y, numpy.add.outer(numpy.arange(5), numpy.arange(4)))
+
+    def test_matches_fromfunction(self):
+        b = fromfunction_open(f, (5, 4), dtype=int)
+        numpy.testing.assert_array_equal(b, numpy.fromfunction(f, (5, 4), dtype=int))
+        self.assertEqual(b[2, 3], 50)
+        numpy.testing.assert_array_equal(b[1:3, :], [[10, 20, 30, 40],
+                                                     [20, 30, 40, 50]])
+
+    def test_partial_dependence_is_broadcast(self):
+        b = fromfunction_open(lambda i, j, k: k**2, (2, 3, 4))
+        self.assertEqual(b.shape, (2, 3, 4))
+        numpy.testing.assert_array_equal(b[1, 2], [0., 1., 4., 9.])
+
+    def test_blocks_into_memmap(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'b.npy')
+            out = evaluate_blocks(f, (50, 7), out=path, dtype=int, block_bytes=7*8*3)
+            self.assertTrue(isinstance(out, numpy.memmap))
+            del out
+            numpy.testing.assert_array_equal(numpy.load(path),
+                                             numpy.fromfunction(f, (50, 7), dtype=int))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_blocks_three_dims(self):
+        g = lambda i, j, k: i - 2*j + 3*k
+        out = evaluate_blocks(g, (9, 4, 5), block_bytes=4*5*8*2)
+        numpy.testing.assert_array_equal(out, numpy.fromfunction(g, (9, 4, 5)))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(GridEvaluationTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,357 @@
+import unittest
+from collections import namedtuple
+from contextlib import contextmanager
+import numpy
+from shape_manipulation.chunking import iter_chunks
+
+BLOCK_BYTES = 1 << 20
+
+
+class Policy(namedtuple('Policy', 'name float complex int')):
+    """The widest float, complex and integer dtypes computations may produce."""
+
+    def dtype_for(self, dtype):
+        """dtype, narrowed to this policy's width for its kind if it is wider.
+
+        Only the dtype is considered; narrow() and check() also make sure the
+        values survive the cast.
+        """
+        dtype = numpy.dtype(dtype)
+        if dtype.kind == 'f':
+            limit = self.float
+        elif dtype.kind == 'c':
+            limit = self.complex
+        elif dtype.kind == 'i':
+            limit = self.int
+        elif dtype.kind == 'u':
+            limit = numpy.dtype('u%d' % self.int.itemsize)
+        else:
+            return dtype
+        return limit if dtype.itemsize > limit.itemsize else dtype
+
+
+POLICIES = {
+    'default': Policy('default', numpy.dtype(numpy.float64), numpy.dtype(numpy.complex128),
+                      numpy.dtype(numpy.int64)),
+    'lean': Policy('lean', numpy.dtype(numpy.float32), numpy.dtype(numpy.complex64),
+                   numpy.dtype(numpy.int32)),
+}
+DEFAULT = POLICIES['default']
+
+# reductions accumulate at full width whatever the policy, then narrow the result
+ACCUMULATORS = {'f': numpy.dtype(numpy.float64), 'c': numpy.dtype(numpy.complex128),
+                'i': numpy.dtype(numpy.int64), 'u': numpy.dtype(numpy.uint64),
+                'b': numpy.dtype(numpy.int64)}
+
+_state = {'policy': DEFAULT}
+_escapes = {}
+
+
+def get_policy():
+    return _state['policy']
+
+
+def set_policy(policy):
+    """Make policy (a Policy or a name in POLICIES) current; returns the previous one.
+
+    The setting is process wide, like numpy's print options.
+    """
+    if not isinstance(policy, Policy):
+        try:
+            policy = POLICIES[policy]
+        except KeyError:
+            raise ValueError("unknown policy %r, expected one of %s" % (policy, sorted(POLICIES)))
+    previous = _state['policy']
+    _state['policy'] = policy
+    return previous
+
+
+@contextmanager
+def policy(name):
+    """with policy('lean'): ... runs the block under another dtype policy."""
+    previous = set_policy(name)
+    try:
+        yield get_policy()
+    finally:
+        set_policy(previous)
+
+
+def _escaped(op, natural, allowed, nbytes, kept=False):
+    key = (op, natural.str, allowed.str)
+    count, total, wide = _escapes.get(key, (0, 0, 0))
+    _escapes[key] = (count + 1, total + nbytes, wide + bool(kept))
+
+
+def escape_report():
+    """Operations whose result came out wider than the policy allowed, widest traffic first.
+
+    kept counts the results that were left at their wide dtype because their
+    values do not fit the policy's.
+    """
+    rows = [{'op': op, 'dtype': numpy.dtype(natural).name, 'policy_dtype': numpy.dtype(allowed).name,
+             'count': count, 'nbytes': nbytes, 'kept': kept}
+            for (op, natural, allowed), (count, nbytes, kept) in _escapes.items()]
+    return sorted(rows, key=lambda row: (-row['nbytes'], row['op']))
+
+
+def clear_escapes():
+    _escapes.clear()
+
+
+def fits(a, dtype):
+    """Whether every value of a survives a cast to dtype without wrapping or overflowing."""
+    a = numpy.asarray(a)
+    dtype = numpy.dtype(dtype)
+    if a.size == 0 or dtype.kind not in 'iufc' or numpy.can_cast(a.dtype, dtype):
+        return True
+    if dtype.kind in 'iu':
+        if a.dtype.kind not in 'iu':
+            return True
+        info = numpy.iinfo(dtype)
+        return bool(info.min <= a.min() and a.max() <= info.max)
+    largest = numpy.finfo(dtype).max
+    for part in ((a.real, a.imag) if a.dtype.kind == 'c' else (a,)):
+        # inf and nan stay what they are; only finite values can overflow
+        magnitude = numpy.abs(part)
+        if (magnitude[magnitude > largest] != numpy.inf).any():
+            return False
+    return True
+
+
+def narrow(a, dtype, op='narrow'):
+    """a cast to dtype, or a unchanged, recorded as an escape, if some value would not fit."""
+    dtype = numpy.dtype(dtype)
+    if a.dtype == dtype:
+        return a
+    if fits(a, dtype):
+        return a.astype(dtype, copy=False)
+    _escaped(op, a.dtype, dtype, a.nbytes, kept=True)
+    return a
+
+
+def check(a, op='check'):
+    """a narrowed to the policy, recording an escape if it had to be.
+
+    Values out of the policy dtype's range are never wrapped or overflowed:
+    such a result keeps its wide dtype (counted as kept in escape_report).
+    """
+    a = numpy.asanyarray(a)
+    allowed = get_policy().dtype_for(a.dtype)
+    if allowed == a.dtype:
+        return a
+    if not fits(a, allowed):
+        _escaped(op, a.dtype, allowed, a.nbytes, kept=True)
+        return a
+    _escaped(op, a.dtype, allowed, a.nbytes)
+    return a.astype(allowed)
+
+
+def _sample(arg):
+    if isinstance(arg, (numpy.ndarray, numpy.generic)):
+        return numpy.empty(0, dtype=arg.dtype)
+    if isinstance(arg, (bool, int, float, complex)):
+        return type(arg)(0)
+    return numpy.empty(0, dtype=numpy.asarray(arg).dtype)
+
+
+_natural = {}
+
+
+def natural_dtype(ufunc, *args):
+    """The dtype ufunc(*args) would produce without a policy (cached per input types)."""
+    samples = [_sample(arg) for arg in args]
+    key = (ufunc, tuple(getattr(s, 'dtype', type(s)) for s in samples))
+    dtype = _natural.get(key)
+    if dtype is None:
+        dtype = _natural[key] = ufunc(*samples).dtype
+    return dtype
+
+
+def apply(ufunc, *args, **kwargs):
+    """ufunc(*args), computed directly in the policy's dtype when it would promote past it.
+
+    An explicit dtype or out is honoured; a result wider than the policy is
+    then only reported, as kept.
+    """
+    policy = get_policy()
+    if policy is DEFAULT or ufunc.nout != 1:
+        return ufunc(*args, **kwargs)
+    if 'dtype' in kwargs or kwargs.get('out') is not None:
+        result = ufunc(*args, **kwargs)
+        allowed = policy.dtype_for(result.dtype)
+        if allowed != result.dtype:
+            _escaped(ufunc.__name__, result.dtype, allowed, result.nbytes, kept=True)
+        return result
+    natural = natural_dtype(ufunc, *args)
+    allowed = policy.dtype_for(natural)
+    # computing in the narrow dtype casts the inputs first, so they must fit it
+    if allowed != natural and all(fits(arg, allowed) for arg in args
+                                  if isinstance(arg, numpy.ndarray)):
+        kwargs['dtype'] = allowed
+    return check(ufunc(*args, **kwargs), ufunc.__name__)
+
+
+def call(function, *args, **kwargs):
+    """function(*args) for functions that take no dtype (dot, fft, argmin, ...).
+
+    Under a narrower policy a too-wide result is recorded as an escape and
+    narrowed, so everything downstream stays within the policy.
+    """
+    result = function(*args, **kwargs)
+    if get_policy() is DEFAULT or not isinstance(result, numpy.ndarray):
+        return result
+    return check(result, getattr(function, '__name__', 'call'))
+
+
+def _accumulator(dtype):
+    return ACCUMULATORS.get(numpy.dtype(dtype).kind, numpy.dtype(dtype))
+
+
+def _narrow(result, op):
+    # float/complex results come back at policy width if they fit; integer sums
+    # stay wide rather than wrap around
+    if not isinstance(result, numpy.ndarray) or result.dtype.kind not in 'fc':
+        return result
+    return narrow(result, get_policy().dtype_for(result.dtype), op)
+
+
+def policy_sum(a, axis=None):
+    """a.sum(axis) accumulated at full width; arrays come back at policy width."""
+    a = numpy.asarray(a)
+    return _narrow(a.sum(axis=axis, dtype=_accumulator(a.dtype)), 'sum')
+
+
+def policy_mean(a, axis=None):
+    a = numpy.asarray(a)
+    return _narrow(a.mean(axis=axis, dtype=_accumulator(a.dtype)), 'mean')
+
+
+def policy_cumsum(a, axis=None, out=None, block_bytes=BLOCK_BYTES):
+    """a.cumsum(axis) with a full-width running total but a policy-width result.
+
+    Only one block at a time is held at accumulator width, so the result
+    never exists as a full-size wide temporary.
+    """
+    a = numpy.asarray(a)
+    wide = _accumulator(a.dtype)
+    dtype = get_policy().dtype_for(wide) if wide.kind in 'fc' else wide
+    if axis is None:
+        a = a.reshape(-1)
+        axis = 0
+    axis = axis % a.ndim
+    own = out is None
+    if own:
+        out = numpy.empty(a.shape, dtype=dtype)
+    elif out.shape != a.shape:
+        raise ValueError("out has shape %s, expected %s" % (out.shape, a.shape))
+    carry = None
+    for chunk in iter_chunks(a, max_bytes=block_bytes):
+        running = numpy.cumsum(chunk.view, axis=axis, dtype=wide)
+        if axis == 0 and running.shape[0]:
+            if carry is not None:
+                running += carry
+            carry = running[-1].copy()
+        if own and out.dtype != wide and not fits(running, out.dtype):
+            # the totals outgrew the policy dtype: finish (and keep) the result wide
+            _escaped('cumsum', wide, out.dtype, a.size * wide.itemsize, kept=True)
+            out = out.astype(wide)
+        out[chunk.start:chunk.stop] = running
+    return out
+
+
+class PrecisionPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_escapes()
+
+    def test_default_changes_nothing(self):
+        a = numpy.ones(3, dtype='int32')
+        b = numpy.linspace(0, numpy.pi, 3)
+        self.assertEqual(apply(numpy.add, a, b).dtype, numpy.float64)
+        self.assertEqual(apply(numpy.exp, b * 1j).dtype, numpy.complex128)
+        self.assertEqual(escape_report(), [])
+
+    def test_lean_keeps_tutorial_upcasts_narrow(self):
+        a = numpy.ones(3, dtype='int32')
+        with policy('lean') as lean:
+            self.assertEqual(lean.name, 'lean')
+            b = numpy.linspace(0, numpy.pi, 3, dtype=lean.float)
+            c = apply(numpy.add, a, b)
+            self.assertEqual(c.dtype, numpy.float32)
+            numpy.testing.assert_array_almost_equal(c, a + numpy.linspace(0, numpy.pi, 3))
+            self.assertEqual(apply(numpy.exp, apply(numpy.multiply, b, 1j)).dtype, numpy.complex64)
+            self.assertEqual(apply(numpy.sin, numpy.arange(4)).dtype, numpy.float32)
+            self.assertEqual(apply(numpy.greater, b, 1).dtype, bool)
+        self.assertTrue(get_policy() is DEFAULT)
+        self.assertEqual(escape_report(), [])
+
+    def test_escapes_are_reported_and_narrowed(self):
+        with policy('lean'):
+            x = numpy.ones(8, dtype=numpy.float32)
+            product = call(numpy.dot, numpy.ones((2, 3), dtype=numpy.int32),
+                           numpy.ones((3, 2), dtype=numpy.float32))
+            index = call(numpy.argmin, numpy.ones((4, 5), dtype=numpy.float32), axis=0)
+            explicit = apply(numpy.add, x, x, dtype=numpy.float64)
+        self.assertEqual(product.dtype, numpy.float32)
+        self.assertEqual(index.dtype, numpy.int32)
+        self.assertEqual(explicit.dtype, numpy.float64)
+        report = escape_report()
+        self.assertEqual([(row['op'], row['dtype'], row['policy_dtype'], row['kept'])
+                          for row in report],
+                         [('add', 'float64', 'float32', 1), ('argmin', 'int64', 'int32', 0),
+                          ('dot', 'float64', 'float32', 0)])
+
+    def test_reductions_accumulate_wide(self):
+        x = numpy.full(10 ** 6, 0.1, dtype=numpy.float32)
+        with policy('lean'):
+            self.assertAlmostEqual(policy_sum(x), 10 ** 6 * float(numpy.float32(0.1)), places=6)
+            self.assertAlmostEqual(policy_mean(x), float(numpy.float32(0.1)), places=7)
+            grid = numpy.ones((3, 4), dtype=numpy.float32)
+            self.assertEqual(policy_sum(grid, axis=0).dtype, numpy.float32)
+            self.assertEqual(policy_sum(numpy.ones(3, dtype=numpy.int32)).dtype, numpy.int64)
+            running = policy_cumsum(x, block_bytes=4096)
+            self.assertEqual(running.dtype, numpy.float32)
+            self.assertAlmostEqual(running[-1], 10 ** 5, places=1)
+            # the naive float32 running sum drifts well away from it
+            self.assertTrue(abs(numpy.cumsum(x)[-1] - 10 ** 5) > 1)
+        a = numpy.array([[1, 2, 3], [1, 2, 3]])
+        numpy.testing.assert_array_equal(policy_cumsum(a, block_bytes=8), [1, 3, 6, 7, 9, 12])
+        numpy.testing.assert_array_equal(policy_cumsum(a, axis=1, block_bytes=8),
+                                         [[1, 3, 6], [1, 3, 6]])
+        numpy.testing.assert_array_equal(policy_cumsum(a, axis=0, block_bytes=8),
+                                         [[1, 2, 3], [2, 4, 6]])
+
+    def test_out_of_range_values_stay_wide(self):
+        big = numpy.array([2 ** 40, 3])
+        huge = numpy.array([1e300, 1.])
+        with policy('lean'):
+            self.assertTrue(fits(numpy.array([2 ** 31 - 1, -2 ** 31]), numpy.int32))
+            self.assertFalse(fits(big, numpy.int32))
+            self.assertFalse(fits(huge, numpy.float32))
+            self.assertFalse(fits(numpy.array([1j * 1e300]), numpy.complex64))
+            self.assertTrue(fits(numpy.array([numpy.inf, numpy.nan, 1e30]), numpy.float32))
+            kept = check(big)
+            numpy.testing.assert_array_equal(kept, big)
+            self.assertEqual(kept.dtype, numpy.int64)
+            self.assertEqual(check(numpy.array([5, 3])).dtype, numpy.int32)
+            shifted = apply(numpy.add, huge, 1.)
+            self.assertEqual((shifted.dtype, shifted[0]), (numpy.float64, 1e300))
+            wide = numpy.full(4, 3e38, dtype=numpy.float32)
+            self.assertEqual(policy_sum(wide.reshape(2, 2), axis=0).dtype, numpy.float64)
+            running = policy_cumsum(wide, block_bytes=8)
+            self.assertEqual(running.dtype, numpy.float64)
+            self.assertEqual(running[-1], 4 * float(numpy.float32(3e38)))
+        report = dict((row['op'], row) for row in escape_report())
+        self.assertEqual(report['check']['kept'], 1)
+        self.assertEqual(report['check']['count'], 2)
+        self.assertEqual([report[op]['kept'] for op in ('add', 'sum', 'cumsum')], [1, 1, 1])
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, set_policy, 'half')
+        self.assertTrue(get_policy() is DEFAULT)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(PrecisionPolicyTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
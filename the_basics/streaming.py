@@ -0,0 +1,243 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+from numpy.lib.format import open_memmap
+from shape_manipulation.chunking import iter_chunks
+
+# blocks of a few MiB stay cache resident while each one is reduced
+BLOCK_BYTES = 1 << 22
+
+REDUCTIONS = ('sum', 'min', 'max', 'mean')
+
+
+def open_array(source):
+    """A read-only memmap for an .npy path, anything else as an array."""
+    if isinstance(source, str):
+        return numpy.load(source, mmap_mode='r')
+    return numpy.asarray(source)
+
+
+def open_output(out, shape, dtype, exact_dtype=False):
+    """The array to write a result of shape into.
+
+    out may be an array of that shape (and of dtype too, if exact_dtype),
+    an .npy path to create, written through a memmap, or None for a new
+    in-memory array of dtype.
+    """
+    shape = tuple(shape)
+    if out is None:
+        return numpy.empty(shape, dtype=dtype)
+    if isinstance(out, str):
+        return open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+    if out.shape != shape:
+        raise ValueError("out has shape %s, expected %s" % (out.shape, shape))
+    if exact_dtype and out.dtype != numpy.dtype(dtype):
+        raise ValueError("out has dtype %s, expected %s" % (out.dtype, numpy.dtype(dtype)))
+    return out
+
+
+def _blocks(a, block_bytes):
+    if a.ndim == 0:
+        a = a.reshape(1)
+    return iter_chunks(a, max_bytes=block_bytes)
+
+
+class _KahanSum(object):
+    # compensated running sum of the per-block (pairwise) sums
+
+    def __init__(self):
+        self.total = None
+        self.compensation = None
+
+    def add(self, value):
+        if self.total is None:
+            self.total = value
+            self.compensation = numpy.zeros_like(value)
+            return
+        if not numpy.issubdtype(numpy.asarray(value).dtype, numpy.inexact):
+            self.total = self.total + value
+            return
+        y = value - self.compensation
+        t = self.total + y
+        self.compensation = (t - self.total) - y
+        self.total = t
+
+
+def streaming_reduce(source, ops=REDUCTIONS, axis=None, block_bytes=BLOCK_BYTES):
+    """Compute several of sum/min/max/mean of source in one pass over it.
+
+    source is an array or an .npy path (read through a memmap in blocks of
+    about block_bytes along the first axis). Returns a dict of results that
+    match the in-memory calls a.sum(axis), a.min(axis), ...
+    """
+    unknown = set(ops) - set(REDUCTIONS)
+    if unknown:
+        raise ValueError("unknown reductions %s, expected some of %s"
+                         % (sorted(unknown), REDUCTIONS))
+    a = open_array(source)
+    if a.size == 0:
+        raise ValueError("cannot reduce an empty array")
+    if axis is not None:
+        axis = axis % a.ndim
+    want_sum = 'sum' in ops or 'mean' in ops
+
+    if axis is None or axis == 0:
+        total, low, high = _KahanSum(), None, None
+        for chunk in _blocks(a, block_bytes):
+            block = chunk.view
+            if want_sum:
+                total.add(block.sum(axis=axis))
+            if 'min' in ops:
+                m = block.min(axis=axis)
+                low = m if low is None else numpy.minimum(low, m)
+            if 'max' in ops:
+                m = block.max(axis=axis)
+                high = m if high is None else numpy.maximum(high, m)
+        results = {'sum': total.total, 'min': low, 'max': high}
+    else:
+        # the reduced axis lies inside each block: every block fills its own rows
+        shape = a.shape[:axis] + a.shape[axis + 1:]
+        results = {}
+        for chunk in _blocks(a, block_bytes):
+            block = chunk.view
+            parts = []
+            if want_sum:
+                parts.append(('sum', block.sum(axis=axis)))
+            if 'min' in ops:
+                parts.append(('min', block.min(axis=axis)))
+            if 'max' in ops:
+                parts.append(('max', block.max(axis=axis)))
+            for name, value in parts:
+                if name not in results:
+                    results[name] = numpy.empty(shape, dtype=value.dtype)
+                results[name][chunk.start:chunk.stop] = value
+
+    count = a.size if axis is None else a.shape[axis]
+    if 'mean' in ops:
+        results['mean'] = numpy.true_divide(results['sum'], count)
+    return dict((name, results[name]) for name in ops)
+
+
+def streaming_sum(source, axis=None, block_bytes=BLOCK_BYTES):
+    return streaming_reduce(source, ('sum',), axis, block_bytes)['sum']
+
+
+def streaming_min(source, axis=None, block_bytes=BLOCK_BYTES):
+    return streaming_reduce(source, ('min',), axis, block_bytes)['min']
+
+
+def streaming_max(source, axis=None, block_bytes=BLOCK_BYTES):
+    return streaming_reduce(source, ('max',), axis, block_bytes)['max']
+
+
+def streaming_mean(source, axis=None, block_bytes=BLOCK_BYTES):
+    return streaming_reduce(source, ('mean',), axis, block_bytes)['mean']
+
+
+def streaming_cumsum(source, axis=None, out=None, block_bytes=BLOCK_BYTES):
+    """cumsum of source block by block, carrying the running total between blocks.
+
+    out is any target open_output accepts.
+    """
+    a = open_array(source)
+    if axis is not None:
+        axis = axis % a.ndim
+    dtype = numpy.zeros(1, dtype=a.dtype).cumsum().dtype
+    shape = (a.size,) if axis is None else a.shape
+    out = open_output(out, shape, dtype)
+
+    carry = None
+    flat_start = 0
+    for chunk in _blocks(a, block_bytes):
+        block = chunk.view
+        if axis is None:
+            target = out[flat_start:flat_start + block.size]
+            flat_start += block.size
+            numpy.cumsum(block.reshape(-1), dtype=dtype, out=target)
+        else:
+            target = out[chunk.start:chunk.stop]
+            numpy.cumsum(block, axis=axis, dtype=dtype, out=target)
+            if axis != 0 or target.shape[0] == 0:
+                continue
+        if target.size == 0:
+            continue
+        if carry is not None:
+            target += carry
+        carry = target[-1].copy()
+    return out
+
+
+class StreamingReductionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def save(self, a):
+        path = os.path.join(self.tmp, 'a.npy')
+        numpy.save(path, a)
+        return path
+
+    def test_tutorial_axis_reductions(self):
+        a = numpy.array([[1, 2, 3], [1, 2, 3]])
+        numpy.testing.assert_array_equal(streaming_sum(a, axis=0), [2, 4, 6])
+        numpy.testing.assert_array_equal(streaming_sum(a, axis=1), [6, 6])
+        numpy.testing.assert_array_equal(streaming_min(a, axis=0), [1, 2, 3])
+        numpy.testing.assert_array_equal(streaming_max(a, axis=1), [3, 3])
+        self.assertEqual(streaming_sum(a), 12)
+
+    def test_tutorial_cumsum(self):
+        a = numpy.array([[1, 2, 3], [1, 2, 3]])
+        numpy.testing.assert_array_equal(streaming_cumsum(a, block_bytes=1), [1, 3, 6, 7, 9, 12])
+        numpy.testing.assert_array_equal(streaming_cumsum(a, axis=1, block_bytes=1),
+                                         [[1, 3, 6], [1, 3, 6]])
+        numpy.testing.assert_array_equal(streaming_cumsum(a, axis=0, block_bytes=1),
+                                         [[1, 2, 3], [2, 4, 6]])
+
+    def test_memmapped_file_in_many_blocks(self):
+        a = numpy.random.RandomState(0).normal(size=(1000, 3, 4))
+        path = self.save(a)
+        for axis in (None, 0, 1, 2, -1):
+            results = streaming_reduce(path, axis=axis, block_bytes=1000)
+            numpy.testing.assert_allclose(results['sum'], a.sum(axis=axis), atol=1e-10)
+            numpy.testing.assert_array_equal(results['min'], a.min(axis=axis))
+            numpy.testing.assert_array_equal(results['max'], a.max(axis=axis))
+            numpy.testing.assert_allclose(results['mean'], a.mean(axis=axis), atol=1e-12)
+            numpy.testing.assert_allclose(streaming_cumsum(path, axis=axis, block_bytes=1000),
+                                          a.cumsum(axis=axis), atol=1e-10)
+
+    def test_cumsum_into_npy(self):
+        a = numpy.arange(100, dtype=numpy.int32).reshape(20, 5)
+        out = streaming_cumsum(self.save(a), axis=0, out=os.path.join(self.tmp, 'c.npy'),
+                               block_bytes=40)
+        self.assertTrue(isinstance(out, numpy.memmap))
+        numpy.testing.assert_array_equal(out, a.cumsum(axis=0))
+        self.assertEqual(out.dtype, a.cumsum(axis=0).dtype)
+
+    def test_compensated_float32_sum(self):
+        a = numpy.full(10**6, 0.1, dtype=numpy.float32)
+        total = streaming_sum(a, block_bytes=4096)
+        self.assertEqual(total.dtype, numpy.float32)
+        self.assertAlmostEqual(float(total) / a.astype(float).sum(), 1., places=6)
+
+    def test_open_output(self):
+        self.assertEqual(open_output(None, [2, 3], numpy.int16).dtype, numpy.int16)
+        out = open_output(os.path.join(self.tmp, 'o.npy'), (2, 3), float)
+        self.assertTrue(isinstance(out, numpy.memmap))
+        given = numpy.zeros((2, 3), dtype=numpy.int32)
+        self.assertTrue(open_output(given, (2, 3), float) is given)
+        self.assertRaises(ValueError, open_output, given, (3, 2), float)
+        self.assertRaises(ValueError, open_output, given, (2, 3), float, exact_dtype=True)
+
+    def test_bad_reduction(self):
+        self.assertRaises(ValueError, streaming_reduce, numpy.ones(3), ('median',))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(StreamingReductionTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
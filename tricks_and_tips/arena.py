@@ -0,0 +1,189 @@
+import unittest
+from collections import OrderedDict
+import numpy
+
+# idle buffers kept for reuse; beyond this the least recently used are dropped
+MAX_BYTES = 1 << 28
+
+
+class ScratchArena(object):
+    """Reusable temporaries for out= arguments, keyed by shape and dtype.
+
+        arena = ScratchArena()
+        for frame in frames:
+            with arena:
+                t = arena.empty(frame.shape, frame.dtype)
+                numpy.multiply(frame, 2, out=t)
+                ...
+
+    Buffers handed out inside a with block go back to the arena when it
+    exits, so the next iteration gets the same memory instead of a fresh
+    allocation (and fresh page faults). Buffers taken outside any block stay
+    with the caller until release(). Releasing a buffer twice (or one the
+    arena did not hand out) raises ValueError; one released explicitly inside
+    a with block is simply not released again when the block exits. Idle
+    buffers are capped at max_bytes, evicting the least recently used
+    shape/dtype first.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._idle = OrderedDict()
+        self._scopes = []
+        # buffers handed out and not yet released, by id
+        self._out = {}
+        self.idle_bytes = 0
+        self.in_use_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.allocated_bytes = 0
+
+    @staticmethod
+    def _key(shape, dtype):
+        if isinstance(shape, (int, numpy.integer)):
+            shape = (shape,)
+        return tuple(int(n) for n in shape), numpy.dtype(dtype).str
+
+    def empty(self, shape, dtype=float):
+        """An uninitialised buffer of this shape and dtype, reused when one is idle."""
+        key = self._key(shape, dtype)
+        idle = self._idle.get(key)
+        if idle:
+            buf = idle.pop()
+            if not idle:
+                del self._idle[key]
+            self.idle_bytes -= buf.nbytes
+            self.hits += 1
+        else:
+            buf = numpy.empty(key[0], dtype=key[1])
+            self.misses += 1
+            self.allocated_bytes += buf.nbytes
+        self.in_use_bytes += buf.nbytes
+        self._out[id(buf)] = buf
+        if self._scopes:
+            self._scopes[-1].append(buf)
+        return buf
+
+    def zeros(self, shape, dtype=float):
+        buf = self.empty(shape, dtype)
+        buf.fill(0)
+        return buf
+
+    def empty_like(self, a):
+        return self.empty(a.shape, a.dtype)
+
+    def release(self, buf):
+        """Return a buffer to the arena; the caller must not use it afterwards."""
+        if self._out.pop(id(buf), None) is not buf:
+            raise ValueError("buffer was not handed out by this arena or was already released")
+        key = self._key(buf.shape, buf.dtype)
+        self.in_use_bytes -= buf.nbytes
+        self._idle.setdefault(key, []).append(buf)
+        # the most recently returned shape/dtype is the last to be evicted
+        self._idle[key] = self._idle.pop(key)
+        self.idle_bytes += buf.nbytes
+        while self.idle_bytes > self.max_bytes and self._idle:
+            oldest = next(iter(self._idle))
+            victim = self._idle[oldest].pop(0)
+            if not self._idle[oldest]:
+                del self._idle[oldest]
+            self.idle_bytes -= victim.nbytes
+            self.evictions += 1
+
+    def __enter__(self):
+        self._scopes.append([])
+        return self
+
+    def __exit__(self, *exc_info):
+        for buf in reversed(self._scopes.pop()):
+            if self._out.get(id(buf)) is buf:
+                self.release(buf)
+        return False
+
+    def clear(self):
+        """Drop every idle buffer (buffers in use are unaffected)."""
+        self._idle.clear()
+        self.idle_bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'allocated_bytes': self.allocated_bytes, 'idle_bytes': self.idle_bytes,
+                'in_use_bytes': self.in_use_bytes}
+
+
+class ScratchArenaTest(unittest.TestCase):
+
+    def test_reuse_across_iterations(self):
+        arena = ScratchArena()
+        seen = []
+        for i in range(5):
+            with arena:
+                a = arena.empty((3, 4), numpy.float32)
+                b = arena.zeros((3, 4), numpy.float32)
+                self.assertFalse(numpy.shares_memory(a, b))
+                self.assertEqual(b.sum(), 0)
+                seen.append((id(a), id(b)))
+        self.assertEqual(len(set(seen)), 1)
+        self.assertEqual(arena.stats(), {'hits': 8, 'misses': 2, 'evictions': 0,
+                                         'allocated_bytes': 96, 'idle_bytes': 96,
+                                         'in_use_bytes': 0})
+
+    def test_keys_by_shape_and_dtype(self):
+        arena = ScratchArena()
+        with arena:
+            arena.empty(10)
+        with arena:
+            self.assertEqual(arena.empty(10, numpy.float32).dtype, numpy.float32)
+            self.assertEqual(arena.empty((2, 5)).shape, (2, 5))
+            self.assertEqual(arena.empty_like(numpy.zeros(10)).shape, (10,))
+        self.assertEqual((arena.hits, arena.misses), (1, 3))
+
+    def test_nested_scopes_and_manual_release(self):
+        arena = ScratchArena()
+        kept = arena.empty(4)
+        with arena:
+            outer = arena.empty(4)
+            with arena:
+                arena.empty(4)
+            self.assertEqual(arena.idle_bytes, 32)
+            self.assertEqual(arena.in_use_bytes, 64)
+        self.assertEqual(arena.in_use_bytes, 32)
+        arena.release(kept)
+        self.assertEqual((arena.idle_bytes, arena.in_use_bytes), (96, 0))
+        self.assertTrue(arena.empty(4) is kept)
+        self.assertTrue(arena.empty(4) is outer)
+
+    def test_double_release(self):
+        arena = ScratchArena()
+        with arena:
+            a = arena.empty(4)
+            arena.release(a)
+            self.assertRaises(ValueError, arena.release, a)
+        self.assertEqual((arena.idle_bytes, arena.in_use_bytes), (32, 0))
+        first, second = arena.empty(4), arena.empty(4)
+        self.assertFalse(first is second)
+        self.assertRaises(ValueError, arena.release, numpy.empty(4))
+
+    def test_byte_cap_evicts_least_recently_used(self):
+        arena = ScratchArena(max_bytes=200)
+        with arena:
+            arena.empty(10)
+        with arena:
+            arena.empty(5)
+        with arena:
+            arena.empty(10)
+        with arena:
+            arena.empty(12)
+        # 80 + 40 + 96 bytes idle is over the cap: the (5,) buffer, used longest ago, goes
+        self.assertEqual(arena.evictions, 1)
+        self.assertEqual(sorted(key[0] for key in arena._idle), [(10,), (12,)])
+        self.assertEqual(arena.idle_bytes, 176)
+        arena.clear()
+        self.assertEqual(arena.idle_bytes, 0)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(ScratchArenaTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
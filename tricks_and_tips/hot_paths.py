@@ -0,0 +1,92 @@
+import unittest
+import numpy
+from broadcasting.vector_quantisation import nearest_codes as plain_nearest_codes
+from fancy_indexing_and_index_tricks.mandelbrot_engine import _escape_time, mandelbrot as \
+    plain_mandelbrot
+from tricks_and_tips.arena import ScratchArena
+
+# Arena-backed versions of the tutorial hot loops. Every full-size temporary
+# comes from the arena, so calling them repeatedly inside `with arena:` blocks
+# reaches a steady state with no large allocations. Small ones remain: the
+# ogrid axes and y*1j (h + w elements) and, in mandelbrot, the indices of the
+# points escaping in each iteration. Results that are arena buffers stay valid
+# only until the enclosing block exits.
+
+
+def mandelbrot(h, w, arena, maxit=20, out=None):
+    """mandelbrot(h, w, maxit) with its scratch taken from arena; out receives the result."""
+    if out is None:
+        out = numpy.empty((h, w), dtype=int)
+    elif out.shape != (h, w):
+        raise ValueError("out has shape %s, expected %s" % (out.shape, (h, w)))
+    with arena:
+        y, x = numpy.ogrid[-1.4:1.4:h*1j, -2:0.8:w*1j]
+        c = arena.empty(h * w, complex)
+        numpy.add(x, y*1j, out=c.reshape(h, w))
+        divtime = out.reshape(-1)
+        _escape_time(c, maxit, divtime, empty=arena.empty)
+        if not numpy.may_share_memory(divtime, out):
+            out[...] = divtime.reshape(out.shape)
+    return out
+
+
+def outer_add(a, b, arena):
+    """a[:, numpy.newaxis] + b into an arena buffer."""
+    a, b = numpy.asarray(a), numpy.asarray(b)
+    out = arena.empty((a.shape[0], b.shape[0]), numpy.result_type(a, b))
+    return numpy.add(a[:, numpy.newaxis], b, out=out)
+
+
+def nearest_codes(observations, codes, arena, chunk_size=1024):
+    """(index, distance) as broadcasting.vector_quantisation.nearest_codes, in arena buffers."""
+    return plain_nearest_codes(observations, codes, chunk_size, empty=arena.empty)
+
+
+class HotPathsTest(unittest.TestCase):
+
+    def test_mandelbrot_matches_engine(self):
+        arena = ScratchArena()
+        out = numpy.empty((60, 80), dtype=int)
+        for i in range(3):
+            result = mandelbrot(60, 80, arena, maxit=30, out=out)
+        self.assertTrue(result is out)
+        numpy.testing.assert_array_equal(result, plain_mandelbrot(60, 80, maxit=30))
+        # c, z, two spares, two index buffers and the mask, allocated once
+        self.assertEqual((arena.misses, arena.hits), (7, 14))
+        numpy.testing.assert_array_equal(mandelbrot(4, 4, arena, maxit=1), numpy.ones((4, 4)))
+        self.assertEqual(arena.in_use_bytes, 0)
+
+    def test_outer_add(self):
+        arena = ScratchArena()
+        a = numpy.array([0.0, 10.0, 20.0, 30.0])
+        b = numpy.array([1.0, 2.0, 3.0])
+        for i in range(3):
+            with arena:
+                numpy.testing.assert_array_equal(outer_add(a, b, arena), a[:, numpy.newaxis] + b)
+        self.assertEqual((arena.hits, arena.misses), (2, 1))
+
+    def test_nearest_codes_steady_state(self):
+        rng = numpy.random.RandomState(0)
+        observations = rng.normal(size=(500, 3))
+        codes = rng.normal(size=(7, 3))
+        expected_index, expected_distance = plain_nearest_codes(observations, codes, chunk_size=64)
+        arena = ScratchArena()
+        for i in range(3):
+            with arena:
+                index, distance = nearest_codes(observations, codes, arena, chunk_size=64)
+                numpy.testing.assert_array_equal(index, expected_index)
+                numpy.testing.assert_array_almost_equal(distance, expected_distance)
+            if i == 0:
+                misses = arena.misses
+        self.assertEqual(arena.misses, misses)
+        with arena:
+            index, _ = nearest_codes(observations[:10].astype(numpy.float32), codes, arena)
+            numpy.testing.assert_array_equal(index, expected_index[:10])
+            index, distance = nearest_codes(observations[3], codes, arena)
+            self.assertEqual((index, distance), (expected_index[3], expected_distance[3]))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(HotPathsTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)